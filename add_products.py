@@ -112,6 +112,7 @@ def add_products():
                 products_added += 1
         
         if products_added > 0:
+            Store.bump_inventory_version(store.id)
             db.session.commit()
             print(f"Successfully added {products_added} products to the database.")
         else:
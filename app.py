@@ -149,16 +149,40 @@ migrate = Migrate(app, db)
 with app.app_context():
     # Import models so they are registered with SQLAlchemy
     # This will work now because models.py imports 'db' from 'extensions.py'
-    from models import User, Role, Store, Product, Category, Inventory, Sale, SaleItem, Customer, Payment, Supplier, ProductTemplate, LabelTemplate, HardwareConfiguration
+    from models import User, Role, Store, Product, Category, Inventory, Sale, SaleItem, Customer, Payment, Supplier, ProductTemplate, LabelTemplate, HardwareConfiguration, SalesRollup, SyncTombstone, ImportJob, BarcodeSequence
     # Added missing models to the import list based on models.py
 
     # Create all tables if they don't exist
     db.create_all()
 
+    # Create the product search index and the triggers that maintain it
+    from product_search import init_search_index
+    init_search_index()
+
     # Import routes after DB initialization
     from routes import register_routes
     register_routes(app)
 
+    # Register the `flask rollups` maintenance commands
+    from rollups import register_commands
+    register_commands(app)
+
+    # Record deletions for offline tills and register the `flask sync` commands
+    import delta_sync
+    delta_sync.register_commands(app)
+
+    # Register the `flask query-plans` index regression check
+    import query_plans
+    query_plans.register_commands(app)
+
+    # Register the `flask products` bulk import commands
+    import product_import
+    product_import.register_commands(app)
+
+    # Register the `flask imports` background import job commands
+    import import_jobs
+    import_jobs.register_commands(app)
+
 # Configure M-Pesa credentials
 app.config["MPESA_CONSUMER_KEY"] = os.environ.get("MPESA_CONSUMER_KEY", "")
 app.config["MPESA_CONSUMER_SECRET"] = os.environ.get("MPESA_CONSUMER_SECRET", "")
@@ -0,0 +1,105 @@
+"""
+Collision-free EAN-13 barcode allocation.
+
+Products without a manufacturer barcode get an in-store code built from
+``BARCODE_PREFIX``, a zero-padded item reference and the EAN-13 check digit.
+Item references come from a ``BarcodeSequence`` row per prefix instead of
+being drawn at random:
+
+1. A request for n codes reserves the next n references with a single
+   ``UPDATE ... RETURNING`` of the sequence row, so concurrent allocations
+   never receive the same block
+2. One indexed range query over ``Product.barcode`` finds codes in the block
+   that are already taken (typed in by hand, or left by the old random
+   generator); they are skipped and the shortfall is reserved the same way
+3. An import can therefore allocate thousands of codes with two statements
+   rather than a lookup per code
+
+The reservation happens in the caller's transaction: a rolled-back import
+releases its block, and the sequence row stays locked until the caller commits.
+"""
+
+from typing import Iterable, List
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import BarcodeSequence, Product
+
+BARCODE_PREFIX = "616"  # GS1 Kenya
+EAN13_DATA_DIGITS = 12  # digits before the check digit
+
+
+class BarcodeAllocationError(Exception):
+    """Exception raised when a prefix has no item references left."""
+    pass
+
+
+def ean13_check_digit(digits: str) -> str:
+    """Return the check digit for the 12 data digits of an EAN-13 code (weights 1, 3, 1, ...)."""
+    total = sum(int(digit) * (3 if index % 2 else 1) for index, digit in enumerate(digits))
+    return str((10 - total % 10) % 10)
+
+
+def ean13(prefix: str, reference: int) -> str:
+    """Build the EAN-13 code for an item reference under a prefix."""
+    digits = f"{prefix}{reference:0{EAN13_DATA_DIGITS - len(prefix)}d}"
+    return digits + ean13_check_digit(digits)
+
+
+def _reserve(prefix: str, count: int) -> int:
+    """Reserve ``count`` consecutive item references; returns the first."""
+    statement = (
+        update(BarcodeSequence)
+        .where(BarcodeSequence.prefix == prefix)
+        .values(next_value=BarcodeSequence.next_value + count)
+        .returning(BarcodeSequence.next_value)
+        .execution_options(synchronize_session=False)
+    )
+    end = db.session.execute(statement).scalar()
+    if end is None:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(BarcodeSequence).values(prefix=prefix, next_value=0))
+        except IntegrityError:
+            pass  # Created by a concurrent allocation
+        end = db.session.execute(statement).scalar()
+
+    if end > 10 ** (EAN13_DATA_DIGITS - len(prefix)):
+        raise BarcodeAllocationError(f"No barcodes left under prefix {prefix}")
+    return end - count
+
+
+def allocate_barcodes(count: int, prefix: str = BARCODE_PREFIX, exclude: Iterable[str] = ()) -> List[str]:
+    """
+    Allocate unused EAN-13 barcodes.
+
+    Args:
+        count: Number of codes wanted
+        prefix: Leading digits of every code
+        exclude: Codes to treat as taken, such as barcodes of rows not yet inserted
+
+    Returns:
+        ``count`` distinct codes in allocation order
+
+    Raises:
+        BarcodeAllocationError: If the prefix runs out of item references
+    """
+    excluded = set(exclude)
+    codes: List[str] = []
+    while len(codes) < count:
+        needed = count - len(codes)
+        start = _reserve(prefix, needed)
+        block = [ean13(prefix, reference) for reference in range(start, start + needed)]
+        # Codes sort in reference order, so the block is one index range
+        taken = set(db.session.execute(
+            select(Product.barcode).where(Product.barcode.between(block[0], block[-1]))
+        ).scalars())
+        codes.extend(code for code in block if code not in taken and code not in excluded)
+    return codes
+
+
+def allocate_barcode(prefix: str = BARCODE_PREFIX) -> str:
+    """Allocate a single unused EAN-13 barcode."""
+    return allocate_barcodes(1, prefix)[0]
@@ -0,0 +1,120 @@
+"""
+Checkout latency against basket size.
+
+Builds the app's routes on a scratch SQLite database seeded the way
+``flask query-plans check`` seeds it (``query_plans.seed_database``), so the
+sales, sale line and payment tables have a realistic size. It then times
+``POST /pos/checkout`` through the test client for each basket size and
+prints the median and p95. The live database is never touched.
+
+Run from the repository root::
+
+    python -m benchmarks.checkout --sales 200000 --basket-sizes 1,5,20,50,100 --runs 20
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from flask import Flask
+from sqlalchemy import text
+
+from extensions import db
+from query_plans import SEED_STORES, seed_database
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STORE_ID = 1
+CASHIER_ID = 1  # seed_database records every sale as user 1
+
+
+def create_app(database_uri: str) -> Flask:
+    """Create an app with the POS routes bound to ``database_uri``."""
+    app = Flask("app", root_path=REPO_ROOT)
+    app.secret_key = "checkout-benchmark"
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=database_uri,
+        SQLALCHEMY_ENGINE_OPTIONS={"connect_args": {"check_same_thread": False}},
+        ENABLE_TIMS=False,  # Only time the checkout itself
+        TESTING=True
+    )
+    db.init_app(app)
+
+    import models  # noqa: F401  Registers the tables
+    from routes import register_routes
+
+    with app.app_context():
+        register_routes(app)
+    return app
+
+
+def seed_till(connection) -> None:
+    """Add the stores, the cashier and enough stock that no basket runs out."""
+    connection.execute(text("INSERT INTO role (id, name) VALUES (1, 'cashier')"))
+    connection.execute(
+        text("INSERT INTO user (id, username, email, password_hash, is_active, role_id, store_id) "
+             "VALUES (:id, 'bench', 'bench@example.com', '-', 1, 1, :store_id)"),
+        {"id": CASHIER_ID, "store_id": STORE_ID}
+    )
+    for store_id in range(1, SEED_STORES + 1):
+        connection.execute(
+            text("INSERT INTO store (id, name, inventory_version) VALUES (:id, :name, 0)"),
+            {"id": store_id, "name": f"Store {store_id}"}
+        )
+    connection.execute(text("UPDATE inventory SET quantity = 1000000 WHERE store_id = :store_id"), {"store_id": STORE_ID})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Time POST /pos/checkout against basket size.")
+    parser.add_argument("--sales", type=int, default=200000, help="Sales in the seeded database (default 200000).")
+    parser.add_argument("--basket-sizes", default="1,5,20,50,100",
+                        help="Comma-separated numbers of lines per basket (default 1,5,20,50,100).")
+    parser.add_argument("--runs", type=int, default=20, help="Checkouts per basket size (default 20).")
+    args = parser.parse_args()
+    try:
+        sizes = [int(size) for size in args.basket_sizes.split(",")]
+    except ValueError:
+        parser.error("--basket-sizes expects comma-separated integers")
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_app(f"sqlite:///{os.path.join(directory, 'checkout.db')}")
+        with app.app_context():
+            started = time.perf_counter()
+            seed_database(db.engine, args.sales)
+            with db.engine.begin() as connection:
+                seed_till(connection)
+            print(f"Seeded {args.sales:,} sales in {time.perf_counter() - started:.1f}s")
+
+            client = app.test_client()
+            with client.session_transaction() as client_session:
+                client_session["user_id"] = CASHIER_ID
+                client_session["store_id"] = STORE_ID
+
+            for size in sizes:
+                payload = {
+                    "items": [
+                        {"product_id": product_id, "quantity": 1, "unit_price": 100, "tax_rate": 16, "total_price": 116}
+                        for product_id in range(1, size + 1)
+                    ],
+                    "payment_method": "cash",
+                    "subtotal": 100 * size, "tax_amount": 16 * size, "total_amount": 116 * size
+                }
+                client.post("/pos/checkout", json=payload)  # Warm up caches and statements
+                timings = []
+                for _ in range(args.runs):
+                    started = time.perf_counter()
+                    response = client.post("/pos/checkout", json=payload)
+                    timings.append((time.perf_counter() - started) * 1000)
+                    if response.status_code != 200:
+                        raise SystemExit(f"Checkout failed with {response.status_code}: {response.get_data(as_text=True)}")
+                timings.sort()
+                print(f"{size:>5} lines: median {statistics.median(timings):7.1f} ms, "
+                      f"p95 {timings[max(0, round(len(timings) * 0.95) - 1)]:7.1f} ms")
+
+            db.session.remove()
+            db.engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
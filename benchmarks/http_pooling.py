@@ -0,0 +1,125 @@
+"""
+Per-call ``requests.post`` against the pooled session from ``http_client``.
+
+Starts a local keep-alive TLS stub and times the same POST both ways. New
+connections can be given an artificial delay to stand in for the network
+round trips of a real TCP and TLS handshake.
+
+Run from the repository root::
+
+    python -m benchmarks.http_pooling --requests 200 --connect-delay-ms 20
+"""
+
+import argparse
+import ipaddress
+import os
+import ssl
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from http_client import create_session
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Keep-alive JSON endpoint."""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # Headers and body are written separately
+
+    def setup(self):
+        super().setup()
+        # Stands in for the network round trips of a new TCP and TLS connection
+        time.sleep(self.server.connect_delay)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        payload = b'{"ResponseCode": "0"}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def write_localhost_certificate(directory: str) -> tuple:
+    """Write a self-signed certificate for 127.0.0.1; returns (cert path, key path)."""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(x509.oid.NameOID.COMMON_NAME, "127.0.0.1")])
+    now = datetime.utcnow()
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(minutes=1))
+        .not_valid_after(now + timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path, key_path = os.path.join(directory, "stub.crt"), os.path.join(directory, "stub.key")
+    with open(cert_path, "wb") as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ))
+    return cert_path, key_path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--requests", dest="count", type=int, default=200, help="Calls per client (default 200).")
+    parser.add_argument("--connect-delay-ms", type=float, default=0,
+                        help="Simulated network delay added to every new connection (default 0).")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert_path, key_path = write_localhost_certificate(directory)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert_path, key_path)
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        server.connect_delay = args.connect_delay_ms / 1000
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="http-stub", daemon=True).start()
+        url = f"https://127.0.0.1:{server.server_port}/stkpush"
+
+        def timed(post):
+            timings = []
+            for _ in range(args.count):
+                started = time.perf_counter()
+                post(url, json={"Amount": 1}, verify=cert_path, timeout=(5, 10)).raise_for_status()
+                timings.append((time.perf_counter() - started) * 1000)
+            return statistics.median(timings), sum(timings)
+
+        try:
+            per_call = timed(requests.post)
+            session = create_session()
+            pooled = timed(session.post)
+            session.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    for label, (median, total) in (("per-call requests.post", per_call), ("pooled session", pooled)):
+        print(f"{label:>24}: median {median:6.2f} ms, {args.count} calls in {total / 1000:.2f}s")
+    print(f"Pooled session is {per_call[0] / pooled[0]:.1f}x faster per call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+In-process product catalogue cache.
+
+Each store's catalogue (its products joined to the store's inventory) is held
+as a snapshot of parallel arrays rather than ORM objects, so a few thousand
+products cost a few hundred kilobytes and reading them needs no database
+round trip beyond a version check.
+
+Snapshots are keyed on ``Store.inventory_version``:
+
+1. Product edits, imports and inventory clears bump the version, and the next
+   read rebuilds the snapshot with one query
+2. Checkouts and voids patch the quantities of a cached snapshot in place of a
+   rebuild, when the snapshot is exactly one version behind the change
+3. Snapshots are never mutated; a patch replaces the quantity array, so readers
+   iterating an older snapshot are unaffected
+"""
+
+import threading
+from array import array
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy import select
+
+from extensions import db
+from models import Inventory, Product, Store
+
+# store_id -> CatalogueSnapshot
+_catalogue_cache: Dict[int, "CatalogueSnapshot"] = {}
+_catalogue_cache_lock = threading.Lock()
+_catalogue_cache_stats = {"hits": 0, "misses": 0, "patches": 0}
+
+
+class CatalogueSnapshot:
+    """A store's catalogue at one inventory version, stored column-wise."""
+
+    __slots__ = (
+        "store_id", "version", "ids", "names", "skus", "barcodes", "prices",
+        "tax_rates", "category_ids", "active", "quantities", "reorder_levels", "positions"
+    )
+
+    def __init__(self, store_id: int, version: int, rows: List):
+        self.store_id = store_id
+        self.version = version
+        self.ids = array("q")
+        self.names: List[str] = []
+        self.skus: List[Optional[str]] = []
+        self.barcodes: List[Optional[str]] = []
+        self.prices = array("d")
+        self.tax_rates = array("d")
+        self.category_ids = array("q")  # 0 when uncategorised
+        self.active = array("b")
+        self.quantities = array("q")
+        self.reorder_levels = array("q")
+
+        for (product_id, name, sku, barcode, price, tax_rate, category_id,
+             is_active, quantity, reorder_level) in rows:
+            self.ids.append(product_id)
+            self.names.append(name)
+            self.skus.append(sku)
+            self.barcodes.append(barcode)
+            self.prices.append(price or 0.0)
+            self.tax_rates.append(tax_rate or 0.0)
+            self.category_ids.append(category_id or 0)
+            self.active.append(1 if is_active else 0)
+            self.quantities.append(quantity or 0)
+            self.reorder_levels.append(reorder_level or 0)
+
+        self.positions = {product_id: index for index, product_id in enumerate(self.ids)}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def entries(self, active_only: bool = True) -> Iterator["CatalogueEntry"]:
+        """Yield a lightweight view of each product, in name order."""
+        for index in range(len(self.ids)):
+            if active_only and not self.active[index]:
+                continue
+            yield CatalogueEntry(self, index)
+
+    def as_json(self, active_only: bool = True) -> List[Dict]:
+        """Return the products in the shape served by ``/api/products``."""
+        return [
+            {
+                "id": self.ids[index],
+                "name": self.names[index],
+                "barcode": self.barcodes[index],
+                "price": self.prices[index],
+                "price_with_tax": self.prices[index] * (1 + self.tax_rates[index] / 100),
+                "tax_rate": self.tax_rates[index],
+                "quantity_available": self.quantities[index],
+            }
+            for index in range(len(self.ids))
+            if not active_only or self.active[index]
+        ]
+
+    def with_stock_changes(self, deltas: Dict[int, int], version: int) -> "CatalogueSnapshot":
+        """Return a copy at ``version`` with quantities adjusted by ``deltas``."""
+        patched = object.__new__(CatalogueSnapshot)
+        for name in CatalogueSnapshot.__slots__:
+            setattr(patched, name, getattr(self, name))
+        patched.version = version
+        patched.quantities = array("q", self.quantities)
+        for product_id, delta in deltas.items():
+            index = self.positions.get(product_id)
+            if index is not None:
+                patched.quantities[index] += delta
+        return patched
+
+
+class CatalogueEntry:
+    """Read-only view of one product in a snapshot, attribute-compatible with templates."""
+
+    __slots__ = ("_snapshot", "_index")
+
+    def __init__(self, snapshot: CatalogueSnapshot, index: int):
+        self._snapshot = snapshot
+        self._index = index
+
+    id = property(lambda self: self._snapshot.ids[self._index])
+    name = property(lambda self: self._snapshot.names[self._index])
+    sku = property(lambda self: self._snapshot.skus[self._index])
+    barcode = property(lambda self: self._snapshot.barcodes[self._index])
+    selling_price = property(lambda self: self._snapshot.prices[self._index])
+    tax_rate = property(lambda self: self._snapshot.tax_rates[self._index])
+    category_id = property(lambda self: self._snapshot.category_ids[self._index] or None)
+    is_active = property(lambda self: bool(self._snapshot.active[self._index]))
+    quantity = property(lambda self: self._snapshot.quantities[self._index])
+    reorder_level = property(lambda self: self._snapshot.reorder_levels[self._index])
+
+    @property
+    def price_with_tax(self) -> float:
+        return self.selling_price * (1 + self.tax_rate / 100)
+
+
+def build_catalogue(store_id: int, fallback_version: int) -> CatalogueSnapshot:
+    """
+    Load a store's catalogue from the database.
+
+    The store's inventory version is selected in the same statement as the
+    rows, so the snapshot is stamped with the version its quantities belong
+    to even when a checkout commits while it loads. ``fallback_version`` is
+    only used for a store with no inventory rows.
+    """
+    version = select(Store.inventory_version).where(Store.id == store_id).scalar_subquery()
+    statement = (
+        select(
+            Product.id, Product.name, Product.sku, Product.barcode, Product.selling_price,
+            Product.tax_rate, Product.category_id, Product.is_active,
+            Inventory.quantity, Inventory.reorder_level, version
+        )
+        .join(Inventory, Inventory.product_id == Product.id)
+        .where(Inventory.store_id == store_id)
+        .order_by(Product.name, Product.id)
+    )
+    rows = db.session.execute(statement).all()
+    version = (rows[0][-1] or 0) if rows else fallback_version
+    return CatalogueSnapshot(store_id, version, [row[:-1] for row in rows])
+
+
+def get_catalogue(store_id: int) -> CatalogueSnapshot:
+    """
+    Return a store's catalogue, reusing the cached snapshot while stock is unchanged.
+
+    Args:
+        store_id: Store whose catalogue is wanted
+
+    Returns:
+        CatalogueSnapshot at the store's current inventory version
+    """
+    version = Store.get_inventory_version(store_id)
+
+    with _catalogue_cache_lock:
+        cached = _catalogue_cache.get(store_id)
+        if cached is not None and cached.version == version:
+            _catalogue_cache_stats["hits"] += 1
+            return cached
+        _catalogue_cache_stats["misses"] += 1
+
+    snapshot = build_catalogue(store_id, version)
+
+    with _catalogue_cache_lock:
+        cached = _catalogue_cache.get(store_id)
+        if cached is None or cached.version <= snapshot.version:
+            _catalogue_cache[store_id] = snapshot
+
+    return snapshot
+
+
+def apply_stock_changes(store_id: int, deltas: Dict[int, int], version: int) -> bool:
+    """
+    Patch the cached snapshot after a committed stock change.
+
+    Only a snapshot exactly one version behind is patched; anything else
+    (another worker's change in between, or a snapshot already reloaded with
+    this change) is left for the next read to reconcile by version.
+
+    Args:
+        store_id: Store whose stock changed
+        deltas: Quantity change per product id
+        version: Inventory version the change was committed at
+
+    Returns:
+        True if the cached snapshot was patched
+    """
+    with _catalogue_cache_lock:
+        cached = _catalogue_cache.get(store_id)
+        if cached is None or cached.version != version - 1:
+            return False
+        _catalogue_cache[store_id] = cached.with_stock_changes(deltas, version)
+        _catalogue_cache_stats["patches"] += 1
+        return True
+
+
+def get_catalogue_cache_stats() -> Dict:
+    """
+    Get statistics about the catalogue cache.
+
+    Returns:
+        Dictionary with cache hits, misses, in-place patches and the number of
+        cached stores and products
+    """
+    with _catalogue_cache_lock:
+        return {
+            "hits": _catalogue_cache_stats["hits"],
+            "misses": _catalogue_cache_stats["misses"],
+            "patches": _catalogue_cache_stats["patches"],
+            "cached_stores": len(_catalogue_cache),
+            "cached_products": sum(len(snapshot) for snapshot in _catalogue_cache.values())
+        }
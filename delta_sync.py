@@ -0,0 +1,202 @@
+"""
+Delta sync for the offline POS cache.
+
+Tills keep the catalogue and customer book in IndexedDB. Instead of
+re-downloading both on every refresh they send back the watermark from their
+last sync and receive only what changed since:
+
+1. Rows are selected on ``updated_at`` (product, the store's inventory row,
+   customer), looking back ``SYNC_OVERLAP`` to cover transactions that were
+   still in flight when the previous watermark was taken
+2. Deletions come from ``SyncTombstone`` rows written by mapper events; a
+   deactivated product is reported as deleted too, since tills only hold
+   active products
+3. Rows are encoded column-wise: field names once, then one array per row
+
+A missing, malformed or expired watermark (older than ``TOMBSTONE_RETENTION``,
+or taken for a different store) gets a full snapshot with ``full`` set, and
+the till replaces its copy.
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import click
+from sqlalchemy import event, insert, or_, select, union
+
+from extensions import db
+from models import Customer, Inventory, Product, SyncTombstone
+
+SYNC_OVERLAP = timedelta(seconds=10)
+TOMBSTONE_RETENTION = timedelta(days=30)
+
+PRODUCT_FIELDS = ["id", "name", "barcode", "price", "price_with_tax", "tax_rate", "quantity_available"]
+CUSTOMER_FIELDS = ["id", "name", "phone", "email", "loyalty_points"]
+
+_WATERMARK_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+def encode_watermark(scope: str, moment: datetime) -> str:
+    return f"{scope}:{moment.strftime(_WATERMARK_FORMAT)}"
+
+
+def decode_watermark(watermark: Optional[str], scope: str, now: datetime) -> Optional[datetime]:
+    """
+    Return the moment a watermark was taken, or None if the till needs a full sync.
+    """
+    if not watermark:
+        return None
+    watermark_scope, _, moment = watermark.partition(":")
+    if watermark_scope != scope:
+        return None
+    try:
+        since = datetime.strptime(moment, _WATERMARK_FORMAT)
+    except ValueError:
+        return None
+    if since > now or since < now - TOMBSTONE_RETENTION:
+        return None
+    return since
+
+
+def _deleted_ids(entity: str, since: datetime, store_id: Optional[int] = None) -> List[int]:
+    statement = select(SyncTombstone.entity_id).where(
+        SyncTombstone.entity == entity, SyncTombstone.deleted_at > since
+    )
+    if store_id is not None:
+        statement = statement.where(or_(SyncTombstone.store_id.is_(None), SyncTombstone.store_id == store_id))
+    return sorted(set(db.session.execute(statement).scalars()))
+
+
+def _response(scope: str, now: datetime, full: bool, fields: List[str], rows: List[List], deleted: List[int]) -> Dict:
+    return {
+        "watermark": encode_watermark(scope, now),
+        "full": full,
+        "fields": fields,
+        "rows": rows,
+        "deleted": deleted,
+    }
+
+
+def product_changes(store_id: int, watermark: Optional[str] = None) -> Dict:
+    """
+    Products stocked in a store that changed since a watermark.
+
+    Args:
+        store_id: Store whose catalogue the till holds
+        watermark: Watermark returned by the previous sync, if any
+
+    Returns:
+        Dictionary with the new ``watermark``, ``full``, ``fields``, ``rows``
+        in ``fields`` order and ``deleted`` product ids
+    """
+    now = datetime.utcnow()
+    scope = str(store_id)
+    since = decode_watermark(watermark, scope, now)
+
+    statement = (
+        select(
+            Product.id, Product.name, Product.barcode, Product.selling_price, Product.tax_rate,
+            Product.is_active, Inventory.quantity
+        )
+        .join(Inventory, Inventory.product_id == Product.id)
+        .where(Inventory.store_id == store_id)
+        .order_by(Product.id)
+    )
+    deleted: List[int] = []
+    if since is not None:
+        cutoff = since - SYNC_OVERLAP
+        # Separate index lookups on each table rather than an OR across the join
+        changed = union(
+            select(Product.id).where(Product.updated_at > cutoff),
+            select(Inventory.product_id).where(Inventory.store_id == store_id, Inventory.updated_at > cutoff)
+        )
+        statement = statement.where(Product.id.in_(select(changed.subquery())))
+        deleted = _deleted_ids("product", cutoff, store_id)
+
+    rows = []
+    for product_id, name, barcode, price, tax_rate, is_active, quantity in db.session.execute(statement):
+        if not is_active:
+            if since is not None:
+                deleted.append(product_id)
+            continue
+        price = price or 0.0
+        tax_rate = tax_rate or 0.0
+        rows.append([product_id, name, barcode, price, price * (1 + tax_rate / 100), tax_rate, quantity])
+
+    # A product removed and then restocked since the watermark is sent as a row only
+    restocked = {row[0] for row in rows}
+    deleted = sorted(set(deleted) - restocked)
+    return _response(scope, now, since is None, PRODUCT_FIELDS, rows, deleted)
+
+
+def customer_changes(watermark: Optional[str] = None) -> Dict:
+    """
+    Customers that changed since a watermark.
+
+    Args:
+        watermark: Watermark returned by the previous sync, if any
+
+    Returns:
+        Dictionary in the same form as ``product_changes``
+    """
+    now = datetime.utcnow()
+    since = decode_watermark(watermark, "customers", now)
+
+    statement = select(
+        Customer.id, Customer.name, Customer.phone, Customer.email, Customer.loyalty_points
+    ).order_by(Customer.id)
+    deleted: List[int] = []
+    if since is not None:
+        cutoff = since - SYNC_OVERLAP
+        statement = statement.where(Customer.updated_at > cutoff)
+        deleted = _deleted_ids("customer", cutoff)
+
+    rows = [list(row) for row in db.session.execute(statement)]
+    return _response("customers", now, since is None, CUSTOMER_FIELDS, rows, deleted)
+
+
+def prune_tombstones(older_than: timedelta = TOMBSTONE_RETENTION) -> int:
+    """Delete tombstones no watermark can still need; returns how many were removed."""
+    result = db.session.execute(
+        SyncTombstone.__table__.delete().where(SyncTombstone.deleted_at < datetime.utcnow() - older_than)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def _tombstone(connection, entity: str, entity_id: int, store_id: Optional[int] = None) -> None:
+    connection.execute(insert(SyncTombstone.__table__).values(
+        entity=entity, entity_id=entity_id, store_id=store_id, deleted_at=datetime.utcnow()
+    ))
+
+
+# ORM deletes write their tombstone in the same transaction as the delete
+@event.listens_for(Product, "after_delete")
+def _product_deleted(mapper, connection, target):
+    _tombstone(connection, "product", target.id)
+
+
+@event.listens_for(Inventory, "after_delete")
+def _inventory_deleted(mapper, connection, target):
+    _tombstone(connection, "product", target.product_id, target.store_id)
+
+
+@event.listens_for(Customer, "after_delete")
+def _customer_deleted(mapper, connection, target):
+    _tombstone(connection, "customer", target.id)
+
+
+def register_commands(app) -> None:
+    """Register the ``flask sync`` CLI commands."""
+
+    @app.cli.group("sync")
+    def sync_cli():
+        """Manage offline delta sync."""
+
+    @sync_cli.command("prune-tombstones")
+    @click.option("--days", type=int, default=TOMBSTONE_RETENTION.days, show_default=True,
+                  help="Keep tombstones newer than this many days.")
+    def prune_command(days):
+        """Delete expired deletion tombstones."""
+        removed = prune_tombstones(timedelta(days=days))
+        click.echo(f"Removed {removed} tombstones")
@@ -19,8 +19,12 @@ import hmac
 import json
 import logging
 import os
+import random
+import sqlite3
+import threading
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from io import BytesIO
 from typing import Dict, List, Optional, Tuple, Union, cast
@@ -35,16 +39,30 @@ from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.primitives.serialization import pkcs12
 from flask import current_app, g, session
 
+from http_client import create_session
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # eTIMS API configuration
 ETIMS_API_TIMEOUT = 10  # seconds
-OFFLINE_QUEUE_FILE = "instance/etims_offline_queue.json"
+ETIMS_CONNECT_TIMEOUT = 5  # seconds
+ETIMS_TIMEOUT = (ETIMS_CONNECT_TIMEOUT, ETIMS_API_TIMEOUT)
+OFFLINE_QUEUE_DB = "instance/etims_offline_queue.db"
+OFFLINE_QUEUE_FILE = "instance/etims_offline_queue.json"  # Legacy JSON queue, migrated on first use
+OFFLINE_QUEUE_WORKERS = 4  # concurrent transmissions while draining the queue
+OFFLINE_QUEUE_MAX_ATTEMPTS = 8  # retry budget per invoice
+OFFLINE_QUEUE_BACKOFF_BASE = 30  # seconds before the first retry
+OFFLINE_QUEUE_BACKOFF_MAX = 3600  # upper bound on the retry delay
+OFFLINE_QUEUE_CLAIM_TIMEOUT = 300  # seconds before an abandoned in-flight invoice is retried
 CERTIFICATE_PATH = "instance/etims_certificate.p12"
 
 
+# Pooled keep-alive session shared by all eTIMS calls, including the queue drain workers
+_session = create_session(pool_size=max(OFFLINE_QUEUE_WORKERS * 2, 10))
+
+
 class ETIMSError(Exception):
     """Exception raised for eTIMS-related errors."""
 
@@ -83,6 +101,86 @@ def load_certificate(certificate_path: str, password: str) -> Tuple:
         raise ETIMSError(f"Certificate loading error: {str(e)}")
 
 
+# Parsed certificates keyed on (path, password digest). Each entry remembers the
+# file's mtime and size so a replaced certificate file is picked up automatically.
+_certificate_cache: Dict[Tuple[str, str], Tuple[Tuple[int, int], Tuple]] = {}
+_certificate_cache_lock = threading.Lock()
+_certificate_cache_stats = {"loads": 0, "hits": 0, "invalidations": 0}
+
+
+def load_certificate_cached(certificate_path: str, password: str) -> Tuple:
+    """
+    Load a PKCS#12 certificate, reusing the parsed result while the file is unchanged.
+    
+    PKCS#12 decryption runs a deliberately slow key derivation, so the parsed
+    key and certificate are kept for the life of the process and only reloaded
+    when the file's mtime or size changes or the cache is invalidated.
+    
+    Args:
+        certificate_path: Path to .p12 or .pfx certificate file
+        password: Password to decrypt the certificate
+        
+    Returns:
+        Tuple of (private key, certificate, CA certificates)
+    """
+    if not certificate_path or not password:
+        raise ETIMSError("Certificate path and password must be provided")
+    
+    try:
+        stat = os.stat(certificate_path)
+    except OSError as e:
+        logger.error(f"Failed to load certificate: {str(e)}")
+        raise ETIMSError(f"Certificate loading error: {str(e)}")
+    
+    key = (os.path.abspath(certificate_path), hashlib.sha256(password.encode()).hexdigest())
+    file_version = (stat.st_mtime_ns, stat.st_size)
+    
+    with _certificate_cache_lock:
+        cached = _certificate_cache.get(key)
+        if cached and cached[0] == file_version:
+            _certificate_cache_stats["hits"] += 1
+            return cached[1]
+        
+        result = load_certificate(certificate_path, password)
+        _certificate_cache[key] = (file_version, result)
+        _certificate_cache_stats["loads"] += 1
+        return result
+
+
+def invalidate_certificate_cache(certificate_path: Optional[str] = None) -> None:
+    """
+    Drop cached certificates so the next use reloads them from disk.
+    
+    Args:
+        certificate_path: Only drop entries for this file; drops everything if omitted
+    """
+    with _certificate_cache_lock:
+        if certificate_path is None:
+            _certificate_cache.clear()
+        else:
+            path = os.path.abspath(certificate_path)
+            for key in [key for key in _certificate_cache if key[0] == path]:
+                del _certificate_cache[key]
+        _certificate_cache_stats["invalidations"] += 1
+
+
+def get_certificate_cache_stats() -> Dict:
+    """
+    Get statistics about the certificate cache.
+    
+    Returns:
+        Dictionary with the number of PKCS#12 loads performed, the number of
+        loads saved by cache hits, and the number of invalidations
+    """
+    with _certificate_cache_lock:
+        return {
+            "loads": _certificate_cache_stats["loads"],
+            "loads_saved": _certificate_cache_stats["hits"],
+            "invalidations": _certificate_cache_stats["invalidations"],
+            "cached_certificates": len(_certificate_cache)
+        }
+
+
 def sign_invoice_data(data: str, private_key) -> str:
     """
     Digitally sign invoice data using the private key.
@@ -206,10 +304,10 @@ def format_invoice_data(sale, store, products, tax_pin: str, device_id: str) ->
                     "itemName": getattr(product, 'name', 'Unknown Product'),
                     "quantity": float(item.quantity),
                     "unitPrice": float(item.unit_price),
-                    "taxRate": float(item.tax_rate) if hasattr(item, 'tax_rate') else 0,
-                    "taxAmount": float(item.unit_price * item.quantity * (item.tax_rate / 100)) if hasattr(item, 'tax_rate') else 0,
-                    "discountAmount": float(item.discount_amount) if hasattr(item, 'discount_amount') and item.discount_amount else 0,
-                    "lineTotal": float(item.total_price)
+                    "taxRate": float(item.tax_rate_applied or 0),
+                    "taxAmount": float(item.unit_price * item.quantity * ((item.tax_rate_applied or 0) / 100)),
+                    "discountAmount": float(item.discount_amount_applied or 0),
+                    "lineTotal": float(item.line_total)
                 }
                 invoice_data["items"].append(product_data)
         else:
@@ -286,11 +384,11 @@ def transmit_invoice(
         }
         
         # Send to KRA eTIMS API
-        response = requests.post(
+        response = _session.post(
             f"{api_url.rstrip('/')}/invoices",
             data=invoice_json,
             headers=headers,
-            timeout=ETIMS_API_TIMEOUT
+            timeout=ETIMS_TIMEOUT
         )
         
         # Check for success (KRA typically returns 200-202 for success)
@@ -308,6 +406,152 @@ def transmit_invoice(
         raise ETIMSError(f"Communication error with eTIMS API: {str(e)}")
 
 
+# Offline queue storage. Each invoice is one row, so enqueueing and status
+# updates touch a single row, and per-status counts are kept current by
+# triggers so that statistics never scan the queue.
+_QUEUE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS offline_queue (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    reference TEXT,
+    timestamp TEXT NOT NULL,
+    invoice_data TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    transmission_time TEXT,
+    response TEXT,
+    error TEXT,
+    last_attempt TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    claimed_at REAL
+);
+CREATE INDEX IF NOT EXISTS ix_offline_queue_status ON offline_queue (status, seq);
+CREATE INDEX IF NOT EXISTS ix_offline_queue_reference ON offline_queue (reference);
+CREATE INDEX IF NOT EXISTS ix_offline_queue_due ON offline_queue (status, next_attempt_at);
+
+CREATE TABLE IF NOT EXISTS offline_queue_stats (
+    status TEXT PRIMARY KEY,
+    count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS offline_queue_stats_insert AFTER INSERT ON offline_queue
+BEGIN
+    INSERT OR IGNORE INTO offline_queue_stats (status, count) VALUES (NEW.status, 0);
+    UPDATE offline_queue_stats SET count = count + 1 WHERE status = NEW.status;
+END;
+
+CREATE TRIGGER IF NOT EXISTS offline_queue_stats_update AFTER UPDATE OF status ON offline_queue
+WHEN OLD.status != NEW.status
+BEGIN
+    UPDATE offline_queue_stats SET count = count - 1 WHERE status = OLD.status;
+    INSERT OR IGNORE INTO offline_queue_stats (status, count) VALUES (NEW.status, 0);
+    UPDATE offline_queue_stats SET count = count + 1 WHERE status = NEW.status;
+END;
+
+CREATE TRIGGER IF NOT EXISTS offline_queue_stats_delete AFTER DELETE ON offline_queue
+BEGIN
+    UPDATE offline_queue_stats SET count = count - 1 WHERE status = OLD.status;
+END;
+"""
+
+# Columns added after the first release of the queue database
+_QUEUE_COLUMN_UPGRADES = {
+    "attempts": "INTEGER NOT NULL DEFAULT 0",
+    "next_attempt_at": "REAL NOT NULL DEFAULT 0",
+    "claimed_at": "REAL"
+}
+
+_queue_init_lock = threading.Lock()
+_initialized_queues = set()
+
+
+def _connect_offline_queue(db_path: str = OFFLINE_QUEUE_DB) -> sqlite3.Connection:
+    """
+    Open a connection to the offline queue database, creating it on first use.
+    
+    The first connection to the default queue in each process also migrates
+    any legacy JSON queue file into the database.
+    
+    Args:
+        db_path: Path to the SQLite queue database
+        
+    Returns:
+        sqlite3 connection with rows accessible by column name
+    """
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    
+    if db_path not in _initialized_queues:
+        with _queue_init_lock:
+            if db_path not in _initialized_queues:
+                conn.execute("PRAGMA journal_mode=WAL")
+                # Bring queues created by earlier releases up to date
+                columns = {row["name"] for row in conn.execute("PRAGMA table_info(offline_queue)")}
+                for column, definition in _QUEUE_COLUMN_UPGRADES.items():
+                    if columns and column not in columns:
+                        conn.execute(f"ALTER TABLE offline_queue ADD COLUMN {column} {definition}")
+                conn.executescript(_QUEUE_SCHEMA)
+                if db_path == OFFLINE_QUEUE_DB:
+                    migrate_json_offline_queue(conn)
+                _initialized_queues.add(db_path)
+    
+    return conn
+
+
+def migrate_json_offline_queue(conn: sqlite3.Connection, json_path: str = OFFLINE_QUEUE_FILE) -> int:
+    """
+    One-time migration of the legacy JSON offline queue into the queue database.
+    
+    The JSON file is renamed with a ``.migrated`` suffix once its entries have
+    been copied, so the migration never runs twice.
+    
+    Args:
+        conn: Open connection to the queue database
+        json_path: Path to the legacy JSON queue file
+        
+    Returns:
+        Number of queue entries migrated
+    """
+    if not os.path.exists(json_path):
+        return 0
+    
+    try:
+        with open(json_path, "r") as f:
+            queue = json.load(f)
+        
+        rows = [
+            (
+                item["id"],
+                item.get("invoice_data", {}).get("traderSystemInvoiceNumber"),
+                item.get("timestamp") or datetime.now().isoformat(),
+                json.dumps(item.get("invoice_data", {})),
+                item.get("status", "pending"),
+                item.get("transmission_time"),
+                json.dumps(item["response"]) if item.get("response") is not None else None,
+                item.get("error"),
+                item.get("last_attempt")
+            )
+            for item in queue
+        ]
+        
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO offline_queue "
+                "(id, reference, timestamp, invoice_data, status, transmission_time, response, error, last_attempt) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+        
+        os.replace(json_path, f"{json_path}.migrated")
+        logger.info(f"Migrated {len(rows)} invoices from {json_path} to the offline queue database")
+        return len(rows)
+    except Exception as e:
+        logger.error(f"Failed to migrate JSON offline queue: {str(e)}")
+        raise ETIMSError(f"Offline queue migration error: {str(e)}")
+
+
 def queue_for_offline_transmission(invoice_data: Dict) -> str:
     """
     Queue invoice data for later transmission when in offline mode.
@@ -322,27 +566,21 @@ def queue_for_offline_transmission(invoice_data: Dict) -> str:
         # Generate a unique ID for this queued invoice
         queue_id = f"OFFLINE-{str(uuid.uuid4())[:8]}"
         
-        # Create the offline queue file if it doesn't exist
-        os.makedirs(os.path.dirname(OFFLINE_QUEUE_FILE), exist_ok=True)
-        
-        # Load existing queue or create new one
-        if os.path.exists(OFFLINE_QUEUE_FILE):
-            with open(OFFLINE_QUEUE_FILE, "r") as f:
-                queue = json.load(f)
-        else:
-            queue = []
-        
-        # Add the new invoice to the queue with timestamp
-        queue.append({
-            "id": queue_id,
-            "timestamp": datetime.now().isoformat(),
-            "invoice_data": invoice_data,
-            "status": "pending"
-        })
-        
-        # Save the updated queue
-        with open(OFFLINE_QUEUE_FILE, "w") as f:
-            json.dump(queue, f, indent=2)
+        conn = _connect_offline_queue()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO offline_queue (id, reference, timestamp, invoice_data, status) "
+                    "VALUES (?, ?, ?, ?, 'pending')",
+                    (
+                        queue_id,
+                        invoice_data.get("traderSystemInvoiceNumber"),
+                        datetime.now().isoformat(),
+                        json.dumps(invoice_data)
+                    )
+                )
+        finally:
+            conn.close()
         
         logger.info(f"Invoice queued for offline transmission: {queue_id}")
         return queue_id
@@ -351,6 +589,227 @@ def queue_for_offline_transmission(invoice_data: Dict) -> str:
         raise ETIMSError(f"Offline queue error: {str(e)}")
 
 
+class OfflineQueueDrain:
+    """
+    Drains the offline queue with a bounded pool of concurrent transmissions.
+    
+    Invoices are claimed from the queue in small batches and sent by a thread
+    pool. Every outcome is written back as soon as it is known, so the queue
+    itself is the checkpoint: a drain that stops partway can be restarted and
+    carries on with whatever is still pending. Failed invoices are retried with
+    exponential backoff until their retry budget is spent, after which they are
+    marked as failed.
+    """
+    
+    def __init__(
+        self,
+        api_url: str,
+        private_key,
+        certificate,
+        workers: int = OFFLINE_QUEUE_WORKERS,
+        max_attempts: int = OFFLINE_QUEUE_MAX_ATTEMPTS,
+        backoff_base: float = OFFLINE_QUEUE_BACKOFF_BASE,
+        backoff_max: float = OFFLINE_QUEUE_BACKOFF_MAX,
+        db_path: str = OFFLINE_QUEUE_DB
+    ):
+        self.api_url = api_url
+        self.private_key = private_key
+        self.certificate = certificate
+        self.workers = max(1, int(workers))
+        self.max_attempts = max(1, int(max_attempts))
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.db_path = db_path
+        
+        self.state = "idle"
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self.transmitted = 0
+        self.retried = 0
+        self.failed = 0
+        self.error: Optional[str] = None
+        self._thread: Optional[threading.Thread] = None
+    
+    def backoff_delay(self, attempts: int) -> float:
+        """
+        Delay before the next attempt of an invoice that has failed `attempts` times.
+        
+        Args:
+            attempts: Number of failed attempts so far
+            
+        Returns:
+            Delay in seconds, with jitter so retries from an outage spread out
+        """
+        delay = min(self.backoff_base * (2 ** (attempts - 1)), self.backoff_max)
+        return delay * random.uniform(0.5, 1.0)
+    
+    def _claim_batch(self, conn: sqlite3.Connection, limit: int) -> List[sqlite3.Row]:
+        """Mark a batch of due invoices as in flight and return them."""
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT seq, invoice_data, attempts FROM offline_queue "
+                "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at, seq LIMIT ?",
+                (now, limit)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE offline_queue SET status = 'in_flight', claimed_at = ? WHERE seq = ?",
+                [(now, row["seq"]) for row in rows]
+            )
+        return rows
+    
+    def _release_abandoned_claims(self, conn: sqlite3.Connection) -> None:
+        """Return invoices left in flight by a drain that died back to the pending state."""
+        with conn:
+            conn.execute(
+                "UPDATE offline_queue SET status = 'pending', claimed_at = NULL "
+                "WHERE status = 'in_flight' AND claimed_at < ?",
+                (time.time() - OFFLINE_QUEUE_CLAIM_TIMEOUT,)
+            )
+    
+    def _record_success(self, conn: sqlite3.Connection, item: sqlite3.Row, response: Dict) -> None:
+        with conn:
+            conn.execute(
+                "UPDATE offline_queue SET status = 'transmitted', transmission_time = ?, response = ?, "
+                "error = NULL, attempts = attempts + 1, claimed_at = NULL WHERE seq = ?",
+                (datetime.now().isoformat(), json.dumps(response), item["seq"])
+            )
+        self.transmitted += 1
+    
+    def _record_failure(self, conn: sqlite3.Connection, item: sqlite3.Row, error: Exception) -> None:
+        attempts = item["attempts"] + 1
+        if attempts >= self.max_attempts:
+            status, next_attempt_at = "failed", 0
+            self.failed += 1
+        else:
+            status, next_attempt_at = "pending", time.time() + self.backoff_delay(attempts)
+            self.retried += 1
+        
+        with conn:
+            conn.execute(
+                "UPDATE offline_queue SET status = ?, error = ?, last_attempt = ?, attempts = ?, "
+                "next_attempt_at = ?, claimed_at = NULL WHERE seq = ?",
+                (status, str(error), datetime.now().isoformat(), attempts, next_attempt_at, item["seq"])
+            )
+    
+    def _send(self, item: sqlite3.Row) -> Dict:
+        return transmit_invoice(
+            json.loads(item["invoice_data"]),
+            cast(str, self.api_url),
+            self.private_key,
+            self.certificate
+        )
+    
+    def run(self) -> Dict:
+        """
+        Drain every invoice that is currently due for transmission.
+        
+        Invoices that fail and are scheduled for a later retry are left pending
+        for the next drain.
+        
+        Returns:
+            Dictionary describing the drain (see `status`)
+        """
+        self.state = "running"
+        self.started_at = datetime.now().isoformat()
+        conn = None
+        try:
+            conn = _connect_offline_queue(self.db_path)
+            self._release_abandoned_claims(conn)
+            
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="etims-drain") as executor:
+                while True:
+                    batch = self._claim_batch(conn, self.workers * 4)
+                    if not batch:
+                        break
+                    
+                    futures = {executor.submit(self._send, item): item for item in batch}
+                    for future in as_completed(futures):
+                        item = futures[future]
+                        try:
+                            response = future.result()
+                        except Exception as e:
+                            # A malformed invoice or response fails that invoice, not the drain
+                            self._record_failure(conn, item, e)
+                        else:
+                            self._record_success(conn, item, response)
+            
+            self.state = "completed"
+        except Exception as e:
+            logger.error(f"Failed to drain offline queue: {str(e)}")
+            self.state = "error"
+            self.error = str(e)
+        finally:
+            self.finished_at = datetime.now().isoformat()
+            if conn is not None:
+                conn.close()
+        
+        return self.status
+    
+    def start(self) -> "OfflineQueueDrain":
+        """Run the drain on a background thread and return immediately."""
+        self.state = "running"
+        self._thread = threading.Thread(target=self.run, name="etims-offline-queue-drain", daemon=True)
+        self._thread.start()
+        return self
+    
+    @property
+    def is_running(self) -> bool:
+        return self.state == "running"
+    
+    @property
+    def status(self) -> Dict:
+        return {
+            "state": self.state,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "workers": self.workers,
+            "transmitted": self.transmitted,
+            "retried": self.retried,
+            "failed": self.failed,
+            "error": self.error
+        }
+
+
+_drain_lock = threading.Lock()
+_current_drain: Optional[OfflineQueueDrain] = None
+
+
+def start_offline_queue_drain(api_url: str, private_key, certificate, **options) -> OfflineQueueDrain:
+    """
+    Start draining the offline queue in the background.
+    
+    Only one drain runs per process; if one is already running it is returned
+    instead of starting another.
+    
+    Args:
+        api_url: KRA eTIMS API endpoint URL
+        private_key: RSA private key for signing
+        certificate: X.509 certificate
+        **options: Tuning options passed to OfflineQueueDrain
+        
+    Returns:
+        The running OfflineQueueDrain
+    """
+    global _current_drain
+    with _drain_lock:
+        if _current_drain is None or not _current_drain.is_running:
+            _current_drain = OfflineQueueDrain(api_url, private_key, certificate, **options).start()
+        return _current_drain
+
+
+def get_offline_queue_drain_status() -> Optional[Dict]:
+    """
+    Get the status of the current or most recent background drain.
+    
+    Returns:
+        Drain status dictionary, or None if no drain has run in this process
+    """
+    drain = _current_drain
+    return drain.status if drain else None
+
+
 def process_offline_queue(
     api_url: str,
     private_key,
@@ -359,6 +818,9 @@ def process_offline_queue(
     """
     Process the offline queue and transmit pending invoices to KRA eTIMS.
     
+    Runs a drain in the calling thread; use start_offline_queue_drain to
+    drain in the background instead.
+    
     Args:
         api_url: KRA eTIMS API endpoint URL
         private_key: RSA private key for signing
@@ -367,50 +829,11 @@ def process_offline_queue(
     Returns:
         Tuple of (successful_count, failed_count)
     """
-    if not os.path.exists(OFFLINE_QUEUE_FILE):
-        return 0, 0
+    result = OfflineQueueDrain(api_url, private_key, certificate).run()
+    if result["state"] == "error":
+        raise ETIMSError(f"Offline queue processing error: {result['error']}")
     
-    try:
-        # Load the queue
-        with open(OFFLINE_QUEUE_FILE, "r") as f:
-            queue = json.load(f)
-        
-        success_count = 0
-        fail_count = 0
-        
-        # Process each pending invoice
-        for item in queue:
-            if item["status"] == "pending":
-                try:
-                    # Attempt to transmit to eTIMS
-                    response = transmit_invoice(
-                        item["invoice_data"],
-                        cast(str, api_url),
-                        private_key,
-                        certificate
-                    )
-                    
-                    # Update status to success
-                    item["status"] = "transmitted"
-                    item["transmission_time"] = datetime.now().isoformat()
-                    item["response"] = response
-                    success_count += 1
-                    
-                except ETIMSError as e:
-                    # Mark as failed but keep in queue for retry
-                    item["status"] = "failed"
-                    item["error"] = str(e)
-                    item["last_attempt"] = datetime.now().isoformat()
-                    fail_count += 1
-        
-        # Save the updated queue
-        with open(OFFLINE_QUEUE_FILE, "w") as f:
-            json.dump(queue, f, indent=2)
-        
-        return success_count, fail_count
-    except Exception as e:
-        logger.error(f"Failed to process offline queue: {str(e)}")
-        raise ETIMSError(f"Offline queue processing error: {str(e)}")
+    return result["transmitted"], result["retried"] + result["failed"]
 
 
 def get_offline_queue_stats() -> Dict:
@@ -420,42 +843,31 @@ def get_offline_queue_stats() -> Dict:
     Returns:
         Dictionary with queue statistics
     """
-    if not os.path.exists(OFFLINE_QUEUE_FILE):
-        return {
-            "total": 0,
-            "pending": 0,
-            "transmitted": 0,
-            "failed": 0
-        }
+    stats = {
+        "total": 0,
+        "pending": 0,
+        "in_flight": 0,
+        "transmitted": 0,
+        "failed": 0
+    }
     
     try:
-        # Load the queue
-        with open(OFFLINE_QUEUE_FILE, "r") as f:
-            queue = json.load(f)
-        
-        # Count items by status
-        stats = {
-            "total": len(queue),
-            "pending": 0,
-            "transmitted": 0,
-            "failed": 0
-        }
+        conn = _connect_offline_queue()
+        try:
+            rows = conn.execute("SELECT status, count FROM offline_queue_stats").fetchall()
+        finally:
+            conn.close()
         
-        for item in queue:
-            status = item.get("status", "pending")
-            if status in stats:
-                stats[status] += 1
+        for row in rows:
+            stats["total"] += row["count"]
+            if row["status"] in stats:
+                stats[row["status"]] = row["count"]
         
         return stats
     except Exception as e:
         logger.error(f"Failed to get offline queue stats: {str(e)}")
-        return {
-            "total": 0,
-            "pending": 0,
-            "transmitted": 0,
-            "failed": 0,
-            "error": str(e)
-        }
+        stats["error"] = str(e)
+        return stats
 
 
 def test_etims_connection(api_url: str) -> bool:
@@ -470,9 +882,9 @@ def test_etims_connection(api_url: str) -> bool:
     """
     try:
         # Try to connect to the health check endpoint
-        response = requests.get(
+        response = _session.get(
             f"{api_url.rstrip('/')}/health",
-            timeout=ETIMS_API_TIMEOUT
+            timeout=ETIMS_TIMEOUT
         )
         
         # Check if connection is successful
@@ -501,10 +913,10 @@ def verify_control_unit(api_url: str, device_id: str, tax_pin: str) -> Dict:
         }
         
         # Send verification request
-        response = requests.post(
+        response = _session.post(
             f"{api_url.rstrip('/')}/devices/verify",
             json=verification_data,
-            timeout=ETIMS_API_TIMEOUT
+            timeout=ETIMS_TIMEOUT
         )
         
         # Check response
@@ -522,6 +934,69 @@ def verify_control_unit(api_url: str, device_id: str, tax_pin: str) -> Dict:
         raise ETIMSError(f"Communication error during Control Unit verification: {str(e)}")
 
 
+def prepare_sale_for_etims(sale_id: int) -> Dict:
+    """
+    Build the eTIMS invoice and receipt QR code for a sale without contacting KRA.
+    
+    Args:
+        sale_id: ID of the Sale record
+        
+    Returns:
+        Dictionary with status "prepared", the invoice data and the base64 QR
+        code, or a "skipped"/"error" status with a reason
+    """
+    from models import Sale, Store
+    
+    # Get eTIMS settings from application config
+    enable_tims = current_app.config.get("ENABLE_TIMS", False)
+    if not enable_tims:
+        return {"status": "skipped", "reason": "eTIMS integration is disabled"}
+    
+    tax_pin = current_app.config.get("TAX_PIN")
+    device_id = current_app.config.get("TIMS_DEVICE_ID")
+    
+    # Validate required settings
+    if not tax_pin:
+        return {"status": "error", "reason": "KRA PIN is not configured"}
+    
+    if not device_id:
+        return {"status": "error", "reason": "Control Unit ID is not configured"}
+    
+    # Get sale data
+    sale = Sale.query.get(sale_id)
+    if not sale:
+        return {"status": "error", "reason": f"Sale with ID {sale_id} not found"}
+    
+    store = Store.query.get(sale.store_id)
+    if not store:
+        return {"status": "error", "reason": f"Store with ID {sale.store_id} not found"}
+    
+    # Format invoice data for eTIMS
+    invoice_data = format_invoice_data(
+        sale=sale,
+        store=store,
+        products=sale.items,
+        tax_pin=tax_pin,
+        device_id=device_id
+    )
+    
+    # Generate QR code
+    qr_buffer = generate_invoice_qr_code(
+        pin=tax_pin,
+        invoice_number=sale.reference,
+        date=sale.sale_date.strftime("%Y-%m-%d"),
+        total_amount=sale.total_amount,
+        vat_amount=sale.tax_amount,
+        device_id=device_id
+    )
+    
+    return {
+        "status": "prepared",
+        "qr_code": base64.b64encode(qr_buffer.getvalue()).decode('utf-8'),
+        "invoice_data": invoice_data
+    }
+
+
 def handle_sale_for_etims(sale_id: int) -> Dict:
     """
     Main function to handle a sale for KRA eTIMS compliance.
@@ -539,58 +1014,18 @@ def handle_sale_for_etims(sale_id: int) -> Dict:
     Returns:
         Dictionary with eTIMS processing results
     """
-    from models import Sale, Store
-    
     try:
-        # Get eTIMS settings from application config
-        enable_tims = current_app.config.get("ENABLE_TIMS", False)
-        if not enable_tims:
-            return {"status": "skipped", "reason": "eTIMS integration is disabled"}
+        prepared = prepare_sale_for_etims(sale_id)
+        if prepared["status"] != "prepared":
+            return prepared
+        
+        invoice_data = prepared["invoice_data"]
+        qr_base64 = prepared["qr_code"]
         
-        tax_pin = current_app.config.get("TAX_PIN")
-        device_id = current_app.config.get("TIMS_DEVICE_ID")
         api_url = current_app.config.get("TIMS_URL")
         cert_path = current_app.config.get("TIMS_CERTIFICATE_PATH", CERTIFICATE_PATH)
         cert_password = current_app.config.get("TIMS_CERTIFICATE_PASSWORD")
         
-        # Validate required settings
-        if not tax_pin:
-            return {"status": "error", "reason": "KRA PIN is not configured"}
-        
-        if not device_id:
-            return {"status": "error", "reason": "Control Unit ID is not configured"}
-        
-        # Get sale data
-        sale = Sale.query.get(sale_id)
-        if not sale:
-            return {"status": "error", "reason": f"Sale with ID {sale_id} not found"}
-        
-        store = Store.query.get(sale.store_id)
-        if not store:
-            return {"status": "error", "reason": f"Store with ID {sale.store_id} not found"}
-        
-        # Format invoice data for eTIMS
-        invoice_data = format_invoice_data(
-            sale=sale,
-            store=store,
-            products=sale.items,
-            tax_pin=tax_pin,
-            device_id=device_id
-        )
-        
-        # Generate QR code
-        qr_buffer = generate_invoice_qr_code(
-            pin=tax_pin,
-            invoice_number=sale.reference,
-            date=sale.sale_date.strftime("%Y-%m-%d"),
-            total_amount=sale.total_amount,
-            vat_amount=sale.tax_amount,
-            device_id=device_id
-        )
-        
-        # Store QR code for printing
-        qr_base64 = base64.b64encode(qr_buffer.getvalue()).decode('utf-8')
-        
         # If offline mode or certificate not available, queue for later
         if not os.path.exists(cert_path) or not cert_password:
             queue_id = queue_for_offline_transmission(invoice_data)
@@ -601,8 +1036,8 @@ def handle_sale_for_etims(sale_id: int) -> Dict:
                 "invoice_data": invoice_data
             }
         
-        # Load certificate and transmit
-        private_key, certificate, _ = load_certificate(cert_path, cert_password)
+        # Load certificate (cached across sales) and transmit
+        private_key, certificate, _ = load_certificate_cached(cert_path, cert_password)
         
         try:
             # Try to transmit in real-time
@@ -632,4 +1067,132 @@ def handle_sale_for_etims(sale_id: int) -> Dict:
     
     except Exception as e:
         logger.error(f"eTIMS processing error: {str(e)}")
-        return {"status": "error", "reason": str(e)}
\ No newline at end of file
+        return {"status": "error", "reason": str(e)}
+
+
+# Background fiscalisation. Checkout queues each invoice and wakes this worker,
+# which signs and transmits through the offline queue drain. The worker also
+# wakes periodically to pick up invoices whose retry backoff has elapsed.
+FISCALISATION_POLL_INTERVAL = 30  # seconds
+
+_fiscalisation_wakeup = threading.Event()
+_fiscalisation_lock = threading.Lock()
+_fiscalisation_thread: Optional[threading.Thread] = None
+
+
+def _fiscalisation_worker(app) -> None:
+    """Transmit queued invoices whenever new work arrives or retries fall due."""
+    while True:
+        _fiscalisation_wakeup.wait(timeout=FISCALISATION_POLL_INTERVAL)
+        _fiscalisation_wakeup.clear()
+        
+        try:
+            with app.app_context():
+                api_url = current_app.config.get("TIMS_URL")
+                cert_path = current_app.config.get("TIMS_CERTIFICATE_PATH", CERTIFICATE_PATH)
+                cert_password = current_app.config.get("TIMS_CERTIFICATE_PASSWORD")
+                workers = current_app.config.get("ETIMS_QUEUE_WORKERS", OFFLINE_QUEUE_WORKERS)
+                max_attempts = current_app.config.get("ETIMS_QUEUE_MAX_ATTEMPTS", OFFLINE_QUEUE_MAX_ATTEMPTS)
+            
+            # Without a usable certificate invoices simply stay queued
+            if not api_url or not cert_password or not os.path.exists(cert_path):
+                continue
+            
+            private_key, certificate, _ = load_certificate_cached(cert_path, cert_password)
+            OfflineQueueDrain(
+                api_url,
+                private_key,
+                certificate,
+                workers=workers,
+                max_attempts=max_attempts
+            ).run()
+        except Exception as e:
+            logger.error(f"eTIMS fiscalisation worker error: {str(e)}")
+
+
+def start_fiscalisation_worker(app) -> None:
+    """
+    Start the background fiscalisation worker for this process if it is not running.
+    
+    Args:
+        app: Flask application whose configuration the worker reads
+    """
+    global _fiscalisation_thread
+    with _fiscalisation_lock:
+        if _fiscalisation_thread is None or not _fiscalisation_thread.is_alive():
+            _fiscalisation_thread = threading.Thread(
+                target=_fiscalisation_worker,
+                args=(app,),
+                name="etims-fiscalisation",
+                daemon=True
+            )
+            _fiscalisation_thread.start()
+
+
+def fiscalise_sale_async(sale_id: int) -> Dict:
+    """
+    Queue a sale for fiscalisation and return its locally generated QR code.
+    
+    The invoice is signed and transmitted by the background worker, so the
+    caller never waits on the KRA API. Use get_fiscal_status to follow it.
+    
+    Args:
+        sale_id: ID of the Sale record
+        
+    Returns:
+        Dictionary with status "queued", the queue ID, QR code and invoice data,
+        or a "skipped"/"error" status with a reason
+    """
+    try:
+        prepared = prepare_sale_for_etims(sale_id)
+        if prepared["status"] != "prepared":
+            return prepared
+        
+        queue_id = queue_for_offline_transmission(prepared["invoice_data"])
+        
+        start_fiscalisation_worker(current_app._get_current_object())
+        _fiscalisation_wakeup.set()
+        
+        return {
+            "status": "queued",
+            "queue_id": queue_id,
+            "qr_code": prepared["qr_code"],
+            "invoice_data": prepared["invoice_data"]
+        }
+    except Exception as e:
+        logger.error(f"eTIMS processing error: {str(e)}")
+        return {"status": "error", "reason": str(e)}
+
+
+def get_fiscal_status(reference: str) -> Optional[Dict]:
+    """
+    Look up the fiscalisation status of an invoice by its sale reference.
+    
+    Args:
+        reference: Sale reference used as the trader system invoice number
+        
+    Returns:
+        Dictionary with the queue status, attempts, transmission time and KRA
+        response, or None if the invoice was never queued
+    """
+    conn = _connect_offline_queue()
+    try:
+        row = conn.execute(
+            "SELECT id, status, attempts, transmission_time, response, error FROM offline_queue "
+            "WHERE reference = ? ORDER BY seq DESC LIMIT 1",
+            (reference,)
+        ).fetchone()
+    finally:
+        conn.close()
+    
+    if row is None:
+        return None
+    
+    return {
+        "queue_id": row["id"],
+        "status": row["status"],
+        "attempts": row["attempts"],
+        "transmission_time": row["transmission_time"],
+        "response": json.loads(row["response"]) if row["response"] else None,
+        "error": row["error"]
+    }
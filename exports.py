@@ -0,0 +1,240 @@
+"""
+Streaming report exports.
+
+Report rows are read with ``yield_per`` so the database driver hands them over
+in batches, and written straight into a chunked response. Memory use stays
+flat however long the date range is:
+
+1. CSV is encoded and flushed every ``CSV_FLUSH_BYTES``
+2. XLSX is written with openpyxl's write-only workbook, which spools rows to a
+   temporary file, and the finished file is then streamed in chunks
+"""
+
+import csv
+import io
+import logging
+import tempfile
+from datetime import datetime
+from typing import Iterable, Iterator, List, Sequence
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import aliased
+
+from extensions import db
+from models import Category, Customer, Inventory, Payment, Product, Sale, SaleItem, Supplier, User
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # XLSX export is unavailable without openpyxl
+    Workbook = None
+
+logger = logging.getLogger(__name__)
+
+EXPORT_BATCH_SIZE = 1000  # rows fetched from the database at a time
+CSV_FLUSH_BYTES = 64 * 1024  # CSV bytes buffered before a chunk is sent
+XLSX_CHUNK_BYTES = 64 * 1024  # XLSX bytes read per chunk
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+SALES_EXPORT_HEADER = [
+    "Reference", "Date", "Customer", "Cashier", "Items", "Subtotal",
+    "Tax", "Discount", "Total", "Payment Method", "Status"
+]
+
+INVENTORY_EXPORT_HEADER = [
+    "Product", "SKU", "Barcode", "Category", "Supplier", "Quantity",
+    "Reorder Level", "Cost Price", "Selling Price", "Stock Value", "Active"
+]
+
+
+class ExportError(Exception):
+    """Exception raised when an export cannot be produced."""
+    pass
+
+
+def xlsx_available() -> bool:
+    """Return True when openpyxl is installed and XLSX exports can be written."""
+    return Workbook is not None
+
+
+def _stream(statement) -> Iterable:
+    return db.session.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+
+
+def sales_export_rows(store_id: int, start: datetime, end: datetime, status: str = "completed") -> Iterator[List]:
+    """
+    Yield one row per sale in the range, newest first.
+
+    Item counts and payment methods are computed in the same query, so each
+    sale costs one row from the database and no ORM objects are built.
+
+    Args:
+        store_id: Store to export
+        start: Earliest sale date included
+        end: Latest sale date included
+        status: Sale status to export
+
+    Returns:
+        Iterator of rows in ``SALES_EXPORT_HEADER`` order
+    """
+    cashier = aliased(User)
+    item_count = (
+        select(func.coalesce(func.sum(SaleItem.quantity), 0))
+        .where(SaleItem.sale_id == Sale.id)
+        .scalar_subquery()
+    )
+    payment_method = (
+        select(func.min(Payment.payment_method))
+        .where(Payment.sale_id == Sale.id)
+        .scalar_subquery()
+    )
+    statement = (
+        select(
+            Sale.reference, Sale.sale_date, Customer.name, cashier.username, item_count,
+            Sale.subtotal, Sale.tax_amount, Sale.discount_amount, Sale.total_amount,
+            func.coalesce(Sale.payment_method, payment_method), Sale.status
+        )
+        .outerjoin(Customer, Customer.id == Sale.customer_id)
+        .outerjoin(cashier, cashier.id == Sale.cashier_id)
+        .where(
+            Sale.store_id == store_id,
+            Sale.sale_date >= start,
+            Sale.sale_date <= end,
+            Sale.status == status
+        )
+        .order_by(Sale.sale_date.desc(), Sale.id.desc())
+    )
+
+    for (reference, sale_date, customer, cashier_name, items, subtotal,
+         tax, discount, total, method, sale_status) in _stream(statement):
+        yield [
+            reference,
+            sale_date.strftime("%Y-%m-%d %H:%M:%S") if sale_date else "",
+            customer or "Walk-in Customer",
+            cashier_name or "",
+            items,
+            subtotal,
+            tax,
+            discount,
+            total,
+            (method or "unpaid").upper(),
+            sale_status,
+        ]
+
+
+def inventory_export_rows(store_id: int) -> Iterator[List]:
+    """
+    Yield one row per product stocked in the store, by category then name.
+
+    Args:
+        store_id: Store to export
+
+    Returns:
+        Iterator of rows in ``INVENTORY_EXPORT_HEADER`` order
+    """
+    statement = (
+        select(
+            Product.name, Product.sku, Product.barcode, Category.name, Supplier.name,
+            Inventory.quantity, Inventory.reorder_level, Product.cost_price,
+            Product.selling_price, Product.is_active
+        )
+        .join(Inventory, Inventory.product_id == Product.id)
+        .outerjoin(Category, Category.id == Product.category_id)
+        .outerjoin(Supplier, Supplier.id == Product.supplier_id)
+        .where(Inventory.store_id == store_id)
+        .order_by(Category.name, Product.name, Product.id)
+    )
+
+    for (name, sku, barcode, category, supplier, quantity, reorder_level,
+         cost_price, selling_price, is_active) in _stream(statement):
+        yield [
+            name,
+            sku or "",
+            barcode or "",
+            category or "Uncategorized",
+            supplier or "",
+            quantity,
+            reorder_level,
+            cost_price,
+            selling_price,
+            (cost_price or 0) * (quantity or 0),
+            "Yes" if is_active else "No",
+        ]
+
+
+def stream_csv(header: Sequence, rows: Iterable[Sequence]) -> Iterator[bytes]:
+    """
+    Encode rows as UTF-8 CSV, yielding a chunk roughly every ``CSV_FLUSH_BYTES``.
+
+    A byte order mark is written first so Excel opens the file as UTF-8.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")
+    writer.writerow(header)
+
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CSV_FLUSH_BYTES:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue().encode("utf-8")
+
+
+def stream_xlsx(header: Sequence, rows: Iterable[Sequence], sheet_title: str = "Report") -> Iterator[bytes]:
+    """
+    Write rows to a write-only XLSX workbook and yield the file in chunks.
+
+    The workbook keeps only the current row in memory and the finished file is
+    read back from a temporary file, so memory does not grow with the row count.
+
+    Raises:
+        ExportError: If openpyxl is not installed
+    """
+    if not xlsx_available():
+        raise ExportError("XLSX export requires openpyxl to be installed")
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=sheet_title)
+    sheet.append(list(header))
+    for row in rows:
+        sheet.append(list(row))
+
+    with tempfile.TemporaryFile(suffix=".xlsx") as output:
+        workbook.save(output)
+        output.seek(0)
+        while True:
+            chunk = output.read(XLSX_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+
+def stream_export(export_format: str, header: Sequence, rows: Iterable[Sequence], sheet_title: str = "Report") -> Iterator[bytes]:
+    """
+    Stream rows in the requested format.
+
+    Args:
+        export_format: One of ``EXPORT_FORMATS``
+        header: Column headings
+        rows: Row iterator, consumed lazily
+        sheet_title: Worksheet name for XLSX output
+
+    Returns:
+        Iterator of response body chunks
+
+    Raises:
+        ExportError: If the format is unknown or unavailable
+    """
+    if export_format == "csv":
+        return stream_csv(header, rows)
+    if export_format == "xlsx":
+        if not xlsx_available():
+            raise ExportError("XLSX export requires openpyxl to be installed")
+        return stream_xlsx(header, rows, sheet_title)
+    raise ExportError(f"Unsupported export format: {export_format}")
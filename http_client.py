@@ -0,0 +1,54 @@
+"""
+Shared HTTP sessions for the external APIs the POS talks to (M-Pesa, KRA eTIMS).
+
+Each integration keeps one long-lived requests.Session so connections are pooled
+and kept alive between calls instead of paying a fresh TCP and TLS handshake on
+every request.
+"""
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_POOL_SIZE = 20  # connections kept alive per host
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF_FACTOR = 0.3  # seconds, doubled on each retry
+
+
+def create_session(
+    pool_size: int = DEFAULT_POOL_SIZE,
+    retries: int = DEFAULT_RETRIES,
+    backoff_factor: float = DEFAULT_BACKOFF_FACTOR
+) -> requests.Session:
+    """
+    Create a pooled, keep-alive HTTP session with conservative retries.
+    
+    Connection failures are retried for every method because the request never
+    reached the server. Read failures and 502/503/504 responses are only retried
+    for idempotent methods, so a POST that may have been processed is never sent
+    twice.
+    
+    Args:
+        pool_size: Maximum number of connections kept open per host
+        retries: Maximum number of retries per request
+        backoff_factor: Base delay between retries in seconds
+        
+    Returns:
+        Configured requests.Session
+    """
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+    
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
@@ -0,0 +1,331 @@
+"""
+Background product import jobs.
+
+A large supplier catalogue takes longer to import than a request may run
+behind gunicorn, so the import page only saves the upload and records an
+``ImportJob``; the import itself runs on a background worker:
+
+1. The upload (CSV or XLSX) is written to ``IMPORT_DIR`` and read back as a
+   stream by the import engine in ``product_import``, one committed batch at a
+   time
+2. After each batch (at most every ``PROGRESS_INTERVAL``) the job row is
+   updated with the counts and how far through the file the reader is (for a
+   workbook, how far through its compressed sheet data), from
+   which the status endpoint derives percentage, rows per second and ETA
+3. Rejected rows are appended to an error CSV next to the upload, with their
+   original values, instead of being carried in the session cookie
+
+Jobs run one at a time per process so concurrent imports do not contend for
+the SQLite write lock. A worker claims a job with a conditional UPDATE, so a
+job is never run twice. When the server starts, jobs still queued by the
+previous process are resubmitted (``resume_jobs``). A job that stops
+reporting for ``STALLED_AFTER`` is marked failed when polled: a running job
+whose worker died, or a queued job while no import anywhere is making progress.
+"""
+
+import csv
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+import click
+from sqlalchemy import update
+
+from extensions import db
+from models import ImportJob
+from product_import import (
+    FIELDS, ColumnMapping, ImportResult, ProductImportError, file_format, import_products, read_rows
+)
+
+IMPORT_DIR = "instance/imports"
+IMPORT_WORKERS = 1  # imports run one at a time per process
+PROGRESS_INTERVAL = 1.0  # seconds between job progress writes
+STALLED_AFTER = timedelta(minutes=5)
+JOB_RETENTION = timedelta(days=7)
+
+# Form fields that make up a column mapping (see ColumnMapping.from_form)
+MAPPING_FIELDS = [f"column_{field}" for field in FIELDS] + [
+    "default_category_id", "default_supplier_id", "default_tax_rate",
+    "default_quantity", "default_reorder_level"
+]
+
+_executor = ThreadPoolExecutor(max_workers=IMPORT_WORKERS, thread_name_prefix="product-import")
+
+
+def upload_path(job_id: int) -> str:
+    return os.path.join(IMPORT_DIR, f"{job_id}-upload")
+
+
+def errors_path(job_id: int) -> str:
+    return os.path.join(IMPORT_DIR, f"{job_id}-errors.csv")
+
+
+def start_import(app, upload, form, store_id: int, user_id: Optional[int]) -> ImportJob:
+    """
+    Save an uploaded CSV or XLSX file and queue it for import.
+
+    The mapping is validated here so a bad form fails the request rather than
+    the job.
+
+    Args:
+        app: Flask application the worker runs under
+        upload: Uploaded ``FileStorage``
+        form: Import form with the column mapping and options
+        store_id: Store that receives the inventory
+        user_id: User starting the import
+
+    Returns:
+        The queued ImportJob
+
+    Raises:
+        ProductImportError: If the file type is unsupported or the column mapping is invalid
+    """
+    import_format = file_format(upload.filename)
+    if import_format is None:
+        raise ProductImportError("File type not supported. Please upload a CSV or Excel (.xlsx) file.")
+    mapping = {key: form.get(key) for key in MAPPING_FIELDS if form.get(key) not in (None, "")}
+    ColumnMapping.from_form(mapping)
+
+    job = ImportJob(
+        store_id=store_id,
+        user_id=user_id,
+        filename=os.path.basename(upload.filename or "upload.csv")[:255],
+        status="queued",
+        options=json.dumps({
+            "mapping": mapping,
+            "format": import_format,
+            "has_header": bool(form.get("header_row")),
+            "skip_duplicates": form.get("skip_duplicates", "on") == "on",
+        })
+    )
+    db.session.add(job)
+    db.session.flush()
+
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    path = upload_path(job.id)
+    try:
+        upload.save(path)
+        job.total_bytes = os.path.getsize(path)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+    _executor.submit(_run_job, app, job.id)
+    return job
+
+
+def _save_progress(job_id: int, result: ImportResult, bytes_read: int, **values) -> None:
+    db.session.execute(
+        update(ImportJob).where(ImportJob.id == job_id).values(
+            bytes_read=bytes_read,
+            rows_read=result.rows_read,
+            added=result.added,
+            skipped=result.skipped,
+            duplicate_skus=result.duplicate_skus,
+            duplicate_barcodes=result.duplicate_barcodes,
+            error_count=result.error_count,
+            updated_at=datetime.utcnow(),
+            **values
+        )
+    )
+    db.session.commit()
+
+
+def _execute(job_id: int) -> bool:
+    # Claim the job; another process may have picked it up first
+    claimed = db.session.execute(
+        update(ImportJob).where(ImportJob.id == job_id, ImportJob.status == "queued").values(
+            status="running", started_at=datetime.utcnow(), updated_at=datetime.utcnow()
+        )
+    ).rowcount
+    db.session.commit()
+    if not claimed:
+        return False
+
+    job = db.session.get(ImportJob, job_id)
+    options = job.options_dict
+    store_id = job.store_id
+    mapping = ColumnMapping.from_form(options.get("mapping", {}))
+    last_saved = time.monotonic()
+
+    with open(upload_path(job_id), "rb") as stream, \
+            open(errors_path(job_id), "w", newline="", encoding="utf-8") as error_file:
+        error_writer = csv.writer(error_file)
+        error_writer.writerow(["Row", "Error", "Data"])
+
+        def on_error(row_num, message, row):
+            error_writer.writerow([row_num, message, *row])
+
+        def on_progress(result):
+            nonlocal last_saved
+            if time.monotonic() - last_saved >= PROGRESS_INTERVAL:
+                error_file.flush()
+                _save_progress(job_id, result, stream.tell())
+                last_saved = time.monotonic()
+
+        result = import_products(
+            read_rows(stream, options.get("format", "csv"), has_header=options.get("has_header", False)),
+            mapping,
+            store_id,
+            skip_duplicates=options.get("skip_duplicates", True),
+            on_progress=on_progress,
+            on_error=on_error
+        )
+        bytes_read = stream.tell()
+
+    if not result.error_count:
+        os.remove(errors_path(job_id))
+    _save_progress(
+        job_id, result, bytes_read,
+        status="completed", message=result.summary()[:500], finished_at=datetime.utcnow()
+    )
+    return True
+
+
+def _mark_failed(job_id: int, message: str) -> None:
+    """Mark a job failed and delete its upload."""
+    now = datetime.utcnow()
+    db.session.execute(
+        update(ImportJob).where(ImportJob.id == job_id).values(
+            status="failed", message=message[:500], finished_at=now, updated_at=now
+        )
+    )
+    db.session.commit()
+    if os.path.exists(upload_path(job_id)):
+        os.remove(upload_path(job_id))
+
+
+def _run_job(app, job_id: int) -> None:
+    with app.app_context():
+        try:
+            if _execute(job_id) and os.path.exists(upload_path(job_id)):
+                os.remove(upload_path(job_id))
+        except Exception as e:
+            db.session.rollback()
+            logging.exception(f"Product import job {job_id} failed")
+            _mark_failed(job_id, f"Import failed: {str(e)}")
+        finally:
+            db.session.remove()
+
+
+def resume_jobs(app) -> int:
+    """
+    Resubmit jobs left queued by a previous server process.
+
+    Call once when the server process starts. A queued job whose upload is
+    missing cannot run and is marked failed.
+
+    Returns:
+        Number of jobs resubmitted
+    """
+    resumed = 0
+    with app.app_context():
+        try:
+            for job_id, in db.session.query(ImportJob.id).filter(ImportJob.status == "queued").order_by(ImportJob.id):
+                if os.path.exists(upload_path(job_id)):
+                    _executor.submit(_run_job, app, job_id)
+                    resumed += 1
+                else:
+                    _mark_failed(job_id, "Import was interrupted before it started")
+        finally:
+            db.session.remove()
+    if resumed:
+        logging.info(f"Resumed {resumed} queued product import jobs")
+    return resumed
+
+
+def _is_stalled(job: ImportJob, now: datetime) -> bool:
+    if job.status not in ("queued", "running") or not job.updated_at or now - job.updated_at <= STALLED_AFTER:
+        return False
+    if job.status == "running":
+        return True
+    # A queued job may wait behind a long import; it is only stuck if nothing is progressing
+    return not db.session.query(ImportJob.id).filter(
+        ImportJob.status == "running", ImportJob.updated_at > now - STALLED_AFTER
+    ).limit(1).scalar()
+
+
+def job_status(job: ImportJob) -> Dict:
+    """
+    Describe a job's progress for the polling endpoint.
+
+    A job that has stalled (see the module docstring) is marked failed.
+
+    Returns:
+        Dictionary with the job's status and counts, ``percent`` complete,
+        ``rows_per_second``, ``eta_seconds`` (None until it can be estimated)
+        and whether an error file can be downloaded
+    """
+    now = datetime.utcnow()
+    if _is_stalled(job, now):
+        _mark_failed(job.id, "Import was interrupted before it finished")
+        db.session.refresh(job)
+
+    if job.status == "completed":
+        percent = 100.0
+    else:
+        percent = 100.0 * job.bytes_read / job.total_bytes if job.total_bytes else 0.0
+
+    elapsed = ((job.finished_at or now) - job.started_at).total_seconds() if job.started_at else 0.0
+    rows_per_second = job.rows_read / elapsed if elapsed > 0 else 0.0
+    eta_seconds = None
+    if job.status == "running" and job.bytes_read and elapsed > 0:
+        eta_seconds = round(elapsed * (job.total_bytes - job.bytes_read) / job.bytes_read)
+
+    return {
+        "id": job.id,
+        "filename": job.filename,
+        "status": job.status,
+        "message": job.message,
+        "percent": round(min(percent, 100.0), 1),
+        "rows_read": job.rows_read,
+        "added": job.added,
+        "skipped": job.skipped,
+        "duplicate_skus": job.duplicate_skus,
+        "duplicate_barcodes": job.duplicate_barcodes,
+        "error_count": job.error_count,
+        "rows_per_second": round(rows_per_second, 1),
+        "elapsed_seconds": round(elapsed),
+        "eta_seconds": eta_seconds,
+        "has_error_file": job.error_count > 0 and os.path.exists(errors_path(job.id)),
+        "created_at": job.created_at.isoformat(),
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def prune_jobs(older_than: timedelta = JOB_RETENTION) -> int:
+    """Delete finished jobs and their files; returns how many jobs were removed."""
+    cutoff = datetime.utcnow() - older_than
+    jobs = ImportJob.query.filter(
+        ImportJob.status.in_(["completed", "failed"]), ImportJob.finished_at < cutoff
+    ).all()
+    for job in jobs:
+        for path in (upload_path(job.id), errors_path(job.id)):
+            if os.path.exists(path):
+                os.remove(path)
+        db.session.delete(job)
+    db.session.commit()
+    return len(jobs)
+
+
+def register_commands(app) -> None:
+    """Register the ``flask imports`` CLI commands."""
+
+    @app.cli.group("imports")
+    def imports_cli():
+        """Manage background product import jobs."""
+
+    @imports_cli.command("prune")
+    @click.option("--days", type=int, default=JOB_RETENTION.days, show_default=True,
+                  help="Keep jobs that finished within this many days.")
+    def prune_command(days):
+        """Delete old import jobs and their error files."""
+        removed = prune_jobs(timedelta(days=days))
+        click.echo(f"Removed {removed} import jobs")
@@ -0,0 +1,164 @@
+"""
+Keyset-paginated inventory listing.
+
+Pages are fetched with a seek predicate on (sort column, product id) rather
+than OFFSET, so every page costs the same however deep into the catalogue it
+is. The cursor handed back to the client is the sort key of the last row on
+the page, encoded as an opaque URL-safe string.
+"""
+
+import base64
+import json
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import or_, select, tuple_
+
+from extensions import db
+from models import Category, Inventory, Product
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+SORT_COLUMNS = {
+    "name": Product.name,
+    "quantity": Inventory.quantity,
+    "price": Product.selling_price,
+}
+DEFAULT_SORT = "name-asc"
+
+
+class ListingError(Exception):
+    """Exception raised for an invalid sort, filter or cursor."""
+    pass
+
+
+def parse_sort(sort: Optional[str]) -> Tuple[str, bool]:
+    """
+    Parse a ``<field>-<asc|desc>`` sort string.
+
+    Returns:
+        Tuple of (sort field, descending)
+    """
+    field, _, direction = (sort or DEFAULT_SORT).partition("-")
+    if field not in SORT_COLUMNS or direction not in ("asc", "desc", ""):
+        raise ListingError(f"Unsupported sort: {sort}")
+    return field, direction == "desc"
+
+
+def encode_cursor(values: List) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> List:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ListingError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != 2:
+        raise ListingError("Invalid cursor")
+    return values
+
+
+def _parse_bool(value: Optional[str]) -> Optional[bool]:
+    if value in (None, "", "all"):
+        return None
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+def list_inventory(
+    store_id: int,
+    sort: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    category_id: Optional[int] = None,
+    supplier_id: Optional[int] = None,
+    stock: Optional[str] = None,
+    active: Optional[str] = None,
+    search: Optional[str] = None
+) -> Dict:
+    """
+    Fetch one page of a store's inventory.
+
+    Args:
+        store_id: Store to list
+        sort: ``name``, ``quantity`` or ``price``, suffixed ``-asc`` or ``-desc``
+        cursor: Cursor returned with the previous page; omit for the first page
+        limit: Page size, capped at ``MAX_PAGE_SIZE``
+        category_id: Only products in this category (0 for uncategorised)
+        supplier_id: Only products from this supplier
+        stock: ``low`` for at or below reorder level, ``out`` for none left
+        active: ``true``/``false`` to filter on the active flag
+        search: Case-insensitive match on name, SKU or barcode
+
+    Returns:
+        Dictionary with ``items`` as (Product, Inventory, Category) tuples and
+        ``next_cursor`` (None on the last page)
+    """
+    field, descending = parse_sort(sort)
+    limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+    sort_column = SORT_COLUMNS[field]
+    sort_key = tuple_(sort_column, Product.id)
+
+    statement = (
+        select(Product, Inventory, Category)
+        .join(Inventory, Inventory.product_id == Product.id)
+        .outerjoin(Category, Category.id == Product.category_id)
+        .where(Inventory.store_id == store_id)
+    )
+
+    if category_id is not None:
+        statement = statement.where(
+            Product.category_id.is_(None) if category_id == 0 else Product.category_id == category_id
+        )
+    if supplier_id is not None:
+        statement = statement.where(Product.supplier_id == supplier_id)
+    if stock == "low":
+        statement = statement.where(Inventory.quantity <= Inventory.reorder_level)
+    elif stock == "out":
+        statement = statement.where(Inventory.quantity <= 0)
+    elif stock not in (None, "", "all"):
+        raise ListingError(f"Unsupported stock filter: {stock}")
+    is_active = _parse_bool(active)
+    if is_active is not None:
+        statement = statement.where(Product.is_active == is_active)
+    if search:
+        pattern = f"%{search.strip()}%"
+        statement = statement.where(or_(
+            Product.name.ilike(pattern), Product.sku.ilike(pattern), Product.barcode.ilike(pattern)
+        ))
+
+    if cursor:
+        last_value, last_id = decode_cursor(cursor)
+        statement = statement.where(
+            sort_key < tuple_(last_value, last_id) if descending else sort_key > tuple_(last_value, last_id)
+        )
+
+    order = (sort_column.desc(), Product.id.desc()) if descending else (sort_column.asc(), Product.id.asc())
+    rows = db.session.execute(statement.order_by(*order).limit(limit + 1)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        product, inventory, _ = rows[-1]
+        last_value = {"name": product.name, "quantity": inventory.quantity, "price": product.selling_price}[field]
+        next_cursor = encode_cursor([last_value, product.id])
+
+    return {"items": [tuple(row) for row in rows], "next_cursor": next_cursor}
+
+
+def serialize_inventory_row(product: Product, inventory: Inventory, category: Optional[Category]) -> Dict:
+    """Return the JSON form of a listing row."""
+    return {
+        "id": product.id,
+        "name": product.name,
+        "sku": product.sku,
+        "barcode": product.barcode,
+        "category": category.name if category else "Uncategorized",
+        "category_id": product.category_id,
+        "supplier_id": product.supplier_id,
+        "selling_price": product.selling_price,
+        "quantity": inventory.quantity,
+        "reorder_level": inventory.reorder_level,
+        "is_active": product.is_active,
+    }
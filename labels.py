@@ -0,0 +1,445 @@
+"""
+Server-side barcode and price label rendering.
+
+Printing thousands of shelf labels used to be left to the browser, which drew
+every barcode with JsBarcode and froze the till. Labels are now rendered on
+the server into a PDF of 1-bit raster pages at the printer's resolution:
+
+1. Each label follows a saved ``LabelTemplate`` config (the label designer's
+   title, price, barcode and size options). Labels are laid out in a grid on
+   A4 sheets, or one per page for roll label printers
+2. Barcode bars are drawn once per code, bar width and height, and each line
+   of text once per string and size, then reused from LRU caches. EAN-13,
+   UPC-A and EAN-8 codes are encoded; any other code is printed as text only
+3. Batches of more than ``PROCESS_POOL_THRESHOLD`` labels are rendered one page
+   per task across a process pool. Pages are written to the PDF in order as
+   they arrive, so memory does not grow with the size of the batch. If a pool
+   worker dies, the broken pool is discarded (the next batch starts a fresh
+   one) and the rest of the batch is rendered inline
+"""
+
+import logging
+import multiprocessing
+import os
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from itertools import repeat
+from typing import BinaryIO, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+from sqlalchemy import select
+
+from extensions import db
+from models import Product
+
+# Labels per request. Rendering runs inside the request on the single gunicorn
+# worker, so a batch must finish in seconds, well inside its 30 s timeout
+MAX_LABELS = 2000
+GLYPH_CACHE_SIZE = 4096  # rendered barcodes kept per process
+PROCESS_POOL_THRESHOLD = 500  # labels above which pages are rendered in a process pool
+LABEL_RENDER_WORKERS = min(4, os.cpu_count() or 1)
+
+A4_MM = (210.0, 297.0)
+SHEET_MARGIN_MM = 5.0
+SHEET_GAP_MM = 2.0
+LABEL_PADDING_MM = 1.5
+FONT_SIZES_MM = {"small": 2.4, "medium": 3.0, "large": 3.8}
+LAYOUTS = ("sheet", "roll")
+
+# EAN left-hand odd (L) patterns; R is the complement of L and G is R reversed
+_EAN_L = ["0001101", "0011001", "0010011", "0111101", "0100011",
+          "0110001", "0101111", "0111011", "0110111", "0001011"]
+_EAN_R = ["".join("1" if bit == "0" else "0" for bit in code) for code in _EAN_L]
+_EAN_G = [code[::-1] for code in _EAN_R]
+# L/G parity of the left-hand digits of an EAN-13, by first digit
+_EAN13_PARITY = ["LLLLLL", "LLGLGG", "LLGGLG", "LLGGGL", "LGLLGG",
+                 "LGGLLG", "LGGGLL", "LGLGLG", "LGLGGL", "LGGLGL"]
+_EAN_QUIET_MODULES = 18  # 11 on the left and 7 on the right of an EAN-13
+
+logger = logging.getLogger(__name__)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+class LabelError(Exception):
+    """Exception raised for a label request that cannot be rendered."""
+    pass
+
+
+class LabelSpec:
+    """Label size, content and page layout, from a ``LabelTemplate`` config."""
+
+    __slots__ = (
+        "title", "custom_title", "show_price", "show_barcode", "show_barcode_value",
+        "width_mm", "height_mm", "font_size", "layout", "columns", "dpi"
+    )
+
+    def __init__(self, title: str = "name", custom_title: str = "", show_price: bool = True,
+                 show_barcode: bool = True, show_barcode_value: bool = True,
+                 width_mm: float = 50.0, height_mm: float = 30.0, font_size: str = "medium",
+                 layout: str = "sheet", columns: int = 2, dpi: int = 300):
+        self.title = title if title in ("name", "sku", "custom", "none") else "name"
+        self.custom_title = custom_title or ""
+        self.show_price = show_price
+        self.show_barcode = show_barcode
+        self.show_barcode_value = show_barcode_value
+        self.width_mm = min(max(width_mm, 20.0), 150.0)
+        self.height_mm = min(max(height_mm, 10.0), 100.0)
+        self.font_size = font_size if font_size in FONT_SIZES_MM else "medium"
+        self.layout = layout if layout in LAYOUTS else "sheet"
+        self.columns = min(max(columns, 1), 4)
+        self.dpi = min(max(dpi, 150), 600)
+
+    @classmethod
+    def from_config(cls, config: Dict, **overrides) -> "LabelSpec":
+        """
+        Build a spec from a label designer config, as saved in ``LabelTemplate.config``.
+
+        Args:
+            config: Config dictionary (title, customTitle, showPrice, showBarcode,
+                showBarcodeValue, width, height, fontSize, and optionally
+                layout, columns and dpi)
+            **overrides: Values that take precedence over the config, where not None
+
+        Raises:
+            LabelError: If a size or count is not a number
+        """
+        try:
+            values = {
+                "title": config.get("title", "name"),
+                "custom_title": config.get("customTitle", ""),
+                "show_price": bool(config.get("showPrice", True)),
+                "show_barcode": bool(config.get("showBarcode", True)),
+                "show_barcode_value": bool(config.get("showBarcodeValue", True)),
+                "width_mm": float(config.get("width") or 50),
+                "height_mm": float(config.get("height") or 30),
+                "font_size": config.get("fontSize", "medium"),
+                "layout": config.get("layout", "sheet"),
+                "columns": int(config.get("columns") or 2),
+                "dpi": int(config.get("dpi") or 300),
+            }
+        except (TypeError, ValueError) as e:
+            raise LabelError(f"Invalid label template: {str(e)}")
+        values.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(**values)
+
+    def px(self, mm: float) -> int:
+        return int(round(mm * self.dpi / 25.4))
+
+    @property
+    def page_size(self) -> Tuple[int, int]:
+        if self.layout == "roll":
+            return self.px(self.width_mm), self.px(self.height_mm)
+        return self.px(A4_MM[0]), self.px(A4_MM[1])
+
+    @property
+    def grid(self) -> Tuple[int, int]:
+        """Columns and rows of labels on a page."""
+        if self.layout == "roll":
+            return 1, 1
+        fit_columns = int((A4_MM[0] - 2 * SHEET_MARGIN_MM + SHEET_GAP_MM) // (self.width_mm + SHEET_GAP_MM))
+        fit_rows = int((A4_MM[1] - 2 * SHEET_MARGIN_MM + SHEET_GAP_MM) // (self.height_mm + SHEET_GAP_MM))
+        return max(1, min(self.columns, fit_columns)), max(1, fit_rows)
+
+    @property
+    def labels_per_page(self) -> int:
+        columns, rows = self.grid
+        return columns * rows
+
+
+def _ean_check_digit(digits: str) -> str:
+    # Weights alternate 3, 1 from the rightmost data digit
+    total = sum(int(digit) * (3 if index % 2 == 0 else 1) for index, digit in enumerate(reversed(digits)))
+    return str((10 - total % 10) % 10)
+
+
+def ean_modules(code: Optional[str]) -> Optional[str]:
+    """
+    Encode an EAN-13, UPC-A or EAN-8 code as a string of bar (1) and space (0) modules.
+
+    Returns None for anything else, including a code whose check digit is wrong.
+    """
+    if not code or not (code.isascii() and code.isdigit()):
+        return None
+    if len(code) == 12:
+        code = "0" + code  # UPC-A is EAN-13 with a leading zero
+    if len(code) not in (8, 13) or _ean_check_digit(code[:-1]) != code[-1]:
+        return None
+
+    digits = [int(digit) for digit in code]
+    if len(code) == 8:
+        left = "".join(_EAN_L[digit] for digit in digits[:4])
+        right = "".join(_EAN_R[digit] for digit in digits[4:])
+    else:
+        parity = _EAN13_PARITY[digits[0]]
+        left = "".join((_EAN_L if side == "L" else _EAN_G)[digit] for side, digit in zip(parity, digits[1:7]))
+        right = "".join(_EAN_R[digit] for digit in digits[7:])
+    return "101" + left + "01010" + right + "101"
+
+
+@lru_cache(maxsize=GLYPH_CACHE_SIZE)
+def barcode_glyph(code: str, module_px: int, height_px: int) -> Optional[Image.Image]:
+    """Render the bars of a code at a module width and height, or None if it cannot be encoded."""
+    modules = ean_modules(code)
+    if modules is None:
+        return None
+    glyph = Image.new("1", (len(modules) * module_px, height_px), 1)
+    draw = ImageDraw.Draw(glyph)
+    start = None
+    for index, module in enumerate(modules + "0"):
+        if module == "1" and start is None:
+            start = index
+        elif module == "0" and start is not None:
+            draw.rectangle([start * module_px, 0, index * module_px - 1, height_px - 1], fill=0)
+            start = None
+    return glyph
+
+
+@lru_cache(maxsize=32)
+def _font(size_px: int) -> ImageFont.ImageFont:
+    try:
+        return ImageFont.load_default(size=size_px)
+    except (TypeError, ImportError, OSError):  # Pillow without FreeType
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=GLYPH_CACHE_SIZE)
+def text_glyph(text: str, size_px: int, max_width: int) -> Image.Image:
+    """Render a line of text, cut short with an ellipsis to fit ``max_width``."""
+    font = _font(size_px)
+    if font.getlength(text) > max_width:
+        while text and font.getlength(text + "…") > max_width:
+            text = text[:-1]
+        text = text + "…" if text else ""
+    ascent, descent = font.getmetrics()
+    glyph = Image.new("1", (max(1, int(font.getlength(text)) + 1), ascent + descent), 1)
+    ImageDraw.Draw(glyph).text((0, 0), text, font=font, fill=0)
+    return glyph
+
+
+def draw_label(page: Image.Image, origin: Tuple[int, int], label: Sequence, spec: LabelSpec) -> None:
+    """
+    Draw one label onto a page.
+
+    Args:
+        page: 1-bit page image
+        origin: Top-left corner of the label on the page, in pixels
+        label: Tuple of (title, price text, barcode)
+        spec: Label spec
+    """
+    title, price, code = label
+    left, top = origin
+    width, height = spec.px(spec.width_mm), spec.px(spec.height_mm)
+    padding = spec.px(LABEL_PADDING_MM)
+    inner_width = width - 2 * padding
+    text_px = spec.px(FONT_SIZES_MM[spec.font_size])
+    y = top + padding
+
+    def centred(glyph, glyph_top):
+        page.paste(glyph, (left + (width - glyph.width) // 2, glyph_top))
+
+    if title:
+        glyph = text_glyph(title, text_px, inner_width)
+        centred(glyph, y)
+        y += glyph.height
+
+    if price:
+        glyph = text_glyph(price, int(text_px * 1.3), inner_width)
+        centred(glyph, y)
+        y += glyph.height + padding
+
+    if code and (spec.show_barcode or spec.show_barcode_value):
+        bottom = top + height - padding
+        if spec.show_barcode_value:
+            glyph = text_glyph(code, int(text_px * 0.8), inner_width)
+            bottom -= glyph.height
+            centred(glyph, bottom)
+
+        modules = ean_modules(code)
+        if spec.show_barcode and modules is not None and bottom - y > 0:
+            module_px = inner_width // (len(modules) + _EAN_QUIET_MODULES)
+            if module_px >= 1:
+                centred(barcode_glyph(code, module_px, bottom - y), y)
+
+
+def render_page(labels: Sequence[Sequence], spec: LabelSpec) -> Tuple[int, int, bytes]:
+    """
+    Draw one page of labels.
+
+    Returns:
+        Tuple of (width, height, Flate-compressed 1-bit rows), ready for a PDF image
+    """
+    page_width, page_height = spec.page_size
+    page = Image.new("1", (page_width, page_height), 1)
+    columns, _ = spec.grid
+    label_width, label_height = spec.px(spec.width_mm), spec.px(spec.height_mm)
+    margin = 0 if spec.layout == "roll" else spec.px(SHEET_MARGIN_MM)
+    gap = spec.px(SHEET_GAP_MM)
+
+    for index, label in enumerate(labels):
+        row, column = divmod(index, columns)
+        draw_label(page, (margin + column * (label_width + gap), margin + row * (label_height + gap)), label, spec)
+
+    return page_width, page_height, zlib.compress(page.tobytes(), 6)
+
+
+class _PdfWriter:
+    """Writes a PDF of full-page 1-bit images, one page at a time."""
+
+    def __init__(self, out: BinaryIO, dpi: int):
+        self.out = out
+        self.dpi = dpi
+        self.position = 0
+        self.offsets: Dict[int, int] = {}
+        self.page_ids: List[int] = []
+        self.next_id = 3  # 1 is the catalog, 2 the page tree
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self._object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+
+    def _write(self, data: bytes) -> None:
+        self.out.write(data)
+        self.position += len(data)
+
+    def _object(self, object_id: int, body: bytes, stream: Optional[bytes] = None) -> None:
+        self.offsets[object_id] = self.position
+        self._write(f"{object_id} 0 obj\n".encode() + body)
+        if stream is not None:
+            self._write(b"\nstream\n" + stream + b"\nendstream")
+        self._write(b"\nendobj\n")
+
+    def add_page(self, width: int, height: int, data: bytes) -> None:
+        image_id, contents_id, page_id = self.next_id, self.next_id + 1, self.next_id + 2
+        self.next_id += 3
+        width_pt, height_pt = width * 72 / self.dpi, height * 72 / self.dpi
+
+        self._object(image_id, (
+            f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+            f"/ColorSpace /DeviceGray /BitsPerComponent 1 /Filter /FlateDecode /Length {len(data)} >>"
+        ).encode(), data)
+        contents = f"q {width_pt:.2f} 0 0 {height_pt:.2f} 0 0 cm /Im0 Do Q".encode()
+        self._object(contents_id, f"<< /Length {len(contents)} >>".encode(), contents)
+        self._object(page_id, (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width_pt:.2f} {height_pt:.2f}] "
+            f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {contents_id} 0 R >>"
+        ).encode())
+        self.page_ids.append(page_id)
+
+    def close(self) -> None:
+        kids = " ".join(f"{page_id} 0 R" for page_id in self.page_ids)
+        self._object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>".encode())
+
+        xref = self.position
+        lines = [f"xref\n0 {self.next_id}\n", "0000000000 65535 f \n"]
+        lines.extend(f"{self.offsets[object_id]:010d} 00000 n \n" for object_id in range(1, self.next_id))
+        lines.append(f"trailer\n<< /Size {self.next_id} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n")
+        self._write("".join(lines).encode())
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Never fork: the request threads of this process may hold locks a forked child would inherit
+            _pool = ProcessPoolExecutor(
+                max_workers=LABEL_RENDER_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    global _pool
+    with _pool_lock:
+        # Another request may already have replaced it
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _rendered_pages(pages: List[List[Sequence]], spec: LabelSpec) -> Iterator[Tuple[int, int, bytes]]:
+    done = 0
+    if sum(len(page) for page in pages) > PROCESS_POOL_THRESHOLD and LABEL_RENDER_WORKERS > 1:
+        pool = _get_pool()
+        try:
+            for page in pool.map(render_page, pages, repeat(spec)):
+                yield page
+                done += 1
+        except BrokenProcessPool:
+            logger.warning(f"Label render pool broke after {done} of {len(pages)} pages; rendering the rest inline")
+            _discard_pool(pool)
+    for page in pages[done:]:
+        yield render_page(page, spec)
+
+
+def _pages(labels: List[Sequence], per_page: int) -> Iterator[List[Sequence]]:
+    for start in range(0, len(labels), per_page):
+        yield labels[start:start + per_page]
+
+
+def render_labels_pdf(labels: List[Sequence], spec: LabelSpec, out: BinaryIO) -> int:
+    """
+    Render labels into a paginated PDF.
+
+    Args:
+        labels: Tuples of (title, price text, barcode), in print order
+        spec: Label spec
+        out: Binary file the PDF is written to
+
+    Returns:
+        Number of pages written
+    """
+    writer = _PdfWriter(out, spec.dpi)
+    for width, height, data in _rendered_pages(list(_pages(labels, spec.labels_per_page)), spec):
+        writer.add_page(width, height, data)
+    writer.close()
+    return len(writer.page_ids)
+
+
+def product_labels(product_ids: Sequence[int], spec: LabelSpec, copies: int = 1) -> List[Tuple]:
+    """
+    Load the label contents for products, in name order.
+
+    The price is what the till charges, including tax.
+
+    Raises:
+        LabelError: If no products are selected or there are too many labels
+    """
+    if not product_ids:
+        raise LabelError("No products selected")
+    if len(product_ids) * copies > MAX_LABELS:
+        raise LabelError(f"At most {MAX_LABELS:,} labels can be printed at once; print larger runs in batches")
+
+    rows = db.session.execute(
+        select(Product.name, Product.sku, Product.barcode, Product.selling_price, Product.tax_rate)
+        .where(Product.id.in_(product_ids))
+        .order_by(Product.name, Product.id)
+    )
+    labels = []
+    for name, sku, barcode, selling_price, tax_rate in rows:
+        if spec.title == "name":
+            title = name
+        elif spec.title == "sku":
+            title = sku or ""
+        elif spec.title == "custom":
+            title = spec.custom_title
+        else:
+            title = ""
+        price = f"KES {(selling_price or 0.0) * (1 + (tax_rate or 0.0) / 100):,.2f}" if spec.show_price else ""
+        labels.extend(repeat((title, price, barcode or ""), copies))
+    return labels
+
+
+def get_glyph_cache_stats() -> Dict:
+    """
+    Get statistics about this process's barcode and text glyph caches.
+
+    Returns:
+        Dictionary with hits, misses, size and maximum size per cache
+    """
+    return {
+        name: {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max_size": info.maxsize}
+        for name, info in (("barcodes", barcode_glyph.cache_info()), ("text", text_glyph.cache_info()))
+    }
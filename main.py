@@ -1,4 +1,8 @@
 from app import app  # noqa: F401
+import import_jobs
+
+# The server process owns the import workers; pick up jobs a previous one left queued
+import_jobs.resume_jobs(app)
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
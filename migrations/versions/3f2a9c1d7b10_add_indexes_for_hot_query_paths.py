@@ -0,0 +1,38 @@
+"""Add indexes for hot query paths
+
+Revision ID: 3f2a9c1d7b10
+Revises: 
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1d7b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+# Tables are created by db.create_all(), which also creates these indexes on a
+# fresh database, so every index is created only if it is missing.
+INDEXES = [
+    ('ix_sale_store_status_date', 'sale', ['store_id', 'status', 'sale_date']),
+    ('ix_payment_reference', 'payment', ['reference']),
+    ('ix_payment_sale_id', 'payment', ['sale_id']),
+    ('ix_sale_item_sale_id', 'sale_item', ['sale_id']),
+    ('ix_inventory_store_product', 'inventory', ['store_id', 'product_id']),
+    ('ix_product_is_active', 'product', ['is_active']),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False, if_not_exists=True)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
@@ -0,0 +1,32 @@
+"""Add barcode sequence
+
+Revision ID: b3f7a1e9c4d2
+Revises: a8e2d5c7f3b1
+Create Date: 2026-10-18 01:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3f7a1e9c4d2'
+down_revision = 'a8e2d5c7f3b1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Rows are created on first allocation under each prefix
+    op.create_table(
+        'barcode_sequence',
+        sa.Column('prefix', sa.String(length=12), nullable=False),
+        sa.Column('next_value', sa.BigInteger(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('prefix'),
+        if_not_exists=True
+    )
+
+
+def downgrade():
+    op.drop_table('barcode_sequence', if_exists=True)
@@ -0,0 +1,57 @@
+"""Add sales rollups
+
+Revision ID: b7e41c2d9a35
+Revises: 3f2a9c1d7b10
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e41c2d9a35'
+down_revision = '3f2a9c1d7b10'
+branch_labels = None
+depends_on = None
+
+
+def _has_column(table, column):
+    return column in [c['name'] for c in sa.inspect(op.get_bind()).get_columns(table)]
+
+
+def upgrade():
+    # db.create_all() creates the rollup table on startup, but cannot add the
+    # new column to an existing sale table
+    if not _has_column('sale', 'payment_method'):
+        with op.batch_alter_table('sale') as batch_op:
+            batch_op.add_column(sa.Column('payment_method', sa.String(length=20), nullable=True))
+
+    op.create_table(
+        'sales_rollup',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('store_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('hour', sa.Integer(), nullable=False),
+        sa.Column('payment_method', sa.String(length=20), nullable=False),
+        sa.Column('sale_count', sa.Integer(), nullable=False),
+        sa.Column('total_amount', sa.Float(), nullable=False),
+        sa.Column('tax_amount', sa.Float(), nullable=False),
+        sa.Column('discount_amount', sa.Float(), nullable=False),
+        sa.Column('paid_amount', sa.Float(), nullable=False),
+        sa.Column('void_count', sa.Integer(), nullable=False),
+        sa.Column('void_amount', sa.Float(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['store_id'], ['store.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('store_id', 'day', 'hour', 'payment_method', name='_sales_rollup_bucket_uc'),
+        if_not_exists=True
+    )
+
+
+def downgrade():
+    op.drop_table('sales_rollup', if_exists=True)
+
+    if _has_column('sale', 'payment_method'):
+        with op.batch_alter_table('sale') as batch_op:
+            batch_op.drop_column('payment_method')
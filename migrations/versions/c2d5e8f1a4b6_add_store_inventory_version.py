@@ -0,0 +1,32 @@
+"""Add store inventory version
+
+Revision ID: c2d5e8f1a4b6
+Revises: b7e41c2d9a35
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2d5e8f1a4b6'
+down_revision = 'b7e41c2d9a35'
+branch_labels = None
+depends_on = None
+
+
+def _has_column(table, column):
+    return column in [c['name'] for c in sa.inspect(op.get_bind()).get_columns(table)]
+
+
+def upgrade():
+    if not _has_column('store', 'inventory_version'):
+        with op.batch_alter_table('store') as batch_op:
+            batch_op.add_column(sa.Column('inventory_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    if _has_column('store', 'inventory_version'):
+        with op.batch_alter_table('store') as batch_op:
+            batch_op.drop_column('inventory_version')
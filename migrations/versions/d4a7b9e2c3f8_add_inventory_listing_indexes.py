@@ -0,0 +1,39 @@
+"""Add inventory listing indexes
+
+Revision ID: d4a7b9e2c3f8
+Revises: c2d5e8f1a4b6
+Create Date: 2026-10-17 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a7b9e2c3f8'
+down_revision = 'c2d5e8f1a4b6'
+branch_labels = None
+depends_on = None
+
+
+# Sort keys for keyset pagination of /inventory
+INDEXES = [
+    ('ix_product_name', 'product', ['name']),
+    ('ix_product_selling_price', 'product', ['selling_price']),
+    ('ix_inventory_store_quantity', 'inventory', ['store_id', 'quantity']),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False, if_not_exists=True)
+
+    # Without table statistics SQLite sorts the whole store instead of walking
+    # the sort index, which defeats keyset pagination on large catalogues
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute('ANALYZE')
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
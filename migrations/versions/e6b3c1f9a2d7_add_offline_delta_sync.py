@@ -0,0 +1,66 @@
+"""Add offline delta sync
+
+Revision ID: e6b3c1f9a2d7
+Revises: d4a7b9e2c3f8
+Create Date: 2026-10-17 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6b3c1f9a2d7'
+down_revision = 'd4a7b9e2c3f8'
+branch_labels = None
+depends_on = None
+
+
+# Watermark lookups for /api/sync/*
+INDEXES = [
+    ('ix_product_updated_at', 'product', ['updated_at']),
+    ('ix_inventory_store_updated_at', 'inventory', ['store_id', 'updated_at']),
+    ('ix_customer_updated_at', 'customer', ['updated_at']),
+]
+
+
+def _has_column(table, column):
+    return column in [c['name'] for c in sa.inspect(op.get_bind()).get_columns(table)]
+
+
+def upgrade():
+    if not _has_column('customer', 'updated_at'):
+        with op.batch_alter_table('customer') as batch_op:
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+        # Existing customers count as changed when they were created
+        op.execute('UPDATE customer SET updated_at = created_at')
+
+    op.create_table(
+        'sync_tombstone',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('entity', sa.String(length=20), nullable=False),
+        sa.Column('entity_id', sa.Integer(), nullable=False),
+        sa.Column('store_id', sa.Integer(), nullable=True),
+        sa.Column('deleted_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        if_not_exists=True
+    )
+    op.create_index(
+        'ix_sync_tombstone_entity_deleted_at', 'sync_tombstone', ['entity', 'deleted_at'],
+        unique=False, if_not_exists=True
+    )
+
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False, if_not_exists=True)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
+
+    op.drop_index('ix_sync_tombstone_entity_deleted_at', table_name='sync_tombstone', if_exists=True)
+    op.drop_table('sync_tombstone', if_exists=True)
+
+    if _has_column('customer', 'updated_at'):
+        with op.batch_alter_table('customer') as batch_op:
+            batch_op.drop_column('updated_at')
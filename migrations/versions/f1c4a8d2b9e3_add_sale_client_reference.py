@@ -0,0 +1,37 @@
+"""Add sale client reference
+
+Revision ID: f1c4a8d2b9e3
+Revises: e6b3c1f9a2d7
+Create Date: 2026-10-17 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1c4a8d2b9e3'
+down_revision = 'e6b3c1f9a2d7'
+branch_labels = None
+depends_on = None
+
+
+def _has_column(table, column):
+    return column in [c['name'] for c in sa.inspect(op.get_bind()).get_columns(table)]
+
+
+def upgrade():
+    if not _has_column('sale', 'client_reference'):
+        with op.batch_alter_table('sale') as batch_op:
+            batch_op.add_column(sa.Column('client_reference', sa.String(length=64), nullable=True))
+
+    # Unique so a till's retried upload cannot record the same sale twice
+    op.create_index('ix_sale_client_reference', 'sale', ['client_reference'], unique=True, if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_sale_client_reference', table_name='sale', if_exists=True)
+
+    if _has_column('sale', 'client_reference'):
+        with op.batch_alter_table('sale') as batch_op:
+            batch_op.drop_column('client_reference')
@@ -29,6 +29,7 @@ class Store(db.Model):
     phone = db.Column(db.String(20))
     email = db.Column(db.String(100))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    inventory_version = db.Column(db.Integer, default=0, server_default='0', nullable=False)  # Bumped on every stock or catalogue change
 
     # Relationships
     users = db.relationship('User', backref='store', lazy=True)
@@ -37,6 +38,22 @@ class Store(db.Model):
     # Added missing relationship from HardwareConfiguration backref
     hardware_configurations = db.relationship('HardwareConfiguration', backref='store', lazy=True)
 
+    @staticmethod
+    def bump_inventory_version(store_id=None):
+        """Mark a store's stock as changed, or every store's when store_id is None.
+
+        Runs as a single UPDATE in the caller's transaction, so the new version
+        becomes visible together with the change it records.
+        """
+        statement = db.update(Store).values(inventory_version=Store.inventory_version + 1)
+        if store_id is not None:
+            statement = statement.where(Store.id == store_id)
+        db.session.execute(statement.execution_options(synchronize_session=False))
+
+    @staticmethod
+    def get_inventory_version(store_id):
+        """Return the current inventory version of a store."""
+        return db.session.query(Store.inventory_version).filter(Store.id == store_id).scalar() or 0
 
     def __repr__(self):
         return f"<Store {self.name}>"
@@ -159,6 +176,13 @@ class Product(db.Model):
     supplier_id = db.Column(db.Integer, db.ForeignKey('supplier.id'))
     template_id = db.Column(db.Integer, db.ForeignKey('product_template.id'), nullable=True) # Added template_id
 
+    __table_args__ = (
+        db.Index('ix_product_is_active', 'is_active'),
+        db.Index('ix_product_name', 'name'),  # Keyset pagination of inventory listings
+        db.Index('ix_product_selling_price', 'selling_price'),
+        db.Index('ix_product_updated_at', 'updated_at'),  # Offline delta sync
+    )
+
     # Relationships
     inventory = db.relationship('Inventory', backref='product', lazy=True, uselist=False) # One-to-one for a specific store in Inventory table
     sale_items = db.relationship('SaleItem', backref='product', lazy=True)
@@ -168,27 +192,9 @@ class Product(db.Model):
         return self.selling_price * (1 + self.tax_rate / 100)
 
     def generate_barcode(self):
-        """Generate a unique barcode for this product."""
-        import random
-
-        # Use 616 as prefix (GS1 Kenya)
-        prefix = "616" # Corrected GS1 prefix for Kenya
-        # Add random digits to make a 12-digit number (for EAN-13)
-        # Needs 9 more digits for the item reference part
-        for _ in range(9):
-            prefix += str(random.randint(0, 9))
-
-        # Calculate check digit
-        total = 0
-        for i, digit_char in enumerate(prefix):
-            digit = int(digit_char)
-            if (i + 1) % 2 != 0: # Odd position (1st, 3rd, ...)
-                total += digit
-            else: # Even position (2nd, 4th, ...)
-                total += digit * 3
-        check_digit = (10 - (total % 10)) % 10
-
-        return prefix + str(check_digit)
+        """Allocate a unique EAN-13 barcode for this product (in the current transaction)."""
+        from barcode_allocator import allocate_barcode  # barcode_allocator imports this module
+        return allocate_barcode()
 
     def __repr__(self):
         return f"<Product {self.name}>"
@@ -206,7 +212,12 @@ class Inventory(db.Model):
     store_id = db.Column(db.Integer, db.ForeignKey('store.id'), nullable=False)
 
     # Unique constraint for product-store combination
-    __table_args__ = (db.UniqueConstraint('product_id', 'store_id', name='_product_store_uc'),)
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'store_id', name='_product_store_uc'),
+        db.Index('ix_inventory_store_product', 'store_id', 'product_id'),  # Store stock listings and joins
+        db.Index('ix_inventory_store_quantity', 'store_id', 'quantity'),  # Listings sorted by stock level
+        db.Index('ix_inventory_store_updated_at', 'store_id', 'updated_at'),  # Offline delta sync
+    )
 
     @property
     def is_low_stock(self):
@@ -225,6 +236,11 @@ class Customer(db.Model):
     address = db.Column(db.String(255))
     loyalty_points = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_customer_updated_at', 'updated_at'),  # Offline delta sync
+    )
 
     # Relationships
     sales = db.relationship('Sale', backref='customer', lazy=True)
@@ -243,6 +259,8 @@ class Sale(db.Model):
     discount_amount = db.Column(db.Float, default=0.0, nullable=False)
     total_amount = db.Column(db.Float, nullable=False)
     status = db.Column(db.String(20), default='completed', nullable=False)  # completed, voided, returned
+    payment_method = db.Column(db.String(20), nullable=True)  # Method chosen at checkout
+    client_reference = db.Column(db.String(64), nullable=True)  # Idempotency key sent by the till
     notes = db.Column(db.Text)
 
     # Foreign keys
@@ -250,6 +268,12 @@ class Sale(db.Model):
     customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=True) # Allow anonymous sales
     store_id = db.Column(db.Integer, db.ForeignKey('store.id'), nullable=False)
 
+    # Dashboard and sales reports filter on store, status and a date range
+    __table_args__ = (
+        db.Index('ix_sale_store_status_date', 'store_id', 'status', 'sale_date'),
+        db.Index('ix_sale_client_reference', 'client_reference', unique=True),
+    )
+
     # Relationships
     items = db.relationship('SaleItem', backref='sale', lazy=True, cascade="all, delete-orphan")
     payments = db.relationship('Payment', backref='sale', lazy=True, cascade="all, delete-orphan")
@@ -286,6 +310,10 @@ class SaleItem(db.Model):
     sale_id = db.Column(db.Integer, db.ForeignKey('sale.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
 
+    __table_args__ = (
+        db.Index('ix_sale_item_sale_id', 'sale_id'),
+    )
+
     # Removed 'total_price' in favor of 'line_total' for clarity
     # Removed 'tax_rate', renamed to 'tax_rate_applied'
     # Renamed 'discount_amount' to 'discount_amount_applied'
@@ -307,10 +335,102 @@ class Payment(db.Model):
     # Foreign keys
     sale_id = db.Column(db.Integer, db.ForeignKey('sale.id'), nullable=False)
 
+    # M-Pesa callbacks and status checks look payments up by reference
+    __table_args__ = (
+        db.Index('ix_payment_reference', 'reference'),
+        db.Index('ix_payment_sale_id', 'sale_id'),
+    )
+
     def __repr__(self):
         return f"<Payment {self.payment_method}: {self.amount} ({self.status})>"
 
 
+# Sales rollup - pre-aggregated sales per store, day, hour and payment method
+class SalesRollup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    store_id = db.Column(db.Integer, db.ForeignKey('store.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    hour = db.Column(db.Integer, nullable=False)  # 0-23
+    payment_method = db.Column(db.String(20), nullable=False)  # cash, mpesa, card, other
+    sale_count = db.Column(db.Integer, default=0, nullable=False)  # Completed sales
+    total_amount = db.Column(db.Float, default=0.0, nullable=False)
+    tax_amount = db.Column(db.Float, default=0.0, nullable=False)
+    discount_amount = db.Column(db.Float, default=0.0, nullable=False)
+    paid_amount = db.Column(db.Float, default=0.0, nullable=False)  # Completed payments
+    void_count = db.Column(db.Integer, default=0, nullable=False)
+    void_amount = db.Column(db.Float, default=0.0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # One row per bucket; rollups.py upserts into it
+    __table_args__ = (
+        db.UniqueConstraint('store_id', 'day', 'hour', 'payment_method', name='_sales_rollup_bucket_uc'),
+    )
+
+    def __repr__(self):
+        return f"<SalesRollup Store:{self.store_id} {self.day} {self.hour:02d}h {self.payment_method}>"
+
+
+# Sync tombstone - records deletions so offline tills can drop them on their next delta sync
+class SyncTombstone(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)  # product, customer
+    entity_id = db.Column(db.Integer, nullable=False)
+    store_id = db.Column(db.Integer, nullable=True)  # None when deleted for every store
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_sync_tombstone_entity_deleted_at', 'entity', 'deleted_at'),
+    )
+
+    def __repr__(self):
+        return f"<SyncTombstone {self.entity}:{self.entity_id} Store:{self.store_id}>"
+
+
+# Import job - a bulk product import running in the background, polled for progress
+class ImportJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    store_id = db.Column(db.Integer, db.ForeignKey('store.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    filename = db.Column(db.String(255), nullable=False)
+    status = db.Column(db.String(20), default='queued', nullable=False)  # queued, running, completed, failed
+    options = db.Column(db.Text)  # JSON column mapping and import options
+    total_bytes = db.Column(db.Integer, default=0, nullable=False)
+    bytes_read = db.Column(db.Integer, default=0, nullable=False)
+    rows_read = db.Column(db.Integer, default=0, nullable=False)
+    added = db.Column(db.Integer, default=0, nullable=False)
+    skipped = db.Column(db.Integer, default=0, nullable=False)
+    duplicate_skus = db.Column(db.Integer, default=0, nullable=False)
+    duplicate_barcodes = db.Column(db.Integer, default=0, nullable=False)
+    error_count = db.Column(db.Integer, default=0, nullable=False)
+    message = db.Column(db.String(500))  # Summary when finished, or why the job failed
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_import_job_store_created_at', 'store_id', 'created_at'),
+    )
+
+    @property
+    def options_dict(self):
+        """Return the options as a dictionary."""
+        return json.loads(self.options) if self.options else {}
+
+    def __repr__(self):
+        return f"<ImportJob {self.id} {self.filename} ({self.status})>"
+
+
+# Barcode sequence - next unreserved item reference per EAN-13 prefix, see barcode_allocator.py
+class BarcodeSequence(db.Model):
+    prefix = db.Column(db.String(12), primary_key=True)
+    next_value = db.Column(db.BigInteger, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<BarcodeSequence {self.prefix}: {self.next_value}>"
+
+
 # Label template model
 class LabelTemplate(db.Model):
     id = db.Column(db.Integer, primary_key=True)
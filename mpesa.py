@@ -1,26 +1,114 @@
 import os
 import requests
 import base64
+import threading
+import time
 from datetime import datetime
 import logging
 from flask import current_app
 
-def get_access_token():
-    """Get M-Pesa API access token."""
-    consumer_key = current_app.config.get('MPESA_CONSUMER_KEY')
-    consumer_secret = current_app.config.get('MPESA_CONSUMER_SECRET')
-    environment = current_app.config.get('MPESA_ENVIRONMENT', 'sandbox')
+from http_client import create_session
+
+# Connect and read timeouts (seconds) for calls to the Daraja API
+MPESA_CONNECT_TIMEOUT = 5
+MPESA_READ_TIMEOUT = 30
+MPESA_TIMEOUT = (MPESA_CONNECT_TIMEOUT, MPESA_READ_TIMEOUT)
+
+# Pooled keep-alive session shared by all M-Pesa calls
+_session = create_session()
+
+# Access tokens are refreshed this many seconds before they expire
+TOKEN_REFRESH_MARGIN = 300
+TOKEN_DEFAULT_LIFETIME = 3599
+
+
+class AccessTokenCache:
+    """
+    Thread-safe cache of M-Pesa OAuth access tokens.
     
-    if not consumer_key or not consumer_secret:
-        logging.error("M-Pesa credentials not configured")
-        return None
+    Tokens are kept until shortly before their `expires_in` lifetime runs out.
+    Inside the refresh margin the current token is still handed out while a
+    single background request fetches its replacement, and when no valid token
+    is cached concurrent callers wait on one shared request instead of each
+    hitting the OAuth endpoint.
+    """
     
-    # API URL based on environment
-    if environment == 'sandbox':
-        url = "https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
-    else:
-        url = "https://api.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
+    def __init__(self, refresh_margin=TOKEN_REFRESH_MARGIN):
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._tokens = {}  # (url, consumer_key) -> (token, refresh_at, expires_at)
+        self._in_flight = {}  # (url, consumer_key) -> threading.Event
+    
+    def get(self, url, consumer_key, consumer_secret):
+        """Return a valid access token, fetching one only if necessary."""
+        key = (url, consumer_key)
+        
+        with self._lock:
+            token, refresh_at, expires_at = self._tokens.get(key, (None, 0, 0))
+            now = time.monotonic()
+            
+            if token and now < expires_at:
+                if now >= refresh_at and key not in self._in_flight:
+                    # Refresh ahead of expiry without making this caller wait
+                    self._in_flight[key] = threading.Event()
+                    threading.Thread(
+                        target=self._fetch,
+                        args=(key, url, consumer_key, consumer_secret),
+                        name="mpesa-token-refresh",
+                        daemon=True
+                    ).start()
+                return token
+            
+            event = self._in_flight.get(key)
+            is_leader = event is None
+            if is_leader:
+                event = self._in_flight[key] = threading.Event()
+        
+        if is_leader:
+            self._fetch(key, url, consumer_key, consumer_secret)
+        else:
+            event.wait(MPESA_CONNECT_TIMEOUT + MPESA_READ_TIMEOUT)
+        
+        with self._lock:
+            token, _, expires_at = self._tokens.get(key, (None, 0, 0))
+            return token if token and time.monotonic() < expires_at else None
+    
+    def invalidate(self, url=None, consumer_key=None):
+        """Forget a cached token (or all tokens), e.g. after it is rejected."""
+        with self._lock:
+            if url is None:
+                self._tokens.clear()
+            else:
+                self._tokens.pop((url, consumer_key), None)
     
+    def _fetch(self, key, url, consumer_key, consumer_secret):
+        try:
+            result = _request_access_token(url, consumer_key, consumer_secret)
+            if result:
+                token, expires_in = result
+                now = time.monotonic()
+                refresh_at = now + expires_in - min(self.refresh_margin, expires_in / 2)
+                with self._lock:
+                    self._tokens[key] = (token, refresh_at, now + expires_in)
+        finally:
+            with self._lock:
+                event = self._in_flight.pop(key, None)
+            if event:
+                event.set()
+
+
+_token_cache = AccessTokenCache()
+
+
+def _oauth_url(environment):
+    """Get the OAuth endpoint for the configured environment."""
+    if environment == 'sandbox':
+        return "https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
+    return "https://api.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
+
+
+def _request_access_token(url, consumer_key, consumer_secret):
+    """Request a new access token. Returns (token, expires_in) or None."""
     # Create auth string and encode to base64
     auth_string = f"{consumer_key}:{consumer_secret}"
     auth_bytes = auth_string.encode('ascii')
@@ -31,15 +119,48 @@ def get_access_token():
     }
     
     try:
-        response = requests.get(url, headers=headers)
+        response = _session.get(url, headers=headers, timeout=MPESA_TIMEOUT)
         response.raise_for_status()  # Raise exception for HTTP errors
         
         result = response.json()
-        return result.get('access_token')
-    except requests.exceptions.RequestException as e:
+        token = result.get('access_token')
+        if not token:
+            return None
+        
+        try:
+            expires_in = int(result.get('expires_in', TOKEN_DEFAULT_LIFETIME))
+        except (TypeError, ValueError):
+            expires_in = TOKEN_DEFAULT_LIFETIME
+        return token, expires_in
+    except (requests.exceptions.RequestException, ValueError) as e:
         logging.error(f"Error getting M-Pesa access token: {str(e)}")
         return None
 
+
+def _token_cache_key():
+    """Get the token cache key for the current app configuration."""
+    environment = current_app.config.get('MPESA_ENVIRONMENT', 'sandbox')
+    return _oauth_url(environment), current_app.config.get('MPESA_CONSUMER_KEY')
+
+
+def _invalidate_rejected_token(error):
+    """Drop the cached token if the API rejected it as unauthorised."""
+    if getattr(error, 'response', None) is not None and error.response.status_code == 401:
+        _token_cache.invalidate(*_token_cache_key())
+
+
+def get_access_token():
+    """Get M-Pesa API access token, reusing a cached token while it is valid."""
+    consumer_key = current_app.config.get('MPESA_CONSUMER_KEY')
+    consumer_secret = current_app.config.get('MPESA_CONSUMER_SECRET')
+    environment = current_app.config.get('MPESA_ENVIRONMENT', 'sandbox')
+    
+    if not consumer_key or not consumer_secret:
+        logging.error("M-Pesa credentials not configured")
+        return None
+    
+    return _token_cache.get(_oauth_url(environment), consumer_key, consumer_secret)
+
 def format_timestamp():
     """Format timestamp for M-Pesa API."""
     return datetime.now().strftime('%Y%m%d%H%M%S')
@@ -111,10 +232,11 @@ def initiate_stk_push(phone_number, amount, reference):
     }
     
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        response = _session.post(url, json=payload, headers=headers, timeout=MPESA_TIMEOUT)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
+        _invalidate_rejected_token(e)
         logging.error(f"Error initiating STK push: {str(e)}")
         return {"ResponseCode": "1", "ResponseDescription": f"Request Error: {str(e)}"}
 
@@ -158,9 +280,49 @@ def check_transaction_status(checkout_request_id):
     }
     
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        response = _session.post(url, json=payload, headers=headers, timeout=MPESA_TIMEOUT)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
+        _invalidate_rejected_token(e)
         logging.error(f"Error checking transaction status: {str(e)}")
         return {"ResultCode": "1", "ResultDesc": f"Request Error: {str(e)}"}
+
+
+class StatusQueryThrottle:
+    """
+    Rate limit for STK push status queries to Safaricom.
+    
+    Tills poll our own database for the payment result, which the callback
+    writes. Safaricom is only asked directly once a payment has waited longer
+    than `query_after` seconds without a callback, and then at most once every
+    `interval` seconds per checkout request ID in this process.
+    """
+    
+    def __init__(self, query_after=30, interval=15):
+        self.query_after = query_after
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._last_query = {}  # checkout_request_id -> monotonic time of the last query
+    
+    def should_query(self, checkout_request_id, waited_seconds):
+        """Return True, and record the query, if the payment is due an upstream status query."""
+        if waited_seconds < self.query_after:
+            return False
+        
+        with self._lock:
+            now = time.monotonic()
+            last_query = self._last_query.get(checkout_request_id)
+            if last_query is not None and now - last_query < self.interval:
+                return False
+            self._last_query[checkout_request_id] = now
+            
+            # Forget payments nobody is still polling for
+            expired = [key for key, queried_at in self._last_query.items()
+                       if now - queried_at > self.interval * 40]
+            for key in expired:
+                del self._last_query[key]
+            return True
+
+
+status_query_throttle = StatusQueryThrottle()
@@ -0,0 +1,566 @@
+"""
+Bulk product import engine.
+
+Uploads are read as a stream of rows and imported in batches of
+``IMPORT_BATCH_SIZE``. Memory stays flat however large the file is, and each
+batch costs a fixed number of statements:
+
+1. Rows are parsed and validated in Python; a bad row is reported with its row
+   number and skipped, never failing the import
+2. Duplicate SKUs and barcodes are found with one ``IN`` query per column for
+   the whole batch, plus the codes already seen earlier in the same batch
+3. Unknown categories are created together, missing barcodes are allocated
+   as one block (see ``barcode_allocator``), then products go in as multi-row
+   ``INSERT ... RETURNING`` statements and their inventory rows as one
+   executemany
+4. Each batch commits on its own, bumping the store's inventory version, so a
+   long import never holds the database write lock for more than one batch
+
+The same engine serves the fixed-layout upload on the add-product page and the
+column-mapped import page, reading CSV with ``csv_rows`` and Excel workbooks
+with ``xlsx_rows``.
+"""
+
+import csv
+import io
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+import click
+from sqlalchemy import delete, insert, select
+
+from barcode_allocator import allocate_barcodes
+from extensions import db
+from models import Category, Inventory, Product, Store, Supplier
+
+try:
+    from openpyxl import load_workbook
+except ImportError:  # XLSX import is unavailable without openpyxl
+    load_workbook = None
+
+IMPORT_BATCH_SIZE = 1000  # rows validated and inserted per transaction
+MAX_KEPT_ERRORS = 1000  # error messages kept on the result; the count is always exact
+DEFAULT_TAX_RATE = 16.0  # Standard Kenyan VAT rate
+DEFAULT_REORDER_LEVEL = 5
+IMPORT_FORMATS = ("csv", "xlsx")
+
+FIELDS = (
+    "name", "description", "sku", "barcode", "selling_price",
+    "cost_price", "tax_rate", "category", "quantity"
+)
+
+
+class ProductImportError(Exception):
+    """Exception raised for an import that cannot be started."""
+    pass
+
+
+class ColumnMapping:
+    """Which column holds each product field, and the defaults for missing values."""
+
+    def __init__(
+        self,
+        columns: Dict[str, Optional[int]],
+        default_category_id: Optional[int] = None,
+        default_supplier_id: Optional[int] = None,
+        default_tax_rate: float = DEFAULT_TAX_RATE,
+        default_quantity: int = 0,
+        default_reorder_level: int = DEFAULT_REORDER_LEVEL,
+        default_cost_ratio: Optional[float] = None,
+        min_columns: int = 0
+    ):
+        if columns.get("name") is None:
+            raise ProductImportError("A column must be mapped to the product name")
+        self.columns = {field: columns.get(field) for field in FIELDS}
+        self.default_category_id = default_category_id
+        self.default_supplier_id = default_supplier_id
+        self.default_tax_rate = default_tax_rate
+        self.default_quantity = default_quantity
+        self.default_reorder_level = default_reorder_level
+        self.default_cost_ratio = default_cost_ratio  # cost = ratio x selling price when missing; 0 if None
+        self.min_columns = min_columns
+
+    @classmethod
+    def fixed_layout(cls, default_supplier_id: Optional[int] = None) -> "ColumnMapping":
+        """
+        The layout of the add-product bulk upload: Name, Description, SKU,
+        Barcode, Selling Price, Cost Price, Tax Rate, Category, Quantity.
+        """
+        return cls(
+            {field: index for index, field in enumerate(FIELDS)},
+            default_supplier_id=default_supplier_id,
+            default_cost_ratio=0.8,  # Default 20% markup
+            min_columns=5
+        )
+
+    @classmethod
+    def from_form(cls, form) -> "ColumnMapping":
+        """Build a mapping from the import page's ``column_*`` and ``default_*`` fields."""
+        def optional_int(key):
+            value = form.get(key)
+            return int(value) if value not in (None, "") else None
+
+        try:
+            return cls(
+                {field: optional_int(f"column_{field}") for field in FIELDS},
+                default_category_id=optional_int("default_category_id"),
+                default_supplier_id=optional_int("default_supplier_id"),
+                default_tax_rate=float(form.get("default_tax_rate") or DEFAULT_TAX_RATE),
+                default_quantity=int(form.get("default_quantity") or 0),
+                default_reorder_level=int(form.get("default_reorder_level") or DEFAULT_REORDER_LEVEL)
+            )
+        except ValueError as e:
+            raise ProductImportError(f"Invalid column mapping: {str(e)}")
+
+
+class ImportResult:
+    """Counts and errors from an import, updated as batches complete."""
+
+    def __init__(self):
+        self.rows_read = 0
+        self.added = 0
+        self.skipped = 0
+        self.duplicate_skus = 0
+        self.duplicate_barcodes = 0
+        self.error_count = 0
+        self.errors: List[str] = []
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows_read / self.elapsed if self.elapsed else 0.0
+
+    def summary(self) -> str:
+        """Describe the outcome for a flash message."""
+        message = f"Successfully imported {self.added} products"
+        details = []
+        if self.skipped:
+            details.append(f"{self.skipped} skipped")
+        if self.duplicate_skus:
+            details.append(f"{self.duplicate_skus} duplicate SKUs")
+        if self.duplicate_barcodes:
+            details.append(f"{self.duplicate_barcodes} duplicate barcodes")
+        if self.error_count:
+            details.append(f"{self.error_count} errors")
+        if details:
+            message += f" ({', '.join(details)})"
+        return message
+
+    def as_dict(self) -> Dict:
+        return {
+            "rows_read": self.rows_read,
+            "added": self.added,
+            "skipped": self.skipped,
+            "duplicate_skus": self.duplicate_skus,
+            "duplicate_barcodes": self.duplicate_barcodes,
+            "error_count": self.error_count,
+            "elapsed": round(self.elapsed, 3),
+            "rows_per_second": round(self.rows_per_second, 1),
+        }
+
+
+def csv_rows(stream, has_header: bool = False, encoding: str = "utf-8-sig") -> Iterator[List[str]]:
+    """
+    Read CSV rows from a binary stream without loading it into memory.
+
+    A UTF-8 byte order mark, as written by Excel, is dropped.
+    """
+    text = io.TextIOWrapper(stream, encoding=encoding, newline="")
+    try:
+        reader = csv.reader(text)
+        if has_header:
+            next(reader, None)
+        yield from reader
+    finally:
+        # Leave the underlying upload open for its owner
+        text.detach()
+
+
+def xlsx_available() -> bool:
+    """Return True when openpyxl is installed and XLSX uploads can be read."""
+    return load_workbook is not None
+
+
+def xlsx_rows(stream, has_header: bool = False) -> Iterator[Sequence]:
+    """
+    Read rows from every worksheet of an XLSX workbook without loading it into memory.
+
+    The workbook is opened read-only, so each sheet's XML is parsed as it is
+    iterated and only the shared strings are held. Sheets are read in order;
+    with ``has_header`` the first row of each sheet is skipped. Rows with no
+    values at all (formatting left below the data) are dropped.
+
+    Raises:
+        ProductImportError: If openpyxl is missing or the file is not a workbook
+    """
+    if not xlsx_available():
+        raise ProductImportError("XLSX import requires openpyxl to be installed")
+    try:
+        workbook = load_workbook(stream, read_only=True, data_only=True)
+    except Exception as e:
+        raise ProductImportError(f"Could not read the Excel workbook: {str(e)}")
+
+    try:
+        for sheet in workbook.worksheets:
+            # Exporters often write a wrong <dimension>; read every row present instead
+            sheet.reset_dimensions()
+            rows = sheet.iter_rows(values_only=True)
+            if has_header:
+                next(rows, None)
+            for row in rows:
+                if any(value is not None and value != "" for value in row):
+                    yield row
+    finally:
+        workbook.close()
+
+
+def file_format(filename: Optional[str]) -> Optional[str]:
+    """Return the import format for an uploaded file name, or None if unsupported."""
+    extension = (filename or "").rsplit(".", 1)[-1].lower()
+    if extension == "xlsx" and not xlsx_available():
+        return None
+    return extension if extension in IMPORT_FORMATS else None
+
+
+def read_rows(stream, import_format: str, has_header: bool = False) -> Iterator[Sequence]:
+    """Stream rows from an upload in one of ``IMPORT_FORMATS``."""
+    if import_format == "xlsx":
+        return xlsx_rows(stream, has_header=has_header)
+    return csv_rows(stream, has_header=has_header)
+
+
+def _text(value) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)  # spreadsheet codes arrive as floats
+    value = str(value).strip()
+    return value or None
+
+
+def _number(value, label: str) -> Optional[float]:
+    text = _text(value)
+    if text is None:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        raise ValueError(f"Invalid {label} '{text}'")
+
+
+def _whole_number(value, label: str) -> Optional[int]:
+    number = _number(value, label)
+    if number is None:
+        return None
+    if not number.is_integer():
+        raise ValueError(f"Invalid {label} '{_text(value)}'")
+    return int(number)
+
+
+def parse_row(row: Sequence, mapping: ColumnMapping) -> Optional[Dict]:
+    """
+    Turn one row into product values, applying the mapping's defaults.
+
+    Returns:
+        Dictionary of product values, or None for a row without a name
+
+    Raises:
+        ValueError: If the row is too short or a number cannot be read
+    """
+    if len(row) < mapping.min_columns:
+        raise ValueError("Not enough data. Need at least Name and Selling Price.")
+
+    def cell(field):
+        index = mapping.columns[field]
+        return row[index] if index is not None and index < len(row) else None
+
+    name = _text(cell("name"))
+    if not name:
+        return None
+
+    selling_price = _number(cell("selling_price"), "selling price") or 0.0
+    cost_price = _number(cell("cost_price"), "cost price")
+    if cost_price is None:
+        cost_price = selling_price * mapping.default_cost_ratio if mapping.default_cost_ratio else 0.0
+    tax_rate = _number(cell("tax_rate"), "tax rate")
+    quantity = _whole_number(cell("quantity"), "quantity")
+
+    return {
+        "name": name,
+        "description": _text(cell("description")) or f"Description for {name}",
+        "sku": _text(cell("sku")),  # Generated at insert time when missing
+        "barcode": _text(cell("barcode")),
+        "selling_price": selling_price,
+        "cost_price": cost_price,
+        "tax_rate": mapping.default_tax_rate if tax_rate is None else tax_rate,
+        "category": _text(cell("category")),
+        "quantity": mapping.default_quantity if quantity is None else quantity,
+    }
+
+
+def _generated_sku() -> str:
+    return f"SKU-{uuid.uuid4().hex[:8].upper()}"
+
+
+class _BatchImporter:
+    """Validates and inserts one batch of parsed rows at a time."""
+
+    def __init__(self, mapping: ColumnMapping, store_id: int, skip_duplicates: bool,
+                 result: ImportResult, on_error: Callable[[int, str, Sequence], None]):
+        self.mapping = mapping
+        self.store_id = store_id
+        self.skip_duplicates = skip_duplicates
+        self.result = result
+        self.on_error = on_error
+        self.categories = {name.lower(): category_id for category_id, name in db.session.execute(
+            select(Category.id, Category.name)
+        )}
+
+    def _existing(self, column, values) -> set:
+        if not values:
+            return set()
+        return set(db.session.execute(select(column).where(column.in_(values))).scalars())
+
+    def _drop_duplicates(self, batch: List) -> List:
+        existing_skus = self._existing(Product.sku, {record["sku"] for _, record, _ in batch})
+        existing_barcodes = self._existing(Product.barcode, {record["barcode"] for _, record, _ in batch if record["barcode"]})
+
+        kept = []
+        for row_num, record, row in batch:
+            duplicate = None
+            if record["sku"] and record["sku"] in existing_skus:
+                self.result.duplicate_skus += 1
+                duplicate = f"SKU '{record['sku']}' already exists"
+            elif record["barcode"] and record["barcode"] in existing_barcodes:
+                self.result.duplicate_barcodes += 1
+                duplicate = f"Barcode '{record['barcode']}' already exists"
+
+            if duplicate:
+                if self.skip_duplicates:
+                    self.result.skipped += 1
+                else:
+                    self.on_error(row_num, duplicate, row)
+                continue
+
+            if record["sku"]:
+                existing_skus.add(record["sku"])
+            if record["barcode"]:
+                existing_barcodes.add(record["barcode"])
+            kept.append((row_num, record, row))
+
+        self._generate_skus([record for _, record, _ in kept if not record["sku"]], existing_skus)
+        return kept
+
+    def _generate_skus(self, records: List[Dict], taken: set) -> None:
+        """Give rows without a SKU a generated one, drawing again on any collision."""
+        while records:
+            for record in records:
+                record["sku"] = _generated_sku()
+                while record["sku"] in taken:
+                    record["sku"] = _generated_sku()
+                taken.add(record["sku"])
+            clashes = self._existing(Product.sku, {record["sku"] for record in records})
+            records = [record for record in records if record["sku"] in clashes]
+
+    def _assign_barcodes(self, batch: List) -> None:
+        pending = [record for _, record, _ in batch if not record["barcode"]]
+        if pending:
+            given = {record["barcode"] for _, record, _ in batch if record["barcode"]}
+            for record, barcode in zip(pending, allocate_barcodes(len(pending), exclude=given)):
+                record["barcode"] = barcode
+
+    def _category_ids(self, batch: List) -> None:
+        new_names = {}
+        for _, record, _ in batch:
+            name = record["category"]
+            if name and name.lower() not in self.categories:
+                new_names.setdefault(name.lower(), name)
+        if new_names:
+            db.session.execute(insert(Category), [{"name": name} for name in new_names.values()])
+            self.categories.update({name.lower(): category_id for category_id, name in db.session.execute(
+                select(Category.id, Category.name).where(Category.name.in_(list(new_names.values())))
+            )})
+
+    def import_batch(self, batch: List) -> None:
+        batch = self._drop_duplicates(batch)
+        if not batch:
+            return
+        self._assign_barcodes(batch)
+        self._category_ids(batch)
+
+        # RETURNING without a guaranteed order lets SQLite batch the rows into
+        # multi-row INSERTs; the unique SKU maps each id back to its row
+        product_ids = dict(db.session.execute(
+            insert(Product).returning(Product.sku, Product.id),
+            [
+                {
+                    "name": record["name"],
+                    "description": record["description"],
+                    "sku": record["sku"],
+                    "barcode": record["barcode"],
+                    "selling_price": record["selling_price"],
+                    "cost_price": record["cost_price"],
+                    "tax_rate": record["tax_rate"],
+                    "category_id": (
+                        self.categories.get(record["category"].lower()) if record["category"]
+                        else self.mapping.default_category_id
+                    ),
+                    "supplier_id": self.mapping.default_supplier_id,
+                    "is_active": True,
+                }
+                for _, record, _ in batch
+            ]
+        ).all())
+
+        now = datetime.utcnow()
+        db.session.execute(insert(Inventory), [
+            {
+                "product_id": product_ids[record["sku"]],
+                "store_id": self.store_id,
+                "quantity": record["quantity"],
+                "reorder_level": self.mapping.default_reorder_level,
+                "last_restock_date": now if record["quantity"] > 0 else None,
+            }
+            for _, record, _ in batch
+        ])
+        Store.bump_inventory_version(self.store_id)
+        self.result.added += len(batch)
+
+
+def import_products(
+    rows: Iterable[Sequence],
+    mapping: ColumnMapping,
+    store_id: int,
+    skip_duplicates: bool = True,
+    batch_size: int = IMPORT_BATCH_SIZE,
+    on_progress: Optional[Callable[[ImportResult], None]] = None,
+    on_error: Optional[Callable[[int, str, Sequence], None]] = None
+) -> ImportResult:
+    """
+    Import products and their store inventory from a stream of rows.
+
+    Args:
+        rows: Row iterator, consumed lazily (see ``read_rows``)
+        mapping: Column mapping and defaults
+        store_id: Store that receives the inventory
+        skip_duplicates: Skip rows whose SKU or barcode exists; otherwise report them as errors
+        batch_size: Rows per transaction
+        on_progress: Called with the running result after each batch commits
+        on_error: Called with (row number, message, row) for each rejected row;
+            by default the first ``MAX_KEPT_ERRORS`` messages are kept on the result
+
+    Returns:
+        ImportResult with the final counts
+    """
+    result = ImportResult()
+
+    def record_error(row_num: int, message: str, row: Sequence) -> None:
+        result.error_count += 1
+        if on_error is not None:
+            on_error(row_num, message, row)
+        elif len(result.errors) < MAX_KEPT_ERRORS:
+            result.errors.append(f"Row {row_num}: {message}")
+
+    importer = _BatchImporter(mapping, store_id, skip_duplicates, result, record_error)
+
+    def flush(batch):
+        try:
+            importer.import_batch(batch)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        result.elapsed = time.monotonic() - result.started
+        if on_progress is not None:
+            on_progress(result)
+
+    batch = []
+    for row_num, row in enumerate(rows, 1):
+        result.rows_read += 1
+        try:
+            record = parse_row(row, mapping)
+        except ValueError as e:
+            record_error(row_num, str(e), row)
+            continue
+        if record is None:
+            result.skipped += 1
+            continue
+
+        batch.append((row_num, record, row))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+
+    flush(batch)
+    return result
+
+
+def register_commands(app) -> None:
+    """Register the ``flask products`` CLI commands."""
+
+    @app.cli.group("products")
+    def products_cli():
+        """Bulk product maintenance."""
+
+    @products_cli.command("import")
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--store-id", type=int, required=True, help="Store that receives the inventory.")
+    @click.option("--header/--no-header", default=True, show_default=True, help="Skip the first row.")
+    def import_command(path, store_id, header):
+        """Import a CSV or XLSX file in the add-product layout (Name, Description, SKU, Barcode, Selling Price, ...)."""
+        import_format = file_format(path)
+        if import_format is None:
+            raise click.ClickException(f"Unsupported file type; expected one of: {', '.join(IMPORT_FORMATS)}")
+        default_supplier_id = db.session.query(Supplier.id).order_by(Supplier.id).limit(1).scalar()
+        with open(path, "rb") as stream:
+            result = import_products(
+                read_rows(stream, import_format, has_header=header),
+                ColumnMapping.fixed_layout(default_supplier_id),
+                store_id
+            )
+        click.echo(f"{result.summary()} in {result.elapsed:.1f}s ({result.rows_per_second:,.0f} rows/s)")
+        for error in result.errors[:20]:
+            click.echo(error)
+
+    @products_cli.command("benchmark-import")
+    @click.option("--store-id", type=int, required=True, help="Store to import into.")
+    @click.option("--rows", type=int, default=200000, show_default=True, help="Rows in the generated catalogue.")
+    @click.option("--batch-size", type=int, default=IMPORT_BATCH_SIZE, show_default=True)
+    @click.option("--keep", is_flag=True, help="Keep the imported products instead of deleting them.")
+    def benchmark_command(store_id, rows, batch_size, keep):
+        """Import a generated supplier catalogue and report rows per second."""
+        tag = uuid.uuid4().hex[:6].upper()
+        categories = [f"Benchmark {tag} {index}" for index in range(20)]
+
+        with tempfile.TemporaryFile() as stream:
+            text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+            writer = csv.writer(text)
+            writer.writerow(["Name", "Description", "SKU", "Barcode", "Selling Price",
+                             "Cost Price", "Tax Rate", "Category", "Quantity"])
+            for index in range(rows):
+                price = 50 + index % 950
+                writer.writerow([f"Benchmark product {index}", "", f"BENCH-{tag}-{index}", "",
+                                 price, price * 0.8, 16, categories[index % len(categories)], index % 100])
+            text.flush()
+            text.detach()
+            stream.seek(0)
+
+            result = import_products(
+                csv_rows(stream, has_header=True), ColumnMapping.fixed_layout(), store_id, batch_size=batch_size
+            )
+
+        click.echo(f"Imported {result.added:,} of {result.rows_read:,} rows in {result.elapsed:.2f}s: "
+                   f"{result.rows_per_second:,.0f} rows/s")
+
+        if not keep:
+            product_ids = select(Product.id).where(Product.sku.like(f"BENCH-{tag}-%"))
+            db.session.execute(delete(Inventory).where(Inventory.product_id.in_(product_ids)))
+            db.session.execute(delete(Product).where(Product.sku.like(f"BENCH-{tag}-%")))
+            db.session.execute(delete(Category).where(Category.name.in_(categories)))
+            Store.bump_inventory_version(store_id)
+            db.session.commit()
+            click.echo("Removed the benchmark products")
@@ -0,0 +1,302 @@
+"""
+Product search index.
+
+On SQLite the catalogue is indexed in an FTS5 table over product name, SKU,
+barcode and category name. Triggers on ``product`` and ``category`` keep the
+index current, so products added, edited or imported by any code path
+(ORM or Core) are searchable as soon as their transaction commits.
+
+Searches match every typed word as a prefix and rank results with BM25,
+weighting the name above codes and the category. Databases without FTS5 fall
+back to a bounded ILIKE search.
+
+Scanned codes skip the search index entirely: ``resolve_code`` looks them up
+by exact barcode or SKU, remembering recent codes in an in-process LRU.
+"""
+
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import case, or_, text
+
+from extensions import db
+from models import Inventory, Product
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+CODE_CACHE_SIZE = 4096  # recently scanned codes remembered per process
+
+# BM25 column weights: name, sku, barcode, category
+RANK_WEIGHTS = (10.0, 5.0, 5.0, 1.0)
+
+_SEARCH_INDEX_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS product_search USING fts5(
+        name, sku, barcode, category,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS product_search_insert AFTER INSERT ON product BEGIN
+        INSERT INTO product_search (rowid, name, sku, barcode, category)
+        VALUES (NEW.id, NEW.name, NEW.sku, NEW.barcode,
+                (SELECT name FROM category WHERE id = NEW.category_id));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS product_search_update
+    AFTER UPDATE OF name, sku, barcode, category_id ON product BEGIN
+        DELETE FROM product_search WHERE rowid = OLD.id;
+        INSERT INTO product_search (rowid, name, sku, barcode, category)
+        VALUES (NEW.id, NEW.name, NEW.sku, NEW.barcode,
+                (SELECT name FROM category WHERE id = NEW.category_id));
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS product_search_delete AFTER DELETE ON product BEGIN
+        DELETE FROM product_search WHERE rowid = OLD.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS product_search_category_rename
+    AFTER UPDATE OF name ON category BEGIN
+        UPDATE product_search SET category = NEW.name
+        WHERE rowid IN (SELECT id FROM product WHERE category_id = NEW.id);
+    END
+    """,
+]
+
+_POPULATE_SQL = """
+    INSERT INTO product_search (rowid, name, sku, barcode, category)
+    SELECT product.id, product.name, product.sku, product.barcode, category.name
+    FROM product LEFT JOIN category ON category.id = product.category_id
+"""
+
+_SEARCH_SQL = f"""
+    SELECT product_search.rowid
+    FROM product_search
+    JOIN product ON product.id = product_search.rowid
+    JOIN inventory ON inventory.product_id = product.id AND inventory.store_id = :store_id
+    WHERE product_search MATCH :match AND product.is_active = 1
+    ORDER BY bm25(product_search, {', '.join(str(weight) for weight in RANK_WEIGHTS)})
+    LIMIT :limit
+"""
+
+_fts_enabled = False
+
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def init_search_index() -> bool:
+    """
+    Create the FTS5 index and its triggers if missing, filling a new index from the catalogue.
+
+    Returns:
+        True when the FTS5 index is in use, False when searches fall back to ILIKE
+    """
+    global _fts_enabled
+
+    if db.engine.dialect.name != "sqlite":
+        _fts_enabled = False
+        return False
+
+    try:
+        with db.engine.begin() as conn:
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'product_search'"
+            )).first() is not None
+            for statement in _SEARCH_INDEX_DDL:
+                conn.execute(text(statement))
+            if not exists:
+                conn.execute(text(_POPULATE_SQL))
+                logger.info("Built product search index")
+        _fts_enabled = True
+    except Exception as e:
+        # SQLite builds without FTS5 cannot create the table
+        logger.warning(f"Product search index unavailable, using ILIKE search: {str(e)}")
+        _fts_enabled = False
+
+    return _fts_enabled
+
+
+def rebuild_search_index() -> None:
+    """Repopulate the FTS5 index from the catalogue."""
+    if not _fts_enabled:
+        return
+    with db.engine.begin() as conn:
+        conn.execute(text("DELETE FROM product_search"))
+        conn.execute(text(_POPULATE_SQL))
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """
+    Turn user input into an FTS5 query matching every word as a prefix.
+
+    Each word is quoted, so FTS5 operators and punctuation in the input are
+    taken literally.
+    """
+    tokens = _TOKEN_PATTERN.findall(query)
+    if not tokens:
+        return None
+    return " ".join(f'"{token}"*' for token in tokens)
+
+
+def search_products(store_id: int, query: str, limit: int = DEFAULT_LIMIT) -> List[Tuple[Product, Inventory]]:
+    """
+    Find active products stocked in a store, best matches first.
+
+    Args:
+        store_id: Store whose inventory is searched
+        query: Text typed by the cashier
+        limit: Maximum number of results, capped at ``MAX_LIMIT``
+
+    Returns:
+        List of (Product, Inventory) tuples in rank order
+    """
+    limit = max(1, min(limit or DEFAULT_LIMIT, MAX_LIMIT))
+    query = (query or "").strip()
+    if not query:
+        return []
+
+    if _fts_enabled:
+        match = build_match_query(query)
+        if match is None:
+            return []
+        product_ids = db.session.execute(
+            text(_SEARCH_SQL), {"store_id": store_id, "match": match, "limit": limit}
+        ).scalars().all()
+        if not product_ids:
+            return []
+
+        rows = (
+            db.session.query(Product, Inventory)
+            .join(Inventory, Product.id == Inventory.product_id)
+            .filter(Inventory.store_id == store_id, Product.id.in_(product_ids))
+            .all()
+        )
+        position = {product_id: index for index, product_id in enumerate(product_ids)}
+        return sorted(rows, key=lambda row: position[row[0].id])
+
+    # Fallback: substring match, names starting with the query first
+    pattern = f"%{query}%"
+    return (
+        db.session.query(Product, Inventory)
+        .join(Inventory, Product.id == Inventory.product_id)
+        .filter(
+            Inventory.store_id == store_id,
+            Product.is_active == True,
+            or_(Product.name.ilike(pattern), Product.sku.ilike(pattern), Product.barcode.ilike(pattern))
+        )
+        .order_by(case((Product.name.ilike(f"{query}%"), 0), else_=1), Product.name)
+        .limit(limit)
+        .all()
+    )
+
+
+class CodeResolver:
+    """
+    Resolve scanned barcodes and SKUs to a store's product.
+
+    Recently scanned codes are kept in an LRU mapping code to product id, so a
+    repeat scan is a single primary-key lookup joined to the store's inventory.
+    The cached id is verified against the product's current barcode/SKU on
+    every hit, so an edited or reassigned code can never resolve to the wrong
+    product; a stale entry is simply dropped and looked up again. Stock is
+    never cached, so quantity_available is always current.
+    """
+
+    def __init__(self, maxsize: int = CODE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._codes: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stale": 0}
+
+    def _load(self, store_id: int, product_id: int, code: str) -> Optional[Tuple[Product, Inventory]]:
+        return (
+            db.session.query(Product, Inventory)
+            .join(Inventory, Product.id == Inventory.product_id)
+            .filter(
+                Product.id == product_id,
+                Inventory.store_id == store_id,
+                Product.is_active == True,
+                or_(Product.barcode == code, Product.sku == code)
+            )
+            .first()
+        )
+
+    def _lookup_product_id(self, code: str) -> Optional[int]:
+        # Both columns are unique, so each lookup is a single index probe
+        product_id = db.session.query(Product.id).filter(Product.barcode == code).scalar()
+        if product_id is None:
+            product_id = db.session.query(Product.id).filter(Product.sku == code).scalar()
+        return product_id
+
+    def resolve(self, store_id: int, code: str) -> Optional[Tuple[Product, Inventory]]:
+        """
+        Find the active product with this barcode or SKU in a store's inventory.
+
+        Args:
+            store_id: Store whose inventory the product must be in
+            code: Scanned barcode or SKU, matched exactly
+
+        Returns:
+            (Product, Inventory) tuple, or None if nothing matches
+        """
+        code = (code or "").strip()
+        if not code:
+            return None
+
+        with self._lock:
+            product_id = self._codes.get(code)
+            if product_id is not None:
+                self._codes.move_to_end(code)
+
+        if product_id is not None:
+            row = self._load(store_id, product_id, code)
+            if row is not None:
+                with self._lock:
+                    self._stats["hits"] += 1
+                return row
+            with self._lock:
+                self._stats["stale"] += 1
+                self._codes.pop(code, None)
+
+        with self._lock:
+            self._stats["misses"] += 1
+
+        product_id = self._lookup_product_id(code)
+        if product_id is None:
+            return None
+
+        row = self._load(store_id, product_id, code)
+        if row is not None:
+            with self._lock:
+                self._codes[code] = product_id
+                self._codes.move_to_end(code)
+                while len(self._codes) > self.maxsize:
+                    self._codes.popitem(last=False)
+        return row
+
+    def invalidate(self) -> None:
+        """Forget every cached code."""
+        with self._lock:
+            self._codes.clear()
+
+    @property
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats, cached_codes=len(self._codes))
+
+
+code_resolver = CodeResolver()
+
+
+def resolve_code(store_id: int, code: str) -> Optional[Tuple[Product, Inventory]]:
+    """Resolve a scanned barcode or SKU; see ``CodeResolver.resolve``."""
+    return code_resolver.resolve(store_id, code)
@@ -0,0 +1,237 @@
+"""
+Query-plan regression check for the indexes on the hot query paths.
+
+``flask query-plans check`` guards the indexes added for the dashboard, the
+sales report, checkout and the M-Pesa callback:
+
+1. A scratch SQLite database is created from the models and seeded with a
+   realistic volume of sales (a million by default), their lines and
+   payments, and ANALYZEd so the planner sees real statistics
+2. Each query is built the way the routes build it and run through
+   ``EXPLAIN QUERY PLAN``
+3. The check fails if a query does not use its expected index, or falls back
+   to a full table scan
+
+The live database is never touched.
+"""
+
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import List, Sequence, Tuple
+
+import click
+from sqlalchemy import create_engine, func, select, text
+
+from extensions import db
+from models import Customer, Inventory, Payment, Product, Sale, SaleItem
+
+SEED_STORES = 10
+SEED_PRODUCTS = 5000
+SEED_CUSTOMERS = 20000
+SEED_DAYS = 730  # sales are spread over this many days
+SEED_LINES_PER_SALE = 2
+
+# Each seeding statement counts rows with a recursive CTE, so a million sales
+# are generated inside SQLite without a round trip per row
+_SEED_STATEMENTS = (
+    """
+    WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :products)
+    INSERT INTO product (id, name, sku, selling_price, tax_rate, is_active)
+    SELECT i, 'Product ' || i, 'SKU-' || i, 10 + i % 990, 16, i % 10 != 0 FROM n
+    """,
+    """
+    WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < :stores * :products - 1)
+    INSERT INTO inventory (product_id, store_id, quantity, reorder_level)
+    SELECT i % :products + 1, i / :products + 1, i % 50, 5 FROM n
+    """,
+    """
+    WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :customers)
+    INSERT INTO customer (id, name, phone, loyalty_points)
+    SELECT i, 'Customer ' || i, '2547' || printf('%08d', i), 0 FROM n
+    """,
+    """
+    WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :sales)
+    INSERT INTO sale (id, reference, sale_date, subtotal, tax_amount, discount_amount, total_amount,
+                      status, payment_method, cashier_id, store_id, customer_id)
+    SELECT i, 'SALE-' || i,
+           strftime('%Y-%m-%d %H:%M:%f', :start, '+' || (i * :seconds_per_sale) || ' seconds'),
+           100, 16, 0, 116,
+           CASE WHEN i % 20 = 0 THEN 'voided' ELSE 'completed' END,
+           CASE i % 3 WHEN 0 THEN 'cash' WHEN 1 THEN 'mpesa' ELSE 'card' END,
+           1, i % :stores + 1, CASE WHEN i % 4 = 0 THEN i % :customers + 1 END
+    FROM n
+    """,
+    """
+    WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < :sales * :lines - 1)
+    INSERT INTO sale_item (sale_id, product_id, quantity, unit_price, tax_rate_applied,
+                           discount_amount_applied, line_total)
+    SELECT i / :lines + 1, i * 7 % :products + 1, 1, 50, 16, 0, 58 FROM n
+    """,
+    """
+    WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :sales)
+    INSERT INTO payment (sale_id, amount, payment_date, payment_method, reference, status)
+    SELECT i, 116, NULL, CASE i % 3 WHEN 0 THEN 'cash' WHEN 1 THEN 'mpesa' ELSE 'card' END,
+           CASE WHEN i % 3 = 1 THEN 'ws_CO_' || i END, 'completed'
+    FROM n
+    """,
+)
+
+
+class QueryPlanError(Exception):
+    """Exception raised when a query does not use its expected index."""
+    pass
+
+
+def seed_database(engine, sales: int) -> None:
+    """
+    Create the schema in a scratch database and fill it with generated data.
+
+    Args:
+        engine: Engine for an empty SQLite database
+        sales: Number of sales to generate
+    """
+    db.metadata.create_all(engine)
+    params = {
+        "stores": SEED_STORES,
+        "products": SEED_PRODUCTS,
+        "customers": SEED_CUSTOMERS,
+        "sales": sales,
+        "lines": SEED_LINES_PER_SALE,
+        "start": (datetime.utcnow() - timedelta(days=SEED_DAYS)).strftime("%Y-%m-%d %H:%M:%S"),
+        "seconds_per_sale": SEED_DAYS * 86400 // max(sales, 1),
+    }
+    with engine.begin() as connection:
+        for statement in _SEED_STATEMENTS:
+            connection.execute(text(statement), params)
+    with engine.begin() as connection:
+        connection.execute(text("ANALYZE"))
+
+
+def plan_checks(store_id: int = 1) -> List[Tuple[str, object, Sequence[str]]]:
+    """
+    Queries from the hot routes, each with the indexes it may use.
+
+    Returns:
+        List of (description, statement, acceptable index names); the plan
+        must use at least one of the indexes
+    """
+    end = datetime.utcnow()
+    start = end - timedelta(days=30)
+    report_filters = (
+        Sale.store_id == store_id,
+        Sale.sale_date >= start,
+        Sale.sale_date <= end,
+        Sale.status == 'completed'
+    )
+    return [
+        (
+            "dashboard: recent sales",
+            select(Sale).where(Sale.store_id == store_id, Sale.status == 'completed')
+            .order_by(Sale.sale_date.desc()).limit(5),
+            ["ix_sale_store_status_date"],
+        ),
+        (
+            "sales report: totals",
+            select(func.count(Sale.id), func.coalesce(func.sum(Sale.total_amount), 0.0)).where(*report_filters),
+            ["ix_sale_store_status_date"],
+        ),
+        (
+            "sales report: page of sales",
+            select(Sale).where(*report_filters).order_by(Sale.sale_date.desc(), Sale.id.desc()).limit(50),
+            ["ix_sale_store_status_date"],
+        ),
+        (
+            "sales report: payment methods",
+            select(Payment.payment_method, func.sum(Payment.amount))
+            .join(Sale, Sale.id == Payment.sale_id).where(*report_filters).group_by(Payment.payment_method),
+            ["ix_payment_sale_id"],
+        ),
+        (
+            "sale lines of a page of sales",
+            select(SaleItem).where(SaleItem.sale_id.in_(range(1000, 1050))),
+            ["ix_sale_item_sale_id"],
+        ),
+        (
+            "payments of a page of sales",
+            select(Payment).where(Payment.sale_id.in_(range(1000, 1050))),
+            ["ix_payment_sale_id"],
+        ),
+        (
+            "M-Pesa callback and status poll",
+            select(Payment).where(Payment.reference == 'ws_CO_1000').limit(1),
+            ["ix_payment_reference"],
+        ),
+        (
+            "dashboard: low stock",
+            select(Product, Inventory).join(Inventory, Product.id == Inventory.product_id)
+            .where(Inventory.store_id == store_id, Inventory.quantity <= Inventory.reorder_level),
+            # Any index leading on store_id serves this; the planner picks between them
+            ["ix_inventory_store_product", "ix_inventory_store_quantity", "ix_inventory_store_updated_at"],
+        ),
+        (
+            "inactive products",
+            select(Product).where(Product.is_active == False),  # noqa: E712
+            ["ix_product_is_active"],
+        ),
+        (
+            "customer by phone",
+            select(Customer).where(Customer.phone == '254700001000'),
+            ["sqlite_autoindex_customer_1"],  # The unique constraint on phone
+        ),
+    ]
+
+
+def explain(connection, statement) -> List[str]:
+    """Return the ``EXPLAIN QUERY PLAN`` detail lines for a statement."""
+    sql = str(statement.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True}))
+    return [row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+
+
+def check_plan(description: str, plan: List[str], indexes: Sequence[str]) -> None:
+    """
+    Check that a plan uses one of ``indexes`` and scans no table in full.
+
+    Raises:
+        QueryPlanError: If it does not
+    """
+    if not any(f"INDEX {index}" in line for line in plan for index in indexes):
+        raise QueryPlanError(f"{description}: expected {' or '.join(indexes)}, got {plan}")
+    full_scans = [line for line in plan if line.startswith("SCAN ") and " USING " not in line]
+    if full_scans:
+        raise QueryPlanError(f"{description}: full table scan in {plan}")
+
+
+def register_commands(app) -> None:
+    """Register the ``flask query-plans`` CLI commands."""
+
+    @app.cli.group("query-plans")
+    def query_plans_cli():
+        """Query-plan regression checks."""
+
+    @query_plans_cli.command("check")
+    @click.option("--sales", type=int, default=1000000, show_default=True, help="Sales in the seeded database.")
+    def check_command(sales):
+        """Seed a scratch database and check that the hot queries use their indexes."""
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine(f"sqlite:///{os.path.join(directory, 'plans.db')}")
+            started = time.perf_counter()
+            seed_database(engine, sales)
+            click.echo(f"Seeded {sales:,} sales in {time.perf_counter() - started:.1f}s")
+
+            failures = []
+            with engine.connect() as connection:
+                for description, statement, indexes in plan_checks():
+                    plan = explain(connection, statement)
+                    try:
+                        check_plan(description, plan, indexes)
+                    except QueryPlanError as e:
+                        failures.append(str(e))
+                        click.echo(f"FAIL {description}: {' / '.join(plan)}")
+                    else:
+                        click.echo(f"ok   {description}: {' / '.join(plan)}")
+            engine.dispose()
+
+        if failures:
+            raise click.ClickException(f"{len(failures)} queries do not use their indexes:\n" + "\n".join(failures))
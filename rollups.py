@@ -0,0 +1,328 @@
+"""
+Pre-aggregated sales rollups.
+
+Sales are summarised into one ``SalesRollup`` row per store, day, hour and
+payment method. The rows are kept up to date as sales happen:
+
+1. Checkout adds the sale (and, for cash/card, its payment)
+2. Payment completion adds the paid amount (M-Pesa callbacks and status
+   checks), guarded by a conditional UPDATE so it is counted once
+3. Voiding a sale moves it from the sales totals to the void totals
+
+Every update is an atomic upsert issued inside the caller's transaction, so a
+rollup can never disagree with the sale it was written alongside. The dashboard
+then reads today's KPIs from a handful of rollup rows instead of loading every
+sale. ``flask rollups rebuild`` recomputes the rows from historic sales.
+"""
+
+import logging
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+import click
+from sqlalchemy import and_, delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from extensions import db
+from models import Payment, Sale, SalesRollup
+
+logger = logging.getLogger(__name__)
+
+# Payment methods that get their own bucket; anything else is rolled up as 'other'
+PAYMENT_METHODS = ("cash", "mpesa", "card")
+UNKNOWN_PAYMENT_METHOD = "other"
+
+# Columns that are incremented by rollup updates
+ROLLUP_MEASURES = (
+    "sale_count", "total_amount", "tax_amount", "discount_amount",
+    "paid_amount", "void_count", "void_amount"
+)
+
+REBUILD_BATCH_SIZE = 1000  # rows streamed per fetch while rebuilding
+
+
+def _payment_method_bucket(payment_method: Optional[str]) -> str:
+    return payment_method if payment_method in PAYMENT_METHODS else UNKNOWN_PAYMENT_METHOD
+
+
+def _bucket_for(store_id: int, sale_date: Optional[datetime], payment_method: Optional[str]) -> Dict:
+    """Return the rollup key for a sale made at ``sale_date``."""
+    sale_date = sale_date or datetime.utcnow()
+    return {
+        "store_id": store_id,
+        "day": sale_date.date(),
+        "hour": sale_date.hour,
+        "payment_method": _payment_method_bucket(payment_method),
+    }
+
+
+def _increment(bucket: Dict, **deltas) -> None:
+    """
+    Add ``deltas`` to the rollup row for ``bucket``, creating the row if needed.
+
+    Uses INSERT .. ON CONFLICT DO UPDATE on SQLite and PostgreSQL so concurrent
+    checkouts never lose an increment. Other databases fall back to an UPDATE
+    followed by an INSERT when no row was touched.
+
+    Args:
+        bucket: Rollup key (store_id, day, hour, payment_method)
+        **deltas: Amounts to add, keyed by measure column name
+    """
+    deltas = {name: value for name, value in deltas.items() if value}
+    if not deltas:
+        return
+
+    table = SalesRollup.__table__
+    values = dict(bucket, updated_at=datetime.utcnow())
+    values.update({name: deltas.get(name, 0) for name in ROLLUP_MEASURES})
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert_stmt = sqlite_insert(table) if dialect == "sqlite" else postgresql_insert(table)
+        set_ = {name: table.c[name] + insert_stmt.excluded[name] for name in deltas}
+        set_["updated_at"] = insert_stmt.excluded.updated_at
+        db.session.execute(
+            insert_stmt.values(**values).on_conflict_do_update(
+                index_elements=["store_id", "day", "hour", "payment_method"],
+                set_=set_
+            )
+        )
+        return
+
+    bucket_filter = and_(*(table.c[key] == value for key, value in bucket.items()))
+    changes = {name: table.c[name] + value for name, value in deltas.items()}
+    changes["updated_at"] = values["updated_at"]
+    result = db.session.execute(update(table).where(bucket_filter).values(**changes))
+    if result.rowcount == 0:
+        db.session.execute(table.insert().values(**values))
+
+
+def record_sale(sale: Sale, payment_method: Optional[str], paid_amount: float = 0.0) -> None:
+    """
+    Add a completed sale to its rollup bucket.
+
+    Args:
+        sale: The sale, flushed so its store and date are set
+        payment_method: Payment method chosen at checkout
+        paid_amount: Amount already paid in full at checkout (cash and card)
+    """
+    _increment(
+        _bucket_for(sale.store_id, sale.sale_date, payment_method),
+        sale_count=1,
+        total_amount=sale.total_amount or 0.0,
+        tax_amount=sale.tax_amount or 0.0,
+        discount_amount=sale.discount_amount or 0.0,
+        paid_amount=paid_amount or 0.0
+    )
+
+
+def record_payment(payment: Payment) -> None:
+    """
+    Add a payment that has just completed to the bucket of the sale it pays for.
+
+    Call this only on the transition to 'completed' (see complete_payment) so
+    a repeated callback is not counted twice.
+    """
+    sale = payment.sale
+    _increment(
+        _bucket_for(sale.store_id, sale.sale_date, payment.payment_method),
+        paid_amount=payment.amount or 0.0
+    )
+
+
+def complete_payment(payment: Payment) -> bool:
+    """
+    Mark a payment completed and add it to its rollup bucket, exactly once.
+
+    The status change is a conditional UPDATE, so when a callback and a status
+    check race (or a callback is delivered twice) only the request whose UPDATE
+    changes the row records the payment. Runs in the caller's transaction.
+
+    Returns:
+        True if this call completed the payment, False if it already was
+    """
+    result = db.session.execute(
+        update(Payment)
+        .where(Payment.id == payment.id, Payment.status != "completed")
+        .values(status="completed")
+    )
+    if result.rowcount != 1:
+        return False
+    record_payment(payment)
+    return True
+
+
+def record_void(sale: Sale) -> None:
+    """Move a voided sale from the sales totals to the void totals of its bucket."""
+    _increment(
+        _bucket_for(sale.store_id, sale.sale_date, sale_payment_method(sale)),
+        sale_count=-1,
+        total_amount=-(sale.total_amount or 0.0),
+        tax_amount=-(sale.tax_amount or 0.0),
+        discount_amount=-(sale.discount_amount or 0.0),
+        void_count=1,
+        void_amount=sale.total_amount or 0.0
+    )
+
+
+def sale_payment_method(sale: Sale) -> str:
+    """
+    Return the payment method bucket a sale is rolled up under.
+
+    Sales made before ``Sale.payment_method`` was recorded fall back to the
+    method of their payments.
+    """
+    method = sale.payment_method
+    if method is None:
+        method = (
+            db.session.query(func.min(Payment.payment_method))
+            .filter(Payment.sale_id == sale.id)
+            .scalar()
+        )
+    return _payment_method_bucket(method)
+
+
+def get_sales_summary(store_id: int, start: date, end: Optional[date] = None) -> Dict:
+    """
+    Summarise sales for a store from the rollups.
+
+    Args:
+        store_id: Store to summarise
+        start: First day included
+        end: Day after the last day included (defaults to the day after ``start``)
+
+    Returns:
+        Dictionary with sale_count, total_amount, tax_amount, discount_amount,
+        paid_amount, void_count, void_amount and a by_payment_method breakdown
+    """
+    end = end or start + timedelta(days=1)
+    rows = (
+        db.session.query(
+            SalesRollup.payment_method,
+            *(func.coalesce(func.sum(getattr(SalesRollup, name)), 0) for name in ROLLUP_MEASURES)
+        )
+        .filter(
+            SalesRollup.store_id == store_id,
+            SalesRollup.day >= start,
+            SalesRollup.day < end
+        )
+        .group_by(SalesRollup.payment_method)
+        .all()
+    )
+
+    summary = {name: 0 for name in ROLLUP_MEASURES}
+    summary["by_payment_method"] = {}
+    for method, *measures in rows:
+        method_summary = dict(zip(ROLLUP_MEASURES, measures))
+        summary["by_payment_method"][method] = method_summary
+        for name, value in method_summary.items():
+            summary[name] += value
+
+    return summary
+
+
+def _stream(query) -> Iterable:
+    return db.session.execute(query.execution_options(yield_per=REBUILD_BATCH_SIZE))
+
+
+def rebuild_rollups(store_id: Optional[int] = None, since: Optional[date] = None) -> int:
+    """
+    Recompute rollups from the sales and payments tables.
+
+    Sales are streamed and aggregated in memory per bucket, so memory grows with
+    the number of buckets (stores x days x 24 x methods), not with the number of
+    sales. Existing rollup rows in scope are replaced in the same transaction.
+
+    Args:
+        store_id: Only rebuild this store (all stores when None)
+        since: Only rebuild from this day onwards (all history when None)
+
+    Returns:
+        Number of rollup rows written
+    """
+    buckets: Dict[Tuple, Dict] = {}
+
+    def add(store, sale_date, method, **deltas):
+        key = tuple(_bucket_for(store, sale_date, method).values())
+        bucket = buckets.setdefault(key, {name: 0 for name in ROLLUP_MEASURES})
+        for name, value in deltas.items():
+            bucket[name] += value or 0
+
+    sale_filters = []
+    if store_id is not None:
+        sale_filters.append(Sale.store_id == store_id)
+    if since is not None:
+        sale_filters.append(Sale.sale_date >= datetime.combine(since, datetime.min.time()))
+
+    # Same bucket as sale_payment_method(): the checkout method, else the payments' method
+    method_by_sale = (
+        select(Payment.sale_id, func.min(Payment.payment_method).label("payment_method"))
+        .group_by(Payment.sale_id)
+        .subquery()
+    )
+    sales = (
+        select(
+            Sale.store_id, Sale.sale_date, Sale.status, Sale.total_amount,
+            Sale.tax_amount, Sale.discount_amount,
+            func.coalesce(Sale.payment_method, method_by_sale.c.payment_method).label("payment_method")
+        )
+        .outerjoin(method_by_sale, method_by_sale.c.sale_id == Sale.id)
+        .where(Sale.status.in_(("completed", "voided")), *sale_filters)
+    )
+    for row in _stream(sales):
+        if row.status == "completed":
+            add(row.store_id, row.sale_date, row.payment_method,
+                sale_count=1, total_amount=row.total_amount,
+                tax_amount=row.tax_amount, discount_amount=row.discount_amount)
+        else:
+            add(row.store_id, row.sale_date, row.payment_method,
+                void_count=1, void_amount=row.total_amount)
+
+    payments = (
+        select(Sale.store_id, Sale.sale_date, Payment.payment_method, Payment.amount)
+        .join(Sale, Sale.id == Payment.sale_id)
+        .where(Payment.status == "completed", *sale_filters)
+    )
+    for row in _stream(payments):
+        add(row.store_id, row.sale_date, row.payment_method, paid_amount=row.amount)
+
+    rollup_filters = []
+    if store_id is not None:
+        rollup_filters.append(SalesRollup.store_id == store_id)
+    if since is not None:
+        rollup_filters.append(SalesRollup.day >= since)
+
+    try:
+        db.session.execute(delete(SalesRollup).where(*rollup_filters))
+        now = datetime.utcnow()
+        rows = [
+            dict(zip(("store_id", "day", "hour", "payment_method"), key), updated_at=now, **measures)
+            for key, measures in buckets.items()
+        ]
+        for offset in range(0, len(rows), REBUILD_BATCH_SIZE):
+            db.session.execute(SalesRollup.__table__.insert(), rows[offset:offset + REBUILD_BATCH_SIZE])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    logger.info(f"Rebuilt {len(buckets)} sales rollup rows")
+    return len(buckets)
+
+
+def register_commands(app) -> None:
+    """Register the ``flask rollups`` CLI commands."""
+
+    @app.cli.group("rollups")
+    def rollups_cli():
+        """Manage pre-aggregated sales rollups."""
+
+    @rollups_cli.command("rebuild")
+    @click.option("--store-id", type=int, default=None, help="Only rebuild this store.")
+    @click.option("--since", type=click.DateTime(formats=["%Y-%m-%d"]), default=None,
+                  help="Only rebuild from this day (YYYY-MM-DD).")
+    def rebuild_command(store_id, since):
+        """Backfill sales rollups from historic sales."""
+        count = rebuild_rollups(store_id=store_id, since=since.date() if since else None)
+        click.echo(f"Rebuilt {count} rollup rows")
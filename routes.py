@@ -1,4 +1,4 @@
-from flask import render_template, request, redirect, url_for, flash, jsonify, session, send_file, current_app, abort
+from flask import render_template, request, redirect, url_for, flash, jsonify, session, send_file, current_app, abort, Response, stream_with_context
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 from werkzeug.security import generate_password_hash
 from werkzeug.utils import secure_filename
@@ -8,22 +8,160 @@ import logging
 import csv
 import io
 import json
-import random
 import os
 import base64
+import tempfile
+
+from sqlalchemy import case, func, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
 
 from extensions import db
 from models import (
     User, Role, Store, Product, Category, Inventory,
     Sale, SaleItem, Customer, Payment, Supplier,
-    ProductTemplate, LabelTemplate, HardwareConfiguration
+    ProductTemplate, LabelTemplate, HardwareConfiguration, ImportJob
 )
 from auth import (
     login_required, admin_required, manager_required, not_cashier_required,
     register_user, authenticate_user, load_logged_in_user
 )
-from mpesa import initiate_stk_push, check_transaction_status
+from mpesa import initiate_stk_push, check_transaction_status, status_query_throttle
+import barcode_allocator
+import catalogue
+import delta_sync
 import etims
+import exports
+import import_jobs
+import inventory_listing
+import labels
+import product_import
+import product_search
+import rollups
+import sales_ingest
+import valuation
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 64  # Size of Sale.client_reference
+
+
+def _get_import_job(job_id):
+    """Load an import job visible to the current user, or 404."""
+    job = db.session.get(ImportJob, job_id)
+    if job is None or (job.store_id != session.get('store_id') and session.get('role') != Role.ADMIN):
+        abort(404)
+    return job
+
+
+def _checkout_response(sale, payment_success, etims_result=None):
+    """Build the checkout response for a sale, as returned to the till."""
+    # Get the cashier's name for the receipt
+    cashier = User.query.get(sale.cashier_id)
+
+    response_data = {
+        'success': True,
+        'sale_id': sale.id,
+        'reference': sale.reference,
+        'payment_success': payment_success,
+        'payment_reference': None,
+        'cashier_name': cashier.full_name if cashier else "Unknown"
+    }
+
+    # Add QR code and other eTIMS data to the response
+    if etims_result and etims_result.get('status') == 'queued':
+        response_data['etims'] = {
+            'status': etims_result.get('status'),
+            'qr_code': etims_result.get('qr_code'),
+            'tax_pin': current_app.config.get('TAX_PIN', ''),
+            'device_id': current_app.config.get('TIMS_DEVICE_ID', ''),
+            'fiscal_receipt_number': f"F1-{sale.reference}-{current_app.config.get('TIMS_DEVICE_ID', '')}",
+            'status_url': url_for('etims_sale_status', sale_id=sale.id)
+        }
+
+    return response_data
+
+
+def _replay_checkout(sale, total_amount):
+    """Answer a repeated checkout with the sale its idempotency key already recorded.
+
+    Nothing is written: stock, payments and the eTIMS queue were handled by
+    the first attempt. The receipt QR code is regenerated locally.
+    """
+    try:
+        same_total = abs((sale.total_amount or 0) - float(total_amount)) < 0.005
+    except (TypeError, ValueError):
+        same_total = False
+    if sale.store_id != session.get('store_id') or not same_total:
+        return jsonify({'success': False, 'message': 'Idempotency key was already used for a different sale'}), 409
+
+    paid = sale.payment_method != 'mpesa' or any(payment.status == 'completed' for payment in sale.payments)
+
+    etims_result = None
+    if current_app.config.get('ENABLE_TIMS', False):
+        try:
+            prepared = etims.prepare_sale_for_etims(sale.id)
+            if prepared.get('status') == 'prepared':
+                etims_result = {'status': 'queued', 'qr_code': prepared.get('qr_code')}
+        except Exception as e:
+            logging.error(f"eTIMS error replaying checkout: {str(e)}")
+
+    response = jsonify(_checkout_response(sale, paid, etims_result))
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _report_date_range():
+    """Parse the start/end date filters shared by the sales report and its export.
+
+    Both default to today. The returned end datetime covers the whole end day.
+    """
+    today = datetime.now().date()
+    start_date_str = request.args.get('start_date')
+    end_date_str = request.args.get('end_date')
+    start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date() if start_date_str else today
+    end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date() if end_date_str else today
+    return start_date, end_date, datetime.combine(end_date, datetime.max.time())
+
+
+def _list_inventory_page(store_id):
+    """Fetch the inventory page described by the request's sort, filter and cursor arguments."""
+    return inventory_listing.list_inventory(
+        store_id,
+        sort=request.args.get('sort'),
+        cursor=request.args.get('cursor'),
+        limit=request.args.get('limit', inventory_listing.DEFAULT_PAGE_SIZE, type=int),
+        category_id=request.args.get('category_id', type=int),
+        supplier_id=request.args.get('supplier_id', type=int),
+        stock=request.args.get('stock'),
+        active=request.args.get('active'),
+        search=request.args.get('q')
+    )
+
+
+def _product_json(product, inventory):
+    """Serialise a product and its store stock the way the POS expects."""
+    return {
+        'id': product.id,
+        'name': product.name,
+        'barcode': product.barcode,
+        'price': product.selling_price,
+        'price_with_tax': product.price_with_tax,
+        'tax_rate': product.tax_rate,
+        'quantity_available': inventory.quantity
+    }
+
+
+def _export_response(export_format, header, rows, filename, sheet_title):
+    """Stream report rows as a CSV or XLSX download."""
+    body = exports.stream_export(export_format, header, rows, sheet_title)
+    return Response(
+        stream_with_context(body),
+        mimetype=exports.EXPORT_FORMATS[export_format],
+        headers={
+            'Content-Disposition': f'attachment; filename={filename}.{export_format}',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
 
 def register_routes(app):
     """Register all application routes."""
@@ -106,6 +244,7 @@ def register_routes(app):
                         if product:
                             db.session.delete(product)
                 
+                Store.bump_inventory_version(store_id)
                 db.session.commit()
                 flash(f'Successfully removed {deleted_count} items from inventory.', 'success')
             else:
@@ -249,15 +388,9 @@ def register_routes(app):
     def dashboard():
         store_id = session.get('store_id')
         
-        # Get today's sales
+        # Today's sales totals come from the pre-aggregated rollups
         today = datetime.now().date()
-        tomorrow = today + timedelta(days=1)
-        today_sales = Sale.query.filter(
-            Sale.store_id == store_id,
-            Sale.sale_date >= today,
-            Sale.sale_date < tomorrow,
-            Sale.status == 'completed'
-        ).all()
+        today_summary = rollups.get_sales_summary(store_id, today)
         
         # Get low stock items
         low_stock_items = (
@@ -271,8 +404,8 @@ def register_routes(app):
         )
         
         # Summary statistics
-        today_sales_count = len(today_sales)
-        today_sales_amount = sum(sale.total_amount for sale in today_sales)
+        today_sales_count = today_summary['sale_count']
+        today_sales_amount = today_summary['total_amount']
         low_stock_count = len(low_stock_items)
         
         # Get recent sales
@@ -299,13 +432,8 @@ def register_routes(app):
     def pos():
         store_id = session.get('store_id')
         
-        # Get all products with inventory for the current store
-        products = (
-            db.session.query(Product, Inventory)
-            .join(Inventory, Product.id == Inventory.product_id)
-            .filter(Inventory.store_id == store_id, Product.is_active == True)
-            .all()
-        )
+        # Active products with this store's stock, served from the catalogue cache
+        products = list(catalogue.get_catalogue(store_id).entries())
         
         categories = Category.query.all()
         customers = Customer.query.all()
@@ -322,121 +450,98 @@ def register_routes(app):
     def checkout():
         data = request.json
         items = data.get('items', [])
-        customer_id = data.get('customer_id')
         payment_method = data.get('payment_method')
         total_amount = data.get('total_amount')
         
         if not items or not total_amount:
             return jsonify({'success': False, 'message': 'No items in cart'}), 400
         
+        # A retried checkout carries the key of the first attempt and gets its response back
+        idempotency_key = (request.headers.get('Idempotency-Key') or data.get('idempotency_key') or '').strip() or None
+        if idempotency_key:
+            if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+                return jsonify({'success': False, 'message': 'Idempotency key is too long'}), 400
+            
+            existing = Sale.query.filter_by(client_reference=idempotency_key).first()
+            if existing:
+                return _replay_checkout(existing, total_amount)
+        
         try:
-            # Generate unique reference number
-            reference = f"SALE-{uuid.uuid4().hex[:8].upper()}"
-            
-            # Create new sale
-            sale = Sale(
-                reference=reference,
-                cashier_id=session.get('user_id'),
-                customer_id=customer_id,
-                store_id=session.get('store_id'),
-                subtotal=data.get('subtotal', 0),
-                tax_amount=data.get('tax_amount', 0),
-                discount_amount=data.get('discount_amount', 0),
-                total_amount=total_amount,
-                status='completed'
+            # Create the sale, its items, stock movement and cash/card payment
+            sale, _, sold = sales_ingest.create_sale(
+                data, session.get('store_id'), session.get('user_id'), client_reference=idempotency_key
             )
-            db.session.add(sale)
-            db.session.flush()  # Get the sale ID without committing
-            
-            # Add sale items
-            for item in items:
-                sale_item = SaleItem(
-                    sale_id=sale.id,
-                    product_id=item['product_id'],
-                    quantity=item['quantity'],
-                    unit_price=item['unit_price'],
-                    # VVV THESE ARE THE CORRECTED LINES VVV
-                    tax_rate_applied=item.get('tax_rate', 0.0),          # Use new field: tax_rate_applied
-                    discount_amount_applied=item.get('discount_amount', 0.0), # Use new field: discount_amount_applied
-                    line_total=item.get('total_price', 0.0)             # Use new field: line_total (ensure item['total_price'] from frontend IS the line total)
-                    # ^^^ THESE ARE THE CORRECTED LINES ^^^
-                )
-                db.session.add(sale_item)
-                
-                # Update inventory
-                inventory = Inventory.query.filter_by(
-                    product_id=item['product_id'],
-                    store_id=session.get('store_id')
-                ).first()
-                
-                if inventory:
-                    inventory.quantity -= item['quantity']
-            
-            # Handle payment
-            payment_success = True
-            payment_reference = None
-            
-            if payment_method == 'mpesa':
-                # For M-Pesa, we'll return the sale ID and let the frontend handle the STK push
-                payment_success = False  # Will be completed asynchronously
-                
-            elif payment_method in ['cash', 'card']:
-                # Add payment record
-                payment = Payment(
-                    sale_id=sale.id,
-                    amount=total_amount,
-                    payment_method=payment_method,
-                    status='completed'
-                )
-                db.session.add(payment)
+            Store.bump_inventory_version(session.get('store_id'))
+            inventory_version = Store.get_inventory_version(session.get('store_id'))
             
             # Only commit if non-M-Pesa or if M-Pesa is just saved as pending
             db.session.commit()
+            catalogue.apply_stock_changes(
+                session.get('store_id'), {product_id: -quantity for product_id, quantity in sold.items()}, inventory_version
+            )
             
-            # Get the cashier's name for the receipt
-            cashier = User.query.get(session.get('user_id'))
-            cashier_name = cashier.full_name if cashier else "Unknown"
-            
-            # Process for KRA eTIMS if enabled
-            etims_data = None
+            # Queue the sale for KRA eTIMS if enabled. Transmission happens in the
+            # background so checkout never waits on the KRA API; the receipt gets
+            # the locally generated QR code straight away.
+            etims_result = None
             if current_app.config.get('ENABLE_TIMS', False):
                 try:
-                    # Process the sale for eTIMS compliance
-                    etims_result = etims.handle_sale_for_etims(sale.id)
-                    
-                    # Add QR code and other eTIMS data to the response
-                    if etims_result.get('status') in ('transmitted', 'queued', 'queued_after_failure'):
-                        etims_data = {
-                            'status': etims_result.get('status'),
-                            'qr_code': etims_result.get('qr_code'),
-                            'tax_pin': current_app.config.get('TAX_PIN', ''),
-                            'device_id': current_app.config.get('TIMS_DEVICE_ID', ''),
-                            'fiscal_receipt_number': f"F1-{sale.reference}-{current_app.config.get('TIMS_DEVICE_ID', '')}"
-                        }
+                    etims_result = etims.fiscalise_sale_async(sale.id)
                 except Exception as e:
                     logging.error(f"eTIMS error during checkout: {str(e)}")
                     # Continue even if eTIMS fails - we'll handle it in the offline queue
             
-            response_data = {
-                'success': True,
-                'sale_id': sale.id,
-                'reference': sale.reference,
-                'payment_success': payment_success,
-                'payment_reference': payment_reference,
-                'cashier_name': cashier_name
-            }
-            
-            # Add eTIMS data if available
-            if etims_data:
-                response_data['etims'] = etims_data
-                
-            return jsonify(response_data)
+            # For M-Pesa, we'll return the sale ID and let the frontend handle the STK push
+            return jsonify(_checkout_response(sale, payment_method != 'mpesa', etims_result))
+            
+        except IntegrityError:
+            db.session.rollback()
+            # A concurrent attempt with the same key committed first
+            existing = Sale.query.filter_by(client_reference=idempotency_key).first() if idempotency_key else None
+            if existing:
+                return _replay_checkout(existing, total_amount)
+            logging.error("Checkout integrity error")
+            return jsonify({'success': False, 'message': 'Sale could not be recorded'}), 500
             
         except Exception as e:
             db.session.rollback()
             logging.error(f"Checkout error: {str(e)}")
             return jsonify({'success': False, 'message': str(e)}), 500
     
+    @app.route('/pos/offline-sales', methods=['POST'])
+    @login_required
+    def upload_offline_sales():
+        """Record a batch of sales queued by a till while it was offline."""
+        data = request.get_json(silent=True) or {}
+        
+        try:
+            results = sales_ingest.ingest_offline_sales(
+                data.get('sales') or [], session.get('store_id'), session.get('user_id')
+            )
+        except sales_ingest.SaleIngestError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        except Exception as e:
+            # Chunks committed before the error stay recorded; a retry reports them as duplicates
+            db.session.rollback()
+            logging.error(f"Offline sales upload error: {str(e)}")
+            return jsonify({'success': False, 'message': str(e)}), 500
+        
+        if current_app.config.get('ENABLE_TIMS', False):
+            for result in results:
+                if result['status'] == 'created':
+                    try:
+                        etims.fiscalise_sale_async(result['sale_id'])
+                    except Exception as e:
+                        logging.error(f"eTIMS error during offline sales upload: {str(e)}")
+        
+        return jsonify({
+            'success': True,
+            'created': sum(1 for result in results if result['status'] == 'created'),
+            'duplicates': sum(1 for result in results if result['status'] == 'duplicate'),
+            'failed': sum(1 for result in results if result['status'] == 'failed'),
+            'results': results
+        })
+    
     @app.route('/pos/mpesa-payment', methods=['POST'])
     @login_required
     def mpesa_payment():
@@ -506,13 +611,14 @@ def register_routes(app):
                 return jsonify({'success': False, 'message': 'Payment not found'}), 404
             
             if result_code == 0:
-                # Payment successful
-                payment.status = 'completed'
+                # Payment successful; M-Pesa may deliver the same callback more than once
+                rollups.complete_payment(payment)
                 db.session.commit()
                 return jsonify({'success': True})
             else:
-                # Payment failed
-                payment.status = 'failed'
+                # Payment failed, unless a status check already saw it complete
+                Payment.query.filter(Payment.id == payment.id, Payment.status != 'completed')\
+                    .update({'status': 'failed'}, synchronize_session=False)
                 db.session.commit()
                 return jsonify({'success': False, 'message': result.get('ResultDesc', 'Payment failed')})
                 
@@ -537,12 +643,21 @@ def register_routes(app):
                     'is_complete': True
                 })
             
-            # If still pending, check with M-Pesa
+            # Still pending: the callback normally settles it, so only ask M-Pesa
+            # directly once it is overdue, and then only every so often
+            waited = (datetime.utcnow() - payment.payment_date).total_seconds() if payment.payment_date else 0
+            if not status_query_throttle.should_query(checkout_request_id, waited):
+                return jsonify({
+                    'success': True,
+                    'status': payment.status,
+                    'is_complete': False
+                })
+            
             response = check_transaction_status(checkout_request_id)
             
             if response.get('ResultCode') == '0':
-                # Update payment status
-                payment.status = 'completed'
+                # Update payment status; the callback may have completed it meanwhile
+                rollups.complete_payment(payment)
                 db.session.commit()
                 return jsonify({
                     'success': True,
@@ -560,6 +675,49 @@ def register_routes(app):
             logging.error(f"Check payment status error: {str(e)}")
             return jsonify({'success': False, 'message': str(e)}), 500
     
+    @app.route('/pos/void-sale/<int:sale_id>', methods=['POST'])
+    @login_required
+    @manager_required
+    def void_sale(sale_id):
+        """Void a completed sale and return its items to stock."""
+        try:
+            sale = Sale.query.filter_by(id=sale_id, store_id=session.get('store_id')).first()
+            if not sale:
+                return jsonify({'success': False, 'message': 'Sale not found'}), 404
+    
+            if sale.status != 'completed':
+                return jsonify({'success': False, 'message': f'Sale is already {sale.status}'}), 400
+    
+            quantities = {}
+            for product_id, quantity in db.session.query(SaleItem.product_id, SaleItem.quantity).filter_by(sale_id=sale.id):
+                quantities[product_id] = quantities.get(product_id, 0) + quantity
+    
+            if quantities:
+                db.session.execute(
+                    update(Inventory)
+                    .where(Inventory.store_id == sale.store_id, Inventory.product_id.in_(quantities))
+                    .values(quantity=Inventory.quantity + case(quantities, value=Inventory.product_id, else_=0))
+                    .execution_options(synchronize_session=False)
+                )
+                Store.bump_inventory_version(sale.store_id)
+            inventory_version = Store.get_inventory_version(sale.store_id)
+    
+            rollups.record_void(sale)
+            sale.status = 'voided'
+            reason = (request.get_json(silent=True) or {}).get('reason')
+            if reason:
+                sale.notes = f"{sale.notes}\nVoided: {reason}" if sale.notes else f"Voided: {reason}"
+            db.session.commit()
+            if quantities:
+                catalogue.apply_stock_changes(sale.store_id, quantities, inventory_version)
+    
+            return jsonify({'success': True, 'message': f'Sale {sale.reference} voided'})
+    
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Void sale error: {str(e)}")
+            return jsonify({'success': False, 'message': str(e)}), 500
+    
     # Inventory routes
     @app.route('/inventory')
     @login_required
@@ -567,15 +725,37 @@ def register_routes(app):
     def inventory():
         store_id = session.get('store_id')
         
-        inventory_items = (
-            db.session.query(Product, Inventory, Category)
-            .join(Inventory, Product.id == Inventory.product_id)
-            .outerjoin(Category, Product.category_id == Category.id)
-            .filter(Inventory.store_id == store_id)
-            .all()
-        )
+        try:
+            page = _list_inventory_page(store_id)
+        except inventory_listing.ListingError as e:
+            flash(str(e), 'warning')
+            return redirect(url_for('inventory'))
         
-        return render_template('inventory/index.html', inventory_items=inventory_items)
+        return render_template(
+            'inventory/index.html',
+            inventory_items=page['items'],
+            next_cursor=page['next_cursor'],
+            total_products=valuation.get_inventory_valuation(store_id)['product_count'],
+            categories=Category.query.order_by(Category.name).all(),
+            suppliers=Supplier.query.order_by(Supplier.name).all(),
+            filters=request.args
+        )
+    
+    @app.route('/api/inventory', methods=['GET'])
+    @login_required
+    @not_cashier_required
+    def api_inventory():
+        """Return one keyset page of the store's inventory for lazy loading."""
+        try:
+            page = _list_inventory_page(session.get('store_id'))
+        except inventory_listing.ListingError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        return jsonify({
+            'success': True,
+            'items': [inventory_listing.serialize_inventory_row(*row) for row in page['items']],
+            'next_cursor': page['next_cursor']
+        })
     
     @app.route('/inventory/add', methods=['GET', 'POST'])
     @manager_required
@@ -593,206 +773,32 @@ def register_routes(app):
                     flash('No selected file', 'danger')
                     return redirect(request.url)
                     
-                if file and file.filename.endswith('.csv'):
-                    # Process the CSV file
+                import_format = product_import.file_format(file.filename)
+                if file and import_format:
+                    # Stream the CSV or workbook through the bulk import engine
                     try:
-                        # Parse CSV
-                        stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
-                        csv_reader = csv.reader(stream)
-                        
-                        # Skip header row if indicated
-                        if request.form.get('header_row'):
-                            next(csv_reader)
-                            
-                        # Process each row
-                        products_added = 0
-                        errors = []
-                        skipped = 0
-                        
-                        # Cache data to minimize database queries
-                        categories_cache = {category.name.lower(): category.id for category in Category.query.all()}
-                        existing_skus = {product.sku for product in Product.query.with_entities(Product.sku).all() if product.sku}
-                        existing_barcodes = {product.barcode for product in Product.query.with_entities(Product.barcode).all() if product.barcode}
-                        
-                        # Process in batches for better performance
-                        batch_size = 100
-                        batch = []
-                        
-                        store_id = session.get('store_id')
                         default_supplier = Supplier.query.first()
-                        default_supplier_id = default_supplier.id if default_supplier else None
-                        
-                        for row_num, row in enumerate(csv_reader, 1):
-                            try:
-                                # CSV format should be: Name, Description, SKU, Barcode, Selling Price, Cost Price, Tax Rate, Category, Quantity
-                                if len(row) < 5:  # At minimum we need name and selling price
-                                    errors.append(f"Row {row_num}: Not enough data. Need at least Name and Selling Price.")
-                                    continue
-                                    
-                                name = row[0].strip()
-                                description = row[1].strip() if len(row) > 1 and row[1] else f"Description for {name}"
-                                sku = row[2].strip() if len(row) > 2 and row[2] else f"SKU-{uuid.uuid4().hex[:8].upper()}"
-                                barcode = row[3].strip() if len(row) > 3 and row[3] else None
-                                
-                                try:
-                                    selling_price = float(row[4]) if len(row) > 4 and row[4] else 0
-                                except ValueError:
-                                    errors.append(f"Row {row_num}: Invalid selling price '{row[4]}'")
-                                    continue
-                                
-                                try:
-                                    cost_price = float(row[5]) if len(row) > 5 and row[5] else selling_price * 0.8  # Default 20% markup
-                                except ValueError:
-                                    errors.append(f"Row {row_num}: Invalid cost price '{row[5]}'")
-                                    continue
-                                
-                                try:
-                                    tax_rate = float(row[6]) if len(row) > 6 and row[6] else 16.0  # Default VAT rate
-                                except ValueError:
-                                    errors.append(f"Row {row_num}: Invalid tax rate '{row[6]}'")
-                                    continue
-                                
-                                category_name = row[7].strip() if len(row) > 7 and row[7] else None
-                                
-                                try:
-                                    quantity = int(row[8]) if len(row) > 8 and row[8] else 0
-                                except ValueError:
-                                    errors.append(f"Row {row_num}: Invalid quantity '{row[8]}'")
-                                    continue
-                                
-                                # Skip rows without a product name
-                                if not name:
-                                    skipped += 1
-                                    continue
-                                    
-                                # Check for duplicates if option is enabled
-                                if request.form.get('skip_duplicates', 'on') == 'on':
-                                    if sku and sku in existing_skus:
-                                        skipped += 1
-                                        continue
-                                    
-                                    if barcode and barcode in existing_barcodes:
-                                        skipped += 1
-                                        continue
-                                
-                                # Determine category ID
-                                category_id = None
-                                if category_name:
-                                    category_name_lower = category_name.lower()
-                                    if category_name_lower in categories_cache:
-                                        category_id = categories_cache[category_name_lower]
-                                    else:
-                                        # Create new category if it doesn't exist
-                                        new_category = Category(name=category_name)
-                                        db.session.add(new_category)
-                                        db.session.flush()
-                                        category_id = new_category.id
-                                        categories_cache[category_name_lower] = category_id
-                                
-                                # Generate barcode if not provided
-                                if not barcode:
-                                    # Generate a unique EAN-13 barcode
-                                    barcode = "590"  # Example prefix for Kenya
-                                    for _ in range(9):
-                                        barcode += str(random.randint(0, 9))
-                                    
-                                    # Calculate check digit
-                                    total = 0
-                                    for i, digit in enumerate(barcode):
-                                        total += int(digit) * (1 if i % 2 == 0 else 3)
-                                    check_digit = (10 - (total % 10)) % 10
-                                    barcode += str(check_digit)
-                                
-                                # Create product
-                                product = Product(
-                                    name=name,
-                                    description=description,
-                                    sku=sku,
-                                    barcode=barcode,
-                                    selling_price=selling_price,
-                                    cost_price=cost_price,
-                                    tax_rate=tax_rate,
-                                    category_id=category_id,
-                                    supplier_id=default_supplier_id,
-                                    is_active=True
-                                )
-                                
-                                # Add to batch for bulk insert
-                                batch.append(product)
-                                
-                                # Process in batches to improve performance
-                                if len(batch) >= batch_size:
-                                    db.session.add_all(batch)
-                                    db.session.flush()  # Get IDs without committing
-                                    
-                                    # Create inventory entries for each product in batch
-                                    for prod in batch:
-                                        inventory = Inventory(
-                                            product_id=prod.id,
-                                            store_id=store_id,
-                                            quantity=quantity,
-                                            reorder_level=5,
-                                            last_restock_date=datetime.utcnow() if quantity > 0 else None
-                                        )
-                                        db.session.add(inventory)
-                                        
-                                        # Update tracking
-                                        existing_skus.add(prod.sku)
-                                        existing_barcodes.add(prod.barcode)
-                                    
-                                    products_added += len(batch)
-                                    batch = []
-                                
-                            except Exception as e:
-                                errors.append(f"Row {row_num}: {str(e)}")
-                                continue
+                        result = product_import.import_products(
+                            product_import.read_rows(
+                                file.stream, import_format, has_header=bool(request.form.get('header_row'))
+                            ),
+                            product_import.ColumnMapping.fixed_layout(default_supplier.id if default_supplier else None),
+                            session.get('store_id'),
+                            skip_duplicates=request.form.get('skip_duplicates', 'on') == 'on'
+                        )
                         
-                        # Process any remaining products in the last batch
-                        if batch:
-                            db.session.add_all(batch)
-                            db.session.flush()
-                            
-                            # Create inventory entries for remaining products
-                            for prod in batch:
-                                inventory = Inventory(
-                                    product_id=prod.id,
-                                    store_id=store_id,
-                                    quantity=quantity,
-                                    reorder_level=5,
-                                    last_restock_date=datetime.utcnow() if quantity > 0 else None
-                                )
-                                db.session.add(inventory)
-                            
-                            products_added += len(batch)
-                        
-                        # Either commit all or roll back
-                        if products_added > 0:
-                            db.session.commit()
-                            
-                            # Create detailed success message
-                            success_msg = f'Successfully imported {products_added} products'
-                            details = []
-                            
-                            if skipped > 0:
-                                details.append(f"{skipped} skipped")
-                            if len(errors) > 0:
-                                details.append(f"{len(errors)} errors")
-                                
-                            if details:
-                                success_msg += f" ({', '.join(details)})"
-                            
-                            flash(success_msg, 'success')
+                        if result.added > 0:
+                            flash(result.summary(), 'success')
                         else:
-                            db.session.rollback()
                             flash('No products were imported. Please check your file and try again.', 'warning')
                         
                         # Report errors with row numbers for easier reference
-                        if errors:
-                            for error in errors[:5]:  # Show first 5 errors
+                        if result.errors:
+                            for error in result.errors[:5]:  # Show first 5 errors
                                 flash(error, 'warning')
-                            if len(errors) > 5:
-                                flash(f'... and {len(errors) - 5} more errors. Check the logs for details.', 'warning')
-                                for error in errors:
+                            if result.error_count > 5:
+                                flash(f'... and {result.error_count - 5} more errors. Check the logs for details.', 'warning')
+                                for error in result.errors:
                                     logging.error(error)
                                     
                         return redirect(url_for('inventory'))
@@ -802,14 +808,14 @@ def register_routes(app):
                         logging.error(f"Error importing products: {str(e)}")
                         return redirect(request.url)
                 else:
-                    flash('File type not supported. Please upload a CSV file.', 'danger')
+                    flash('File type not supported. Please upload a CSV or Excel (.xlsx) file.', 'danger')
                     return redirect(request.url)
             else:
                 # Regular single product addition
                 name = request.form.get('name')
                 description = request.form.get('description', '')
                 sku = request.form.get('sku')
-                barcode = request.form.get('barcode')
+                barcode = (request.form.get('barcode') or '').strip() or None
                 selling_price = request.form.get('selling_price')
                 cost_price = request.form.get('cost_price')
                 tax_rate = request.form.get('tax_rate', 0)
@@ -850,6 +856,8 @@ def register_routes(app):
                         category_id=category_id if category_id else None,
                         supplier_id=supplier_id if supplier_id else None
                     )
+                    if not product.barcode:
+                        product.barcode = product.generate_barcode()
                     db.session.add(product)
                     db.session.flush()  # Get product ID without committing
                     
@@ -862,6 +870,7 @@ def register_routes(app):
                         last_restock_date=datetime.utcnow() if int(quantity) > 0 else None
                     )
                     db.session.add(inventory)
+                    Store.bump_inventory_version(session.get('store_id'))
                     db.session.commit()
                     
                     flash(f'Product {name} added successfully!', 'success')
@@ -894,7 +903,9 @@ def register_routes(app):
                 product.name = request.form.get('name')
                 product.description = request.form.get('description', '')
                 product.sku = request.form.get('sku')
-                product.barcode = request.form.get('barcode')
+                product.barcode = (request.form.get('barcode') or '').strip() or None
+                if not product.barcode:
+                    product.barcode = product.generate_barcode()
                 product.selling_price = float(request.form.get('selling_price'))
                 product.cost_price = float(request.form.get('cost_price'))
                 product.tax_rate = float(request.form.get('tax_rate', 0))
@@ -911,6 +922,8 @@ def register_routes(app):
                 if new_quantity > old_quantity:
                     inventory.last_restock_date = datetime.utcnow()
                 
+                # Product details are shared by every store that stocks it
+                Store.bump_inventory_version()
                 db.session.commit()
                 flash(f'Product {product.name} updated successfully!', 'success')
                 return redirect(url_for('inventory'))
@@ -996,44 +1009,51 @@ def register_routes(app):
     @not_cashier_required
     def sales_report():
         store_id = session.get('store_id')
+        start_date, end_date, end_date_adjusted = _report_date_range()
         
-        # Get query parameters
-        start_date_str = request.args.get('start_date')
-        end_date_str = request.args.get('end_date')
+        sale_filters = (
+            Sale.store_id == store_id,
+            Sale.sale_date >= start_date,
+            Sale.sale_date <= end_date_adjusted,
+            Sale.status == 'completed'
+        )
         
-        # Default to today if no dates provided
-        today = datetime.now().date()
-        start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date() if start_date_str else today
-        end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date() if end_date_str else today
+        # Calculate summary statistics in the database
+        total_sales, total_amount = (
+            db.session.query(func.count(Sale.id), func.coalesce(func.sum(Sale.total_amount), 0.0))
+            .filter(*sale_filters)
+            .one()
+        )
         
-        # Adjust end_date to include the entire day
-        end_date_adjusted = datetime.combine(end_date, datetime.max.time())
+        payment_methods = dict(
+            db.session.query(Payment.payment_method, func.sum(Payment.amount))
+            .join(Sale, Sale.id == Payment.sale_id)
+            .filter(*sale_filters)
+            .group_by(Payment.payment_method)
+            .all()
+        )
         
-        # Query sales for the specified period
+        # List one page of sales, loading each page's related rows in bulk
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', 50, type=int)
         sales = (
             Sale.query
-            .filter(
-                Sale.store_id == store_id,
-                Sale.sale_date >= start_date,
-                Sale.sale_date <= end_date_adjusted,
-                Sale.status == 'completed'
+            .filter(*sale_filters)
+            .options(
+                joinedload(Sale.customer),
+                joinedload(Sale.cashier),
+                selectinload(Sale.items),
+                selectinload(Sale.payments)
             )
-            .order_by(Sale.sale_date.desc())
-            .all()
+            .order_by(Sale.sale_date.desc(), Sale.id.desc())
+            .paginate(page=page, per_page=per_page, max_per_page=500, error_out=False, count=False)
         )
-        
-        # Calculate summary statistics
-        total_sales = len(sales)
-        total_amount = sum(sale.total_amount for sale in sales)
-        
-        payment_methods = {}
-        for sale in sales:
-            for payment in sale.payments:
-                payment_methods[payment.payment_method] = payment_methods.get(payment.payment_method, 0) + payment.amount
+        sales.total = total_sales  # Already counted above
         
         return render_template(
             'reports/sales.html',
-            sales=sales,
+            sales=sales.items,
+            pagination=sales,
             start_date=start_date,
             end_date=end_date,
             total_sales=total_sales,
@@ -1041,44 +1061,103 @@ def register_routes(app):
             payment_methods=payment_methods
         )
     
+    @app.route('/reports/sales/export')
+    @login_required
+    @not_cashier_required
+    def export_sales_report():
+        """Download the sales report as CSV or XLSX, streamed row by row."""
+        export_format = request.args.get('format', 'csv').lower()
+        if export_format not in exports.EXPORT_FORMATS:
+            return jsonify({'success': False, 'message': f'Unsupported export format: {export_format}'}), 400
+        if export_format == 'xlsx' and not exports.xlsx_available():
+            return jsonify({'success': False, 'message': 'XLSX export is not available on this server'}), 400
+        
+        try:
+            start_date, end_date, end_date_adjusted = _report_date_range()
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Dates must be in YYYY-MM-DD format'}), 400
+        
+        rows = exports.sales_export_rows(session.get('store_id'), start_date, end_date_adjusted)
+        filename = f"sales_{start_date.strftime('%Y%m%d')}_{end_date.strftime('%Y%m%d')}"
+        return _export_response(export_format, exports.SALES_EXPORT_HEADER, rows, filename, 'Sales')
+    
     @app.route('/reports/inventory')
     @login_required
     @not_cashier_required
     def inventory_report():
         store_id = session.get('store_id')
+        method = request.args.get('valuation', valuation.DEFAULT_VALUATION_METHOD)
+        if method not in valuation.VALUATION_METHODS:
+            method = valuation.DEFAULT_VALUATION_METHOD
+        
+        # Totals and per-category figures come from one cached aggregate query
+        summary = valuation.get_inventory_valuation(store_id, method)
         
+        # List one page of stock lines
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', 50, type=int)
         inventory_items = (
             db.session.query(Product, Inventory, Category)
             .join(Inventory, Product.id == Inventory.product_id)
             .outerjoin(Category, Product.category_id == Category.id)
             .filter(Inventory.store_id == store_id)
-            .all()
+            .order_by(Product.name, Product.id)
+            .paginate(page=page, per_page=per_page, max_per_page=500, error_out=False, count=False)
         )
-        
-        # Calculate inventory value
-        total_value = sum(item[0].cost_price * item[1].quantity for item in inventory_items)
-        
-        # Group by category
-        categories = {}
-        for product, inventory, category in inventory_items:
-            category_name = category.name if category else "Uncategorized"
-            if category_name not in categories:
-                categories[category_name] = {
-                    'count': 0,
-                    'quantity': 0,
-                    'value': 0
-                }
-            categories[category_name]['count'] += 1
-            categories[category_name]['quantity'] += inventory.quantity
-            categories[category_name]['value'] += product.cost_price * inventory.quantity
+        inventory_items.total = summary['product_count']  # Already counted by the valuation
         
         return render_template(
             'reports/inventory.html',
-            inventory_items=inventory_items,
-            total_value=total_value,
-            categories=categories
+            inventory_items=inventory_items.items,
+            pagination=inventory_items,
+            summary=summary,
+            valuation_method=method,
+            valuation_methods=valuation.VALUATION_METHODS,
+            total_value=summary['total_value'],
+            categories=summary['categories']
         )
     
+    @app.route('/api/inventory/valuation', methods=['GET'])
+    @login_required
+    @not_cashier_required
+    def inventory_valuation():
+        """Return the current store's inventory valuation as JSON."""
+        try:
+            summary = valuation.get_inventory_valuation(
+                session.get('store_id'),
+                request.args.get('method', valuation.DEFAULT_VALUATION_METHOD)
+            )
+        except valuation.ValuationError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        return jsonify({
+            'success': True,
+            'valuation': summary,
+            'cache': valuation.get_valuation_cache_stats()
+        })
+    
+    @app.route('/api/catalogue/cache', methods=['GET'])
+    @login_required
+    @not_cashier_required
+    def catalogue_cache_stats():
+        """Get hit/miss statistics for the product catalogue cache."""
+        return jsonify(catalogue.get_catalogue_cache_stats())
+    
+    @app.route('/reports/inventory/export')
+    @login_required
+    @not_cashier_required
+    def export_inventory_report():
+        """Download the inventory report as CSV or XLSX, streamed row by row."""
+        export_format = request.args.get('format', 'csv').lower()
+        if export_format not in exports.EXPORT_FORMATS:
+            return jsonify({'success': False, 'message': f'Unsupported export format: {export_format}'}), 400
+        if export_format == 'xlsx' and not exports.xlsx_available():
+            return jsonify({'success': False, 'message': 'XLSX export is not available on this server'}), 400
+        
+        rows = exports.inventory_export_rows(session.get('store_id'))
+        filename = f"inventory_{datetime.now().strftime('%Y%m%d')}"
+        return _export_response(export_format, exports.INVENTORY_EXPORT_HEADER, rows, filename, 'Inventory')
+    
     # User management
     @app.route('/users')
     @admin_required
@@ -1257,6 +1336,7 @@ def register_routes(app):
                     cert_path = os.path.join('instance', 'etims_certificate.p12')
                     cert_file.save(cert_path)
                     current_app.config['TIMS_CERTIFICATE_PATH'] = cert_path
+                    etims.invalidate_certificate_cache(cert_path)
                     
                     # Save certificate password if provided
                     cert_password = request.form.get('cert_password')
@@ -1310,32 +1390,40 @@ def register_routes(app):
     @login_required
     def api_products():
         store_id = session.get('store_id')
-        query = request.args.get('q', '')
+        query = request.args.get('q', '').strip()
         
-        products = (
-            db.session.query(Product, Inventory)
-            .join(Inventory, Product.id == Inventory.product_id)
-            .filter(
-                Inventory.store_id == store_id,
-                Product.is_active == True,
-                Product.name.ilike(f'%{query}%') | Product.barcode.ilike(f'%{query}%')
-            )
-            .all()
+        if not query:
+            # Whole catalogue for the till, served from the catalogue cache
+            return jsonify(catalogue.get_catalogue(store_id).as_json())
+        
+        # Ranked prefix search over name, SKU, barcode and category
+        products = product_search.search_products(
+            store_id, query, request.args.get('limit', product_search.DEFAULT_LIMIT, type=int)
         )
         
-        result = []
-        for product, inventory in products:
-            result.append({
-                'id': product.id,
-                'name': product.name,
-                'barcode': product.barcode,
-                'price': product.selling_price,
-                'price_with_tax': product.price_with_tax,
-                'tax_rate': product.tax_rate,
-                'quantity_available': inventory.quantity
-            })
+        return jsonify([_product_json(product, inventory) for product, inventory in products])
+    
+    @app.route('/api/products/code/<path:code>', methods=['GET'])
+    @login_required
+    def api_product_by_code(code):
+        """Resolve a scanned barcode or SKU to exactly one product in the current store."""
+        row = product_search.resolve_code(session.get('store_id'), code)
+        if row is None:
+            return jsonify({'success': False, 'message': 'Product not found'}), 404
         
-        return jsonify(result)
+        return jsonify(_product_json(*row))
+    
+    @app.route('/api/sync/products', methods=['GET'])
+    @login_required
+    def sync_products():
+        """Products changed in the current store since the till's last sync."""
+        return jsonify(delta_sync.product_changes(session.get('store_id'), request.args.get('since')))
+    
+    @app.route('/api/sync/customers', methods=['GET'])
+    @login_required
+    def sync_customers():
+        """Customers changed since the till's last sync."""
+        return jsonify(delta_sync.customer_changes(request.args.get('since')))
     
     @app.route('/api/customers', methods=['GET'])
     @login_required
@@ -1431,235 +1519,52 @@ def register_routes(app):
                 flash('No selected file', 'danger')
                 return redirect(request.url)
                 
-            if file and (file.filename.endswith('.csv') or file.filename.endswith('.xlsx')):
-                # Process the file
+            if product_import.file_format(file.filename):
+                # Save the upload and import it in the background; the job page polls for progress
                 try:
-                    # For simplicity, we'll only handle CSV files for now
-                    if file.filename.endswith('.csv'):
-                        # Get column mappings from form
-                        column_name = request.form.get('column_name')
-                        column_description = request.form.get('column_description')
-                        column_sku = request.form.get('column_sku')
-                        column_barcode = request.form.get('column_barcode')
-                        column_selling_price = request.form.get('column_selling_price')
-                        column_cost_price = request.form.get('column_cost_price')
-                        column_tax_rate = request.form.get('column_tax_rate')
-                        column_category = request.form.get('column_category')
-                        column_quantity = request.form.get('column_quantity')
-                        
-                        # Get default values
-                        default_category_id = request.form.get('default_category_id')
-                        default_tax_rate = request.form.get('default_tax_rate', 16.0)
-                        default_supplier_id = request.form.get('default_supplier_id')
-                        default_quantity = request.form.get('default_quantity', 0)
-                        default_reorder_level = request.form.get('default_reorder_level', 5)
-                        
-                        # Parse CSV
-                        stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
-                        csv_reader = csv.reader(stream)
-                        
-                        # Skip header row if indicated
-                        if request.form.get('header_row'):
-                            next(csv_reader)
-                            
-                        # Process each row
-                        products_added = 0
-                        errors = []
-                        skipped = 0
-                        duplicate_skus = 0
-                        duplicate_barcodes = 0
-                        
-                        # Cache data to minimize database queries
-                        categories_cache = {category.name.lower(): category.id for category in Category.query.all()}
-                        existing_skus = {product.sku for product in Product.query.with_entities(Product.sku).all() if product.sku}
-                        existing_barcodes = {product.barcode for product in Product.query.with_entities(Product.barcode).all() if product.barcode}
-                        
-                        # Process in batches for better performance with large files
-                        batch_size = 100
-                        batch = []
-                        
-                        for row_num, row in enumerate(csv_reader, 1):
-                            try:
-                                # Extract data based on column mappings
-                                name = row[int(column_name)] if column_name else None
-                                description = row[int(column_description)] if column_description and int(column_description) < len(row) else None
-                                sku = row[int(column_sku)] if column_sku and int(column_sku) < len(row) else f"SKU-{uuid.uuid4().hex[:8].upper()}"
-                                barcode = row[int(column_barcode)] if column_barcode and int(column_barcode) < len(row) else None
-                                
-                                selling_price = row[int(column_selling_price)] if column_selling_price and int(column_selling_price) < len(row) else 0
-                                cost_price = row[int(column_cost_price)] if column_cost_price and int(column_cost_price) < len(row) else 0
-                                tax_rate = row[int(column_tax_rate)] if column_tax_rate and int(column_tax_rate) < len(row) else default_tax_rate
-                                
-                                category_name = row[int(column_category)] if column_category and int(column_category) < len(row) else None
-                                quantity = row[int(column_quantity)] if column_quantity and int(column_quantity) < len(row) else default_quantity
-                                
-                                # Skip rows without a product name
-                                if not name:
-                                    continue
-                                    
-                                # Determine category ID
-                                category_id = default_category_id
-                                if category_name:
-                                    category_name_lower = category_name.lower()
-                                    if category_name_lower in categories_cache:
-                                        category_id = categories_cache[category_name_lower]
-                                    else:
-                                        # Create new category if it doesn't exist
-                                        new_category = Category(name=category_name)
-                                        db.session.add(new_category)
-                                        db.session.flush()
-                                        category_id = new_category.id
-                                        categories_cache[category_name_lower] = category_id
-                                
-                                # Generate barcode if not provided
-                                if not barcode:
-                                    # Generate a unique EAN-13 barcode
-                                    barcode = "590"  # Example prefix
-                                    for _ in range(9):
-                                        barcode += str(random.randint(0, 9))
-                                    
-                                    # Calculate check digit
-                                    total = 0
-                                    for i, digit in enumerate(barcode):
-                                        total += int(digit) * (1 if i % 2 == 0 else 3)
-                                    check_digit = (10 - (total % 10)) % 10
-                                    barcode += str(check_digit)
-                                
-                                # Check for duplicates
-                                if sku and sku in existing_skus:
-                                    duplicate_skus += 1
-                                    if request.form.get('skip_duplicates', 'on') == 'on':
-                                        skipped += 1
-                                        continue
-                                
-                                if barcode and barcode in existing_barcodes:
-                                    duplicate_barcodes += 1
-                                    if request.form.get('skip_duplicates', 'on') == 'on':
-                                        skipped += 1
-                                        continue
-                                
-                                # Create product object
-                                product = Product(
-                                    name=name,
-                                    description=description or f"Description for {name}",
-                                    sku=sku,
-                                    barcode=barcode,
-                                    selling_price=float(selling_price),
-                                    cost_price=float(cost_price),
-                                    tax_rate=float(tax_rate),
-                                    category_id=category_id,
-                                    supplier_id=default_supplier_id,
-                                    is_active=True
-                                )
-                                
-                                # Add to batch for bulk insert
-                                batch.append(product)
-                                
-                                # Process in batches to improve performance
-                                if len(batch) >= batch_size:
-                                    db.session.add_all(batch)
-                                    db.session.flush()  # Get IDs without committing
-                                    
-                                    # Create inventory entries for each product in batch
-                                    for prod in batch:
-                                        inventory = Inventory(
-                                            product_id=prod.id,
-                                            store_id=session.get('store_id'),
-                                            quantity=int(quantity),
-                                            reorder_level=int(default_reorder_level),
-                                            last_restock_date=datetime.utcnow() if int(quantity) > 0 else None
-                                        )
-                                        db.session.add(inventory)
-                                        
-                                        # Update tracking
-                                        if sku and sku not in existing_skus:
-                                            existing_skus.add(sku)
-                                        if barcode and barcode not in existing_barcodes:
-                                            existing_barcodes.add(barcode)
-                                    
-                                    products_added += len(batch)
-                                    batch = []
-                                
-                            except Exception as e:
-                                errors.append(f"Error processing row: {str(e)}")
-                                continue
-                        
-                        # Process any remaining products in the last batch
-                        if batch:
-                            db.session.add_all(batch)
-                            db.session.flush()
-                            
-                            # Create inventory entries for remaining products
-                            for prod in batch:
-                                inventory = Inventory(
-                                    product_id=prod.id,
-                                    store_id=session.get('store_id'),
-                                    quantity=int(quantity),
-                                    reorder_level=int(default_reorder_level),
-                                    last_restock_date=datetime.utcnow() if int(quantity) > 0 else None
-                                )
-                                db.session.add(inventory)
-                            
-                            products_added += len(batch)
-                        
-                        # Either commit all or roll back
-                        if products_added > 0:
-                            db.session.commit()
-                            
-                            # Create detailed success message
-                            success_msg = f'Successfully imported {products_added} products'
-                            details = []
-                            
-                            if skipped > 0:
-                                details.append(f"{skipped} duplicates skipped")
-                            if duplicate_skus > 0:
-                                details.append(f"{duplicate_skus} duplicate SKUs")
-                            if duplicate_barcodes > 0:
-                                details.append(f"{duplicate_barcodes} duplicate barcodes")
-                            if len(errors) > 0:
-                                details.append(f"{len(errors)} errors")
-                                
-                            if details:
-                                success_msg += f" ({', '.join(details)})"
-                            
-                            flash(success_msg, 'success')
-                        else:
-                            db.session.rollback()
-                            flash('No products were imported. Please check your file and mapping.', 'warning')
-                        
-                        # Report errors with row numbers for easier reference
-                        if errors:
-                            for error in errors[:5]:  # Show first 5 errors
-                                flash(error, 'warning')
-                            if len(errors) > 5:
-                                flash(f'... and {len(errors) - 5} more errors. Check the log for details.', 'warning')
-                                for error in errors:
-                                    logging.error(error)
-                                    
-                            # Generate downloadable error log if there are many errors
-                            if len(errors) > 10:
-                                session['import_errors'] = errors
-                                flash(f'<a href="{url_for("download_import_errors")}" class="alert-link">Download complete error log</a>', 'info')
-                    
-                    return redirect(url_for('inventory'))
+                    job = import_jobs.start_import(
+                        current_app._get_current_object(),
+                        file,
+                        request.form,
+                        session.get('store_id'),
+                        session.get('user_id')
+                    )
+                    return redirect(url_for('import_job', job_id=job.id))
                 except Exception as e:
                     db.session.rollback()
                     flash(f'Error importing products: {str(e)}', 'danger')
                     logging.error(f"Error importing products: {str(e)}")
                     return redirect(request.url)
             else:
-                flash('File type not supported. Please upload a CSV or Excel file.', 'danger')
+                flash('File type not supported. Please upload a CSV or Excel (.xlsx) file.', 'danger')
                 return redirect(request.url)
                 
         # GET request - render the form
         categories = Category.query.all()
         suppliers = Supplier.query.all()
         
+        recent_jobs = ImportJob.query.filter_by(store_id=session.get('store_id'))\
+            .order_by(ImportJob.created_at.desc()).limit(10).all()
+        
         return render_template(
             'inventory/import.html',
             categories=categories,
-            suppliers=suppliers
+            suppliers=suppliers,
+            recent_jobs=recent_jobs
         )
+    
+    @app.route('/inventory/import/jobs/<int:job_id>')
+    @manager_required
+    def import_job(job_id):
+        """Progress page for a background product import."""
+        job = _get_import_job(job_id)
+        return render_template('inventory/import_job.html', job=job, status=import_jobs.job_status(job))
+    
+    @app.route('/api/import-jobs/<int:job_id>')
+    @manager_required
+    def api_import_job(job_id):
+        """Progress, throughput and ETA of a background product import, for polling."""
+        return jsonify(import_jobs.job_status(_get_import_job(job_id)))
         
     @app.route('/inventory/templates', methods=['GET'])
     @manager_required
@@ -1796,50 +1701,109 @@ def register_routes(app):
     @login_required
     def barcodes():
         """Barcode generation and printing page."""
-        products = db.session.query(Product, Inventory)\
-            .join(Inventory, Product.id == Inventory.product_id)\
-            .filter(Inventory.store_id == session.get('store_id'))\
-            .all()
-            
-        return render_template('inventory/barcodes.html', products=products)
+        products = list(catalogue.get_catalogue(session.get('store_id')).entries(active_only=False))
+        label_templates = LabelTemplate.query.order_by(LabelTemplate.name).all()
         
-    @app.route('/inventory/download-import-errors', methods=['GET'])
+        return render_template(
+            'inventory/barcodes.html', products=products, label_templates=label_templates,
+            max_labels=labels.MAX_LABELS
+        )
+    
+    @app.route('/inventory/labels', methods=['POST'])
     @login_required
-    @not_cashier_required
-    def download_import_errors():
-        """Download error log from product import."""
-        if 'import_errors' not in session or not session['import_errors']:
-            flash('No import errors found', 'warning')
-            return redirect(url_for('import_products'))
-            
-        errors = session['import_errors']
+    def print_labels():
+        """Render barcode and price labels for the selected products as a PDF, using a saved label template."""
+        template_id = request.form.get('template_id', type=int)
+        config = {}
+        if template_id:
+            template = db.session.get(LabelTemplate, template_id)
+            if template is None:
+                return jsonify({'success': False, 'message': 'Label template not found'}), 404
+            config = template.config_dict
         
-        # Create CSV with error data
-        output = io.StringIO()
-        writer = csv.writer(output)
+        try:
+            spec = labels.LabelSpec.from_config(
+                config,
+                columns=request.form.get('columns', type=int),
+                layout=request.form.get('layout') or None
+            )
+            product_ids = [int(product_id) for product_id in request.form.getlist('product_ids')]
+            copies = max(1, request.form.get('copies', 1, type=int))
+            product_labels = labels.product_labels(product_ids, spec, copies)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid product selection'}), 400
+        except labels.LabelError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        # Spool to disk rather than memory; send_file streams it and closes it afterwards
+        output = tempfile.TemporaryFile()
+        try:
+            labels.render_labels_pdf(product_labels, spec, output)
+        except Exception as e:
+            output.close()
+            logging.error(f"Label rendering error: {str(e)}")
+            return jsonify({'success': False, 'message': str(e)}), 500
+        output.seek(0)
         
-        # Write header
-        writer.writerow(['Error Number', 'Error Message'])
+        return send_file(
+            output,
+            mimetype='application/pdf',
+            as_attachment=False,
+            download_name=f'labels_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
+        )
+    
+    @app.route('/api/products/barcodes/generate', methods=['POST'])
+    @login_required
+    @not_cashier_required
+    def generate_product_barcodes():
+        """Allocate barcodes for products that have none: the given product_ids, or every product."""
+        product_ids = (request.get_json(silent=True) or {}).get('product_ids')
+        # A bare string such as "12" would otherwise be read as the ids 1 and 2
+        if product_ids is not None and (
+            not isinstance(product_ids, list) or any(isinstance(product_id, bool) for product_id in product_ids)
+        ):
+            return jsonify({'success': False, 'message': 'product_ids must be a list of product ids'}), 400
         
-        # Write error data
-        for i, error in enumerate(errors, 1):
-            writer.writerow([i, error])
+        try:
+            query = db.session.query(Product.id).filter(or_(Product.barcode.is_(None), Product.barcode == ''))
+            if product_ids is not None:
+                query = query.filter(Product.id.in_([int(product_id) for product_id in product_ids]))
+            ids = [product_id for product_id, in query.order_by(Product.id)]
+            
+            assigned = dict(zip(ids, barcode_allocator.allocate_barcodes(len(ids))))
+            if assigned:
+                db.session.execute(update(Product), [
+                    {'id': product_id, 'barcode': barcode} for product_id, barcode in assigned.items()
+                ])
+                Store.bump_inventory_version()
+            db.session.commit()
+            
+            return jsonify({'success': True, 'count': len(assigned), 'barcodes': assigned})
+        except (TypeError, ValueError):
+            db.session.rollback()
+            return jsonify({'success': False, 'message': 'product_ids must be a list of product ids'}), 400
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Barcode generation error: {str(e)}")
+            return jsonify({'success': False, 'message': str(e)}), 500
         
-        # Go to the beginning of the stream
-        output.seek(0)
+    @app.route('/inventory/import/jobs/<int:job_id>/errors', methods=['GET'])
+    @login_required
+    @not_cashier_required
+    def download_import_errors(job_id):
+        """Download the rows an import rejected, with the reason and original values."""
+        job = _get_import_job(job_id)
+        path = import_jobs.errors_path(job.id)
+        if not job.error_count or not os.path.exists(path):
+            flash('No import errors found', 'warning')
+            return redirect(url_for('import_job', job_id=job.id))
         
-        # Create a response with the CSV
-        response = send_file(
-            io.BytesIO(output.getvalue().encode()),
+        return send_file(
+            os.path.abspath(path),
             mimetype='text/csv',
             as_attachment=True,
-            download_name=f'product_import_errors_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+            download_name=f'product_import_errors_{job.id}_{job.created_at.strftime("%Y%m%d_%H%M%S")}.csv'
         )
-        
-        # Clear the errors from session after download
-        session.pop('import_errors', None)
-        
-        return response
     
     @app.route('/inventory/download-product-template', methods=['GET'])
     @login_required
@@ -1914,6 +1878,9 @@ def register_routes(app):
         try:
             # If certificate file was uploaded, save it temporarily
             if cert_file:
+                # A new certificate is being installed; drop any parsed copies of the old one
+                etims.invalidate_certificate_cache()
+                
                 cert_path = os.path.join('instance', 'temp_certificate.p12')
                 cert_file.save(cert_path)
                 
@@ -1956,6 +1923,13 @@ def register_routes(app):
         except Exception as e:
             return jsonify({'success': False, 'message': str(e)}), 500
     
+    @app.route('/api/etims/certificate-cache', methods=['GET'])
+    @login_required
+    @not_cashier_required
+    def etims_certificate_cache_stats():
+        """Get statistics about the eTIMS certificate cache."""
+        return jsonify(etims.get_certificate_cache_stats())
+    
     @app.route('/api/etims/verify-device', methods=['POST'])
     @login_required
     @manager_required
@@ -2001,6 +1975,25 @@ def register_routes(app):
         except Exception as e:
             return jsonify({'status': 'error', 'reason': str(e)}), 500
             
+    @app.route('/api/etims/sale-status/<int:sale_id>', methods=['GET'])
+    @login_required
+    def etims_sale_status(sale_id):
+        """Get the fiscalisation status of a sale queued at checkout."""
+        sale = Sale.query.get_or_404(sale_id)
+        
+        try:
+            fiscal_status = etims.get_fiscal_status(sale.reference)
+            if fiscal_status is None:
+                return jsonify({'status': 'not_queued', 'reference': sale.reference}), 404
+            
+            fiscal_status.update({
+                'reference': sale.reference,
+                'fiscal_receipt_number': f"F1-{sale.reference}-{current_app.config.get('TIMS_DEVICE_ID', '')}"
+            })
+            return jsonify(fiscal_status)
+        except Exception as e:
+            return jsonify({'status': 'error', 'reason': str(e)}), 500
+            
     @app.route('/api/etims/offline-queue', methods=['GET'])
     @login_required
     @not_cashier_required
@@ -2017,7 +2010,7 @@ def register_routes(app):
     @login_required
     @manager_required
     def process_offline_queue():
-        """Process the eTIMS offline queue."""
+        """Start draining the eTIMS offline queue in the background."""
         try:
             # Get eTIMS settings from application config
             api_url = current_app.config.get('TIMS_URL')
@@ -2043,19 +2036,35 @@ def register_routes(app):
                 }), 400
             
             # Load certificate
-            private_key, certificate, _ = etims.load_certificate(cert_path, cert_password)
-            
-            # Process the queue
-            success_count, fail_count = etims.process_offline_queue(api_url, private_key, certificate)
+            private_key, certificate, _ = etims.load_certificate_cached(cert_path, cert_password)
+            
+            # Drain the queue on a background thread so the request returns immediately
+            drain = etims.start_offline_queue_drain(
+                api_url,
+                private_key,
+                certificate,
+                workers=current_app.config.get('ETIMS_QUEUE_WORKERS', etims.OFFLINE_QUEUE_WORKERS),
+                max_attempts=current_app.config.get('ETIMS_QUEUE_MAX_ATTEMPTS', etims.OFFLINE_QUEUE_MAX_ATTEMPTS)
+            )
             
             return jsonify({
                 'success': True,
-                'message': f'Processed {success_count + fail_count} invoices: {success_count} succeeded, {fail_count} failed',
-                'succeeded': success_count,
-                'failed': fail_count
-            })
+                'message': 'Offline queue processing started',
+                'drain': drain.status,
+                'queue': etims.get_offline_queue_stats()
+            }), 202
         except Exception as e:
             return jsonify({'success': False, 'message': str(e)}), 500
+    
+    @app.route('/api/etims/process-queue', methods=['GET'])
+    @login_required
+    @not_cashier_required
+    def offline_queue_progress():
+        """Get progress of the background eTIMS offline queue drain."""
+        return jsonify({
+            'drain': etims.get_offline_queue_drain_status(),
+            'queue': etims.get_offline_queue_stats()
+        })
         
     @app.route('/inventory/save-label-template', methods=['POST'])
     @login_required
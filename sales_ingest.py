@@ -0,0 +1,257 @@
+"""
+Recording sales: single checkouts and bulk upload of offline sales.
+
+Offline tills queue sales locally and push them in one request when they
+reconnect. Each queued sale carries a client-generated ``client_reference``
+that is stored on the sale under a unique index, so:
+
+1. A retried upload, or a sale repeated within one upload, is reported as a
+   duplicate of the sale already recorded instead of being recorded twice
+2. Sales are committed in chunks of ``INGEST_CHUNK_SIZE``, each sale inside
+   its own savepoint, so one bad sale fails alone without losing the chunk
+3. Stock, the inventory version and the catalogue cache are updated once
+   per chunk rather than once per sale
+"""
+
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import case, insert, update
+from sqlalchemy.exc import IntegrityError
+
+import catalogue
+import rollups
+from extensions import db
+from models import Inventory, Payment, Sale, SaleItem, Store
+
+INGEST_CHUNK_SIZE = 50  # offline sales committed per transaction
+MAX_INGEST_BATCH = 500  # offline sales accepted per request
+
+
+class SaleIngestError(Exception):
+    """Exception raised for a sale that cannot be recorded as submitted."""
+    pass
+
+
+def record_sale_items(sale_id: int, store_id: int, items: List[Dict]) -> Dict[int, int]:
+    """
+    Insert the lines of a sale and take their quantities off store stock.
+
+    The lines go in as one executemany INSERT and the stock is adjusted with a
+    single set-based UPDATE, so a checkout costs the same number of round trips
+    whatever the size of the basket.
+
+    Returns:
+        Quantity taken off stock per product id
+    """
+    if not items:
+        return {}
+
+    db.session.execute(insert(SaleItem), [
+        {
+            'sale_id': sale_id,
+            'product_id': item['product_id'],
+            'quantity': item['quantity'],
+            'unit_price': item['unit_price'],
+            'tax_rate_applied': item.get('tax_rate', 0.0),
+            'discount_amount_applied': item.get('discount_amount', 0.0),
+            'line_total': item.get('total_price', 0.0)
+        }
+        for item in items
+    ])
+
+    # Collapse repeated lines for the same product into one decrement
+    quantities = {}
+    for item in items:
+        product_id = int(item['product_id'])
+        quantities[product_id] = quantities.get(product_id, 0) + int(item['quantity'])
+
+    db.session.execute(
+        update(Inventory)
+        .where(Inventory.store_id == store_id, Inventory.product_id.in_(quantities))
+        .values(quantity=Inventory.quantity - case(quantities, value=Inventory.product_id, else_=0))
+        .execution_options(synchronize_session=False)
+    )
+    return quantities
+
+
+def create_sale(
+    data: Dict,
+    store_id: int,
+    cashier_id: int,
+    client_reference: Optional[str] = None,
+    sale_date: Optional[datetime] = None
+) -> Tuple[Sale, bool, Dict[int, int]]:
+    """
+    Record a sale, its lines, stock movement, payment and rollup in the current transaction.
+
+    Neither commits nor bumps the inventory version; the caller does both.
+
+    Args:
+        data: Checkout payload (items, customer_id, payment_method, amounts)
+        store_id: Store the sale was made in
+        cashier_id: User who made the sale
+        client_reference: Client idempotency key, unique across sales
+        sale_date: When the sale was made, if not now
+
+    Returns:
+        Tuple of (sale, whether it is fully paid, quantity sold per product id)
+
+    Raises:
+        SaleIngestError: If the sale has no items or no total
+    """
+    items = data.get('items') or []
+    payment_method = data.get('payment_method')
+    total_amount = data.get('total_amount')
+    if not items or not total_amount:
+        raise SaleIngestError('No items in cart')
+
+    sale = Sale(
+        reference=f"SALE-{uuid.uuid4().hex[:8].upper()}",
+        cashier_id=cashier_id,
+        customer_id=data.get('customer_id'),
+        store_id=store_id,
+        subtotal=data.get('subtotal', 0),
+        tax_amount=data.get('tax_amount', 0),
+        discount_amount=data.get('discount_amount', 0),
+        total_amount=total_amount,
+        status='completed',
+        payment_method=payment_method,
+        client_reference=client_reference
+    )
+    if sale_date is not None:
+        sale.sale_date = sale_date
+    db.session.add(sale)
+    db.session.flush()  # Get the sale ID without committing
+
+    sold = record_sale_items(sale.id, store_id, items)
+
+    # M-Pesa is paid asynchronously through an STK push; cash and card are paid now
+    paid = payment_method in ['cash', 'card']
+    if paid:
+        db.session.add(Payment(
+            sale_id=sale.id,
+            amount=total_amount,
+            payment_method=payment_method,
+            status='completed'
+        ))
+
+    rollups.record_sale(sale, payment_method, paid_amount=total_amount if paid else 0.0)
+    return sale, paid, sold
+
+
+def parse_client_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """
+    Parse the ISO 8601 time a till recorded an offline sale, as naive UTC.
+
+    Returns None for a missing or unreadable value; times in the future are
+    clamped to now.
+    """
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return min(moment, datetime.utcnow())
+
+
+def _existing_sales(client_references: List[str]) -> Dict[str, Tuple[int, str]]:
+    if not client_references:
+        return {}
+    rows = db.session.query(Sale.client_reference, Sale.id, Sale.reference)\
+        .filter(Sale.client_reference.in_(client_references))
+    return {client_reference: (sale_id, reference) for client_reference, sale_id, reference in rows}
+
+
+def ingest_offline_sales(sales: List[Dict], store_id: int, cashier_id: int) -> List[Dict]:
+    """
+    Record a batch of offline sales, skipping any already recorded.
+
+    Args:
+        sales: Checkout payloads, each with a ``client_reference`` and
+            optionally the ``timestamp`` the till recorded it at
+        store_id: Store the till belongs to
+        cashier_id: User uploading the sales
+
+    Returns:
+        One result per submitted sale, in order, with ``client_reference``,
+        ``status`` (created, duplicate or failed) and either ``sale_id`` and
+        ``reference`` or an error ``message``
+
+    Raises:
+        SaleIngestError: If the batch is empty or too large
+    """
+    if not sales:
+        raise SaleIngestError('No sales to upload')
+    if len(sales) > MAX_INGEST_BATCH:
+        raise SaleIngestError(f'At most {MAX_INGEST_BATCH} sales can be uploaded at once')
+
+    results = []
+    for start in range(0, len(sales), INGEST_CHUNK_SIZE):
+        chunk = sales[start:start + INGEST_CHUNK_SIZE]
+        known = _existing_sales([
+            sale_data.get('client_reference') for sale_data in chunk
+            if isinstance(sale_data, dict) and sale_data.get('client_reference')
+        ])
+        sold_total: Dict[int, int] = {}
+
+        for sale_data in chunk:
+            client_reference = sale_data.get('client_reference') if isinstance(sale_data, dict) else None
+            if not client_reference:
+                results.append({'client_reference': None, 'status': 'failed', 'message': 'Missing client_reference'})
+                continue
+
+            if client_reference in known:
+                sale_id, reference = known[client_reference]
+                results.append({
+                    'client_reference': client_reference, 'status': 'duplicate',
+                    'sale_id': sale_id, 'reference': reference
+                })
+                continue
+
+            try:
+                with db.session.begin_nested():
+                    sale, _, sold = create_sale(
+                        sale_data, store_id, cashier_id,
+                        client_reference=client_reference,
+                        sale_date=parse_client_timestamp(sale_data.get('timestamp'))
+                    )
+            except IntegrityError:
+                # Recorded by a concurrent upload since the chunk was checked
+                known.update(_existing_sales([client_reference]))
+                if client_reference in known:
+                    sale_id, reference = known[client_reference]
+                    results.append({
+                        'client_reference': client_reference, 'status': 'duplicate',
+                        'sale_id': sale_id, 'reference': reference
+                    })
+                else:
+                    results.append({'client_reference': client_reference, 'status': 'failed', 'message': 'Sale could not be recorded'})
+                continue
+            except (SaleIngestError, KeyError, TypeError, ValueError) as e:
+                results.append({'client_reference': client_reference, 'status': 'failed', 'message': str(e)})
+                continue
+
+            known[client_reference] = (sale.id, sale.reference)
+            for product_id, quantity in sold.items():
+                sold_total[product_id] = sold_total.get(product_id, 0) + quantity
+            results.append({
+                'client_reference': client_reference, 'status': 'created',
+                'sale_id': sale.id, 'reference': sale.reference
+            })
+
+        inventory_version = None
+        if sold_total:
+            Store.bump_inventory_version(store_id)
+            inventory_version = Store.get_inventory_version(store_id)
+        db.session.commit()
+        if inventory_version is not None:
+            catalogue.apply_stock_changes(
+                store_id, {product_id: -quantity for product_id, quantity in sold_total.items()}, inventory_version
+            )
+
+    return results
@@ -2,21 +2,21 @@
 document.addEventListener('DOMContentLoaded', function() {
     // DOM Elements
     const inventoryTable = document.getElementById('inventory-table');
+    const filtersForm = document.getElementById('inventory-filters');
     const searchInput = document.getElementById('inventory-search');
-    const filterSelect = document.getElementById('inventory-filter');
-    const sortSelect = document.getElementById('inventory-sort');
+    const loadMoreButton = document.getElementById('inventory-load-more');
     
-    // Initialize event listeners if elements exist
-    if (searchInput) {
-        initSearch();
-    }
+    // Cursor for the next page of rows; empty once the last page is loaded
+    let nextCursor = loadMoreButton ? loadMoreButton.getAttribute('data-next-cursor') : '';
+    let loading = false;
     
-    if (filterSelect) {
-        initFilter();
+    // Initialize event listeners if elements exist
+    if (filtersForm) {
+        initFilters();
     }
     
-    if (sortSelect) {
-        initSort();
+    if (loadMoreButton) {
+        initLazyLoading();
     }
     
     if (inventoryTable) {
@@ -26,106 +26,168 @@ document.addEventListener('DOMContentLoaded', function() {
     // Initialize tooltips
     initTooltips();
     
-    // Search functionality
-    function initSearch() {
-        searchInput.addEventListener('input', debounce(function() {
-            filterInventoryTable();
-        }, 300));
+    // Filters and sorting run on the server; any change reloads the first page
+    function initFilters() {
+        filtersForm.addEventListener('submit', function(e) {
+            e.preventDefault();
+            reloadInventory();
+        });
+        
+        filtersForm.querySelectorAll('select').forEach(select => {
+            select.addEventListener('change', reloadInventory);
+        });
+        
+        if (searchInput) {
+            searchInput.addEventListener('input', debounce(reloadInventory, 300));
+        }
     }
     
-    // Filter functionality
-    function initFilter() {
-        filterSelect.addEventListener('change', function() {
-            filterInventoryTable();
-        });
+    // Load further pages when the "Load More" button scrolls into view
+    function initLazyLoading() {
+        loadMoreButton.addEventListener('click', loadNextPage);
+        
+        if ('IntersectionObserver' in window) {
+            const observer = new IntersectionObserver(entries => {
+                if (entries.some(entry => entry.isIntersecting)) {
+                    loadNextPage();
+                }
+            });
+            observer.observe(loadMoreButton);
+        }
     }
     
-    // Sort functionality
-    function initSort() {
-        sortSelect.addEventListener('change', function() {
-            sortInventoryTable();
-        });
+    function filterParams() {
+        const params = new URLSearchParams(new FormData(filtersForm));
+        for (const [key, value] of Array.from(params.entries())) {
+            if (!value) {
+                params.delete(key);
+            }
+        }
+        return params;
     }
     
-    // Filter and sort inventory table
-    function filterInventoryTable() {
-        const searchTerm = searchInput ? searchInput.value.toLowerCase() : '';
-        const filterValue = filterSelect ? filterSelect.value : 'all';
+    function reloadInventory() {
+        const params = filterParams();
         
-        const rows = inventoryTable.querySelectorAll('tbody tr');
+        // Keep the URL in step with the filters so reloads and links work
+        window.history.replaceState(null, '', `${window.location.pathname}?${params.toString()}`);
         
-        rows.forEach(row => {
-            const productName = row.querySelector('.product-name').textContent.toLowerCase();
-            const category = row.querySelector('.product-category').textContent;
-            const quantityText = row.querySelector('.product-quantity').textContent;
-            const quantity = parseInt(quantityText);
-            
-            // Check if row matches search term
-            const matchesSearch = productName.includes(searchTerm);
-            
-            // Check if row matches filter
-            let matchesFilter = true;
-            
-            if (filterValue === 'low-stock') {
-                const isLowStock = row.classList.contains('table-warning');
-                matchesFilter = isLowStock;
-            } else if (filterValue === 'out-of-stock') {
-                matchesFilter = quantity <= 0;
-            } else if (filterValue !== 'all') {
-                // Filter by category
-                matchesFilter = category === filterValue;
-            }
-            
-            // Show/hide row based on search and filter
-            row.style.display = matchesSearch && matchesFilter ? '' : 'none';
-        });
+        fetchInventoryPage(params, true);
     }
     
-    // Sort inventory table
-    function sortInventoryTable() {
-        const sortValue = sortSelect.value;
-        const [sortField, sortDirection] = sortValue.split('-');
+    function loadNextPage() {
+        if (!nextCursor || loading) {
+            return;
+        }
         
-        const tbody = inventoryTable.querySelector('tbody');
-        const rows = Array.from(tbody.querySelectorAll('tr'));
+        const params = filterParams();
+        params.set('cursor', nextCursor);
+        fetchInventoryPage(params, false);
+    }
+    
+    function fetchInventoryPage(params, replace) {
+        loading = true;
         
-        // Sort rows
-        rows.sort((a, b) => {
-            let aValue, bValue;
-            
-            if (sortField === 'name') {
-                aValue = a.querySelector('.product-name').textContent;
-                bValue = b.querySelector('.product-name').textContent;
-                return sortDirection === 'asc' ? 
-                    aValue.localeCompare(bValue) : 
-                    bValue.localeCompare(aValue);
-            } else if (sortField === 'quantity') {
-                aValue = parseInt(a.querySelector('.product-quantity').textContent);
-                bValue = parseInt(b.querySelector('.product-quantity').textContent);
-            } else if (sortField === 'price') {
-                aValue = parseFloat(a.querySelector('.product-price').getAttribute('data-price'));
-                bValue = parseFloat(b.querySelector('.product-price').getAttribute('data-price'));
-            }
-            
-            return sortDirection === 'asc' ? aValue - bValue : bValue - aValue;
-        });
+        fetch(`/api/inventory?${params.toString()}`)
+            .then(response => response.json())
+            .then(data => {
+                if (!data.success) {
+                    throw new Error(data.message || 'Failed to load inventory');
+                }
+                
+                const tbody = inventoryTable.querySelector('tbody');
+                if (replace) {
+                    tbody.innerHTML = '';
+                }
+                
+                data.items.forEach(item => tbody.insertAdjacentHTML('beforeend', renderInventoryRow(item)));
+                
+                if (!tbody.children.length) {
+                    tbody.innerHTML = '<tr><td colspan="7" class="text-center py-4">No products found in inventory</td></tr>';
+                }
+                
+                nextCursor = data.next_cursor || '';
+                loadMoreButton.style.display = nextCursor ? '' : 'none';
+                initTooltips();
+            })
+            .catch(error => {
+                console.error('Error loading inventory:', error);
+                showAlert(error.message, 'danger');
+            })
+            .finally(() => {
+                loading = false;
+            });
+    }
+    
+    // Build a table row matching the server-rendered markup
+    function renderInventoryRow(item) {
+        const canEdit = inventoryTable.getAttribute('data-can-edit') === 'true';
+        let rowClass = '';
+        let badge = '<span class="badge bg-success">In Stock</span>';
+        
+        if (item.quantity <= 0) {
+            rowClass = 'table-danger';
+            badge = '<span class="badge bg-danger">Out of Stock</span>';
+        } else if (item.quantity <= item.reorder_level) {
+            rowClass = 'table-warning';
+            badge = '<span class="badge bg-warning text-dark">Low Stock</span>';
+        }
         
-        // Re-append rows in sorted order
-        rows.forEach(row => tbody.appendChild(row));
+        const price = Number(item.selling_price).toLocaleString('en-KE', { minimumFractionDigits: 2, maximumFractionDigits: 2 });
+        
+        return `
+            <tr data-product-id="${item.id}" data-reorder-level="${item.reorder_level}" class="${rowClass}">
+                <td class="product-name">${escapeHtml(item.name)}</td>
+                <td>
+                    ${item.sku ? `<div>SKU: ${escapeHtml(item.sku)}</div>` : ''}
+                    ${item.barcode ? `<div>Barcode: ${escapeHtml(item.barcode)}</div>` : ''}
+                </td>
+                <td class="product-category">${escapeHtml(item.category)}</td>
+                <td class="text-center product-quantity">${item.quantity}</td>
+                <td class="text-end product-price" data-price="${item.selling_price}">KES ${price}</td>
+                <td class="text-center">${badge}</td>
+                <td class="text-end">
+                    <div class="btn-group">
+                        ${canEdit ? `<a href="/inventory/edit/${item.id}" class="btn btn-sm btn-outline-primary"><i class="fas fa-edit"></i></a>` : ''}
+                        <button type="button" class="btn btn-sm btn-outline-secondary adjust-stock-btn"
+                                data-id="${item.id}"
+                                data-name="${escapeHtml(item.name)}"
+                                data-stock="${item.quantity}"
+                                data-bs-toggle="tooltip"
+                                title="Adjust Stock">
+                            <i class="fas fa-layer-group"></i>
+                        </button>
+                        <button type="button" class="btn btn-sm btn-outline-info"
+                                data-bs-toggle="tooltip"
+                                title="View Details">
+                            <i class="fas fa-eye"></i>
+                        </button>
+                    </div>
+                </td>
+            </tr>
+        `;
+    }
+    
+    function escapeHtml(value) {
+        const div = document.createElement('div');
+        div.textContent = value == null ? '' : String(value);
+        return div.innerHTML.replace(/"/g, '&quot;');
     }
     
     // Initialize stock adjustments
     function initStockAdjustments() {
-        const adjustButtons = document.querySelectorAll('.adjust-stock-btn');
-        
-        adjustButtons.forEach(button => {
-            button.addEventListener('click', function() {
-                const productId = this.getAttribute('data-id');
-                const productName = this.getAttribute('data-name');
-                const currentStock = this.getAttribute('data-stock');
-                
-                showStockAdjustmentModal(productId, productName, currentStock);
-            });
+        // Delegated so rows loaded later get the handler too
+        inventoryTable.addEventListener('click', function(e) {
+            const button = e.target.closest('.adjust-stock-btn');
+            if (!button) {
+                return;
+            }
+            
+            const productId = button.getAttribute('data-id');
+            const productName = button.getAttribute('data-name');
+            const currentStock = button.getAttribute('data-stock');
+            
+            showStockAdjustmentModal(productId, productName, currentStock);
         });
     }
     
@@ -283,7 +345,7 @@ document.addEventListener('DOMContentLoaded', function() {
     function initTooltips() {
         const tooltipTriggerList = [].slice.call(document.querySelectorAll('[data-bs-toggle="tooltip"]'));
         tooltipTriggerList.map(function (tooltipTriggerEl) {
-            return new bootstrap.Tooltip(tooltipTriggerEl);
+            return bootstrap.Tooltip.getOrCreateInstance(tooltipTriggerEl);
         });
     }
     
@@ -78,47 +78,57 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Cache products data for offline use
     function cacheProductsData() {
-        fetch('/api/products')
-            .then(response => response.json())
-            .then(products => {
-                const transaction = db.transaction(["products"], "readwrite");
-                const productsStore = transaction.objectStore("products");
-                
-                // Clear existing data
-                productsStore.clear();
-                
-                // Add new data
-                products.forEach(product => {
-                    productsStore.add(product);
-                });
-                
-                console.log(`Cached ${products.length} products for offline use`);
-            })
-            .catch(error => {
-                console.error('Error caching products:', error);
-            });
+        syncOfflineStore("products", "/api/sync/products");
     }
     
     // Cache customers data for offline use
     function cacheCustomersData() {
-        fetch('/api/customers')
+        syncOfflineStore("customers", "/api/sync/customers");
+    }
+    
+    // Apply the changes since the last sync to an object store. The server
+    // sends a full snapshot instead when the watermark is missing or expired.
+    function syncOfflineStore(storeName, url) {
+        const watermarkKey = `kenyan_pos_sync_${storeName}`;
+        const watermark = localStorage.getItem(watermarkKey);
+        
+        fetch(watermark ? `${url}?since=${encodeURIComponent(watermark)}` : url)
             .then(response => response.json())
-            .then(customers => {
-                const transaction = db.transaction(["customers"], "readwrite");
-                const customersStore = transaction.objectStore("customers");
+            .then(changes => {
+                const transaction = db.transaction([storeName], "readwrite");
+                const objectStore = transaction.objectStore(storeName);
+                
+                if (changes.full) {
+                    objectStore.clear();
+                }
                 
-                // Clear existing data
-                customersStore.clear();
+                // Remove deletions first so a restocked record can take back its barcode or phone
+                changes.deleted.forEach(id => {
+                    objectStore.delete(id);
+                });
                 
-                // Add new data
-                customers.forEach(customer => {
-                    customersStore.add(customer);
+                // Rows arrive as arrays in the order given by `fields`
+                changes.rows.forEach(row => {
+                    const record = {};
+                    changes.fields.forEach((field, index) => {
+                        record[field] = row[index];
+                    });
+                    objectStore.put(record);
                 });
                 
-                console.log(`Cached ${customers.length} customers for offline use`);
+                transaction.oncomplete = function() {
+                    localStorage.setItem(watermarkKey, changes.watermark);
+                    console.log(`Synced ${storeName}: ${changes.rows.length} changed, ${changes.deleted.length} removed${changes.full ? " (full)" : ""}`);
+                };
+                
+                transaction.onerror = function(event) {
+                    // Start again from a full snapshot next time
+                    localStorage.removeItem(watermarkKey);
+                    console.error(`Error syncing ${storeName}:`, event.target.error);
+                };
             })
             .catch(error => {
-                console.error('Error caching customers:', error);
+                console.error(`Error syncing ${storeName}:`, error);
             });
     }
     
@@ -133,8 +143,10 @@ document.addEventListener('DOMContentLoaded', function() {
                 saleData.timestamp = new Date().toISOString();
                 saleData.syncStatus = "pending";
                 
-                // Generate offline reference
-                saleData.offline_reference = "OFF-" + Math.random().toString(36).substr(2, 9).toUpperCase();
+                // Generate offline reference; the server uses it to recognise a sale it already has
+                saleData.offline_reference = "OFF-" + (window.crypto && crypto.randomUUID
+                    ? crypto.randomUUID().toUpperCase()
+                    : Date.now().toString(36).toUpperCase() + "-" + Math.random().toString(36).substr(2, 9).toUpperCase());
                 
                 const request = offlineSalesStore.add(saleData);
                 
@@ -245,27 +257,26 @@ document.addEventListener('DOMContentLoaded', function() {
     };
     
     // Sync offline transactions when back online
+    let offlineSyncInProgress = false;
+    const OFFLINE_SYNC_BATCH_SIZE = 100;
+    
     function syncOfflineTransactions() {
-        if (!navigator.onLine) {
-            return; // Skip if offline
+        if (!navigator.onLine || offlineSyncInProgress) {
+            return; // Skip if offline or an upload is already running
         }
         
         try {
             const transaction = db.transaction(["offlineSales"], "readonly");
             const offlineSalesStore = transaction.objectStore("offlineSales");
-            const pendingIndex = offlineSalesStore.index("syncStatus");
-            const pendingRequest = pendingIndex.openCursor("pending");
+            const pendingRequest = offlineSalesStore.index("syncStatus").getAll("pending");
             
             pendingRequest.onsuccess = function(event) {
-                const cursor = event.target.result;
-                
-                if (cursor) {
-                    const offlineSale = cursor.value;
-                    
-                    // Attempt to sync with server
-                    syncSaleWithServer(offlineSale);
-                    
-                    cursor.continue();
+                const pendingSales = event.target.result;
+                if (pendingSales.length > 0) {
+                    offlineSyncInProgress = true;
+                    uploadOfflineSales(pendingSales).finally(() => {
+                        offlineSyncInProgress = false;
+                    });
                 }
             };
         } catch (error) {
@@ -273,37 +284,66 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
     
-    // Sync a single sale with the server
-    function syncSaleWithServer(offlineSale) {
-        // Remove offline-specific properties
-        const saleData = { ...offlineSale };
-        delete saleData.offline_id;
-        delete saleData.offline_reference;
-        delete saleData.timestamp;
-        delete saleData.syncStatus;
+    // Upload pending sales in batches; each batch is one request
+    function uploadOfflineSales(pendingSales) {
+        const batches = [];
+        for (let i = 0; i < pendingSales.length; i += OFFLINE_SYNC_BATCH_SIZE) {
+            batches.push(pendingSales.slice(i, i + OFFLINE_SYNC_BATCH_SIZE));
+        }
+        
+        return batches.reduce(
+            (previous, batch) => previous.then(() => syncSalesWithServer(batch)),
+            Promise.resolve()
+        ).catch(error => {
+            // Unsent sales stay pending; sales the server already has come back as duplicates next time
+            console.error(`Error syncing offline sales: ${error}`);
+        });
+    }
+    
+    // Send a batch of sales to the server, keyed by their offline reference
+    function syncSalesWithServer(offlineSales) {
+        const byReference = {};
+        const sales = offlineSales.map(offlineSale => {
+            byReference[offlineSale.offline_reference] = offlineSale;
+            
+            // Remove offline-specific properties
+            const saleData = { ...offlineSale };
+            delete saleData.offline_id;
+            delete saleData.offline_reference;
+            delete saleData.syncStatus;
+            saleData.client_reference = offlineSale.offline_reference;
+            return saleData;
+        });
         
-        fetch('/pos/checkout', {
+        return fetch('/pos/offline-sales', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify(saleData)
+            body: JSON.stringify({ sales: sales })
         })
         .then(response => response.json())
         .then(result => {
-            if (result.success) {
-                // Update status to synced
-                updateOfflineSaleStatus(offlineSale.offline_id, "synced", result.reference);
-                console.log(`Offline sale ${offlineSale.offline_reference} synced successfully`);
-            } else {
-                // Mark as failed
-                updateOfflineSaleStatus(offlineSale.offline_id, "failed", null, result.message);
-                console.error(`Failed to sync offline sale: ${result.message}`);
+            if (!result.success) {
+                throw new Error(result.message);
             }
-        })
-        .catch(error => {
-            // Keep as pending for retry
-            console.error(`Error syncing offline sale: ${error}`);
+            
+            result.results.forEach(saleResult => {
+                const offlineSale = byReference[saleResult.client_reference];
+                if (!offlineSale) {
+                    return;
+                }
+                
+                if (saleResult.status === 'failed') {
+                    updateOfflineSaleStatus(offlineSale.offline_id, "failed", null, saleResult.message);
+                    console.error(`Failed to sync offline sale ${offlineSale.offline_reference}: ${saleResult.message}`);
+                } else {
+                    // Created now or by an earlier attempt whose response was lost
+                    updateOfflineSaleStatus(offlineSale.offline_id, "synced", saleResult.reference);
+                }
+            });
+            
+            console.log(`Offline sales synced: ${result.created} created, ${result.duplicates} already recorded, ${result.failed} failed`);
         });
     }
     
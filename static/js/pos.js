@@ -7,8 +7,11 @@ document.addEventListener('DOMContentLoaded', function() {
         subtotal: 0,
         taxAmount: 0,
         discountAmount: 0,
-        totalAmount: 0
+        totalAmount: 0,
+        checkoutKey: null  // Idempotency key for checking out this cart; reset when it changes
     };
+    
+    const CHECKOUT_ATTEMPTS = 3;
 
     // DOM Elements
     const productSearchInput = document.getElementById('product-search');
@@ -123,14 +126,24 @@ document.addEventListener('DOMContentLoaded', function() {
             });
     }
 
-    // Search products by barcode
+    // Look up a scanned barcode or SKU by exact match
     function searchProductsByBarcode(barcode) {
-        fetch(`/api/products?q=${encodeURIComponent(barcode)}`)
-            .then(response => response.json())
-            .then(products => {
-                if (products.length > 0) {
+        const code = barcode.trim();
+        if (!code) {
+            return;
+        }
+        
+        fetch(`/api/products/code/${encodeURIComponent(code)}`)
+            .then(response => {
+                if (response.status === 404) {
+                    return null;
+                }
+                return response.json();
+            })
+            .then(product => {
+                if (product) {
                     // If product found, add directly to cart
-                    addToCart(products[0]);
+                    addToCart(product);
                 } else {
                     showAlert('Product not found', 'warning');
                 }
@@ -227,6 +240,9 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // Update cart display and totals
     function updateCart() {
+        // A changed cart is a different sale
+        cart.checkoutKey = null;
+        
         // Clear current cart display
         cartItemsContainer.innerHTML = '';
         
@@ -363,6 +379,44 @@ document.addEventListener('DOMContentLoaded', function() {
         showAlert('Cart cleared', 'info');
     }
 
+    // Generate the key the server uses to recognise a repeated checkout
+    function newCheckoutKey() {
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        return Date.now().toString(36) + '-' + Math.random().toString(36).substr(2, 12);
+    }
+    
+    // Post a checkout, retrying network failures and server errors with the
+    // same idempotency key so a sale the server already recorded is not repeated
+    function postCheckout(data, attempt = 1) {
+        if (!cart.checkoutKey) {
+            cart.checkoutKey = newCheckoutKey();
+        }
+        
+        return fetch('/pos/checkout', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Idempotency-Key': cart.checkoutKey
+            },
+            body: JSON.stringify(data)
+        })
+        .then(response => {
+            if (response.status >= 500 && attempt < CHECKOUT_ATTEMPTS) {
+                throw new Error(`Checkout failed with status ${response.status}`);
+            }
+            return response.json();
+        })
+        .catch(error => {
+            if (attempt >= CHECKOUT_ATTEMPTS) {
+                throw error;
+            }
+            return new Promise(resolve => setTimeout(resolve, 500 * attempt))
+                .then(() => postCheckout(data, attempt + 1));
+        });
+    }
+    
     // Show checkout modal with payment options
     function showCheckoutModal() {
         if (cart.items.length === 0) {
@@ -509,14 +563,7 @@ document.addEventListener('DOMContentLoaded', function() {
             };
             
             // Send checkout request
-            fetch('/pos/checkout', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify(paymentData)
-            })
-            .then(response => response.json())
+            postCheckout(paymentData)
             .then(result => {
                 if (result.success) {
                     // Close modal
@@ -572,14 +619,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 total_amount: cart.totalAmount
             };
             
-            fetch('/pos/checkout', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify(saleData)
-            })
-            .then(response => response.json())
+            postCheckout(saleData)
             .then(saleResult => {
                 if (saleResult.success) {
                     // Now initiate M-Pesa payment
@@ -669,58 +709,71 @@ document.addEventListener('DOMContentLoaded', function() {
         const mpesaModal = new bootstrap.Modal(document.getElementById('mpesaWaitingModal'));
         mpesaModal.show();
         
-        // Set up polling for payment status
+        // Poll our own server for the result the M-Pesa callback records. The
+        // server only queries M-Pesa directly once a callback is overdue.
         const statusMessage = document.getElementById('mpesa-status-message');
-        const pollInterval = 5000; // 5 seconds
-        let pollCount = 0;
-        const maxPolls = 12; // 1 minute maximum wait
+        // Most customers confirm within 30 seconds, so poll quickly until then
+        // and back off afterwards to keep database reads per till down
+        const fastPollInterval = 3000; // 3 seconds
+        const fastPollPeriod = 30000; // for the first 30 seconds
+        const slowPollInterval = 10000; // 10 seconds after that
+        const maxWait = 120000; // 2 minutes maximum wait
+        const pollStarted = Date.now();
+        let pollTimer = null;
+        let finished = false;
+        
+        const showResult = (status) => {
+            finished = true;
+            
+            if (status === 'completed') {
+                statusMessage.textContent = 'Payment successful!';
+                statusMessage.className = 'mt-3 text-success';
+            } else {
+                statusMessage.textContent = 'Payment failed or cancelled';
+                statusMessage.className = 'mt-3 text-danger';
+            }
+        };
+        
+        const showError = () => {
+            finished = true;
+            statusMessage.textContent = 'Error checking payment status';
+            statusMessage.className = 'mt-3 text-danger';
+        };
         
         const checkStatus = () => {
             fetch(`/pos/check-payment-status/${checkoutRequestId}`)
                 .then(response => response.json())
                 .then(result => {
-                    pollCount++;
+                    const waited = Date.now() - pollStarted;
+                    if (finished) {
+                        return;
+                    }
                     
-                    if (result.success) {
-                        if (result.is_complete) {
-                            // Payment complete
-                            clearInterval(pollTimer);
-                            
-                            if (result.status === 'completed') {
-                                statusMessage.textContent = 'Payment successful!';
-                                statusMessage.className = 'mt-3 text-success';
-                            } else {
-                                statusMessage.textContent = 'Payment failed or cancelled';
-                                statusMessage.className = 'mt-3 text-danger';
-                            }
-                        } else if (pollCount >= maxPolls) {
-                            // Timeout
-                            clearInterval(pollTimer);
-                            statusMessage.textContent = 'Payment pending. Check sales records for updates.';
-                            statusMessage.className = 'mt-3 text-warning';
-                        }
+                    if (!result.success) {
+                        showError();
+                    } else if (result.is_complete) {
+                        showResult(result.status);
+                    } else if (waited >= maxWait) {
+                        // Timeout
+                        finished = true;
+                        statusMessage.textContent = 'Payment pending. Check sales records for updates.';
+                        statusMessage.className = 'mt-3 text-warning';
                     } else {
-                        // Error checking status
-                        clearInterval(pollTimer);
-                        statusMessage.textContent = 'Error checking payment status';
-                        statusMessage.className = 'mt-3 text-danger';
+                        pollTimer = setTimeout(checkStatus, waited < fastPollPeriod ? fastPollInterval : slowPollInterval);
                     }
                 })
                 .catch(error => {
                     console.error('Error checking payment status:', error);
-                    clearInterval(pollTimer);
-                    statusMessage.textContent = 'Error checking payment status';
-                    statusMessage.className = 'mt-3 text-danger';
+                    showError();
                 });
         };
         
-        // Start polling
-        const pollTimer = setInterval(checkStatus, pollInterval);
         checkStatus(); // Check immediately
         
         // Done button handler
         document.getElementById('mpesa-done-btn').addEventListener('click', function() {
-            clearInterval(pollTimer);
+            finished = true;
+            clearTimeout(pollTimer);
             mpesaModal.hide();
         });
         
@@ -770,6 +823,7 @@ document.addEventListener('DOMContentLoaded', function() {
                                     <p class="mb-1"><strong>KRA PIN:</strong> ${etimsData.tax_pin || 'N/A'}</p>
                                     <p class="mb-1"><strong>Device ID:</strong> ${etimsData.device_id || 'N/A'}</p>
                                     <p class="mb-1"><strong>Fiscal Receipt No:</strong> ${etimsData.fiscal_receipt_number || 'N/A'}</p>
+                                    <p class="mb-1"><strong>KRA Status:</strong> <span id="etims-fiscal-status">${etimsData.status === 'transmitted' ? 'Transmitted' : 'Pending transmission'}</span></p>
                                     ${etimsData.qr_code ? `
                                     <div class="text-center mt-2">
                                         <img src="data:image/png;base64,${etimsData.qr_code}" style="max-width: 150px;" alt="KRA QR Code">
@@ -799,6 +853,11 @@ document.addEventListener('DOMContentLoaded', function() {
         const receiptModal = new bootstrap.Modal(document.getElementById('receiptModal'));
         receiptModal.show();
         
+        // eTIMS transmission happens in the background; follow it until KRA confirms
+        if (hasEtimsData && etimsData.status_url) {
+            watchFiscalStatus(etimsData.status_url);
+        }
+        
         // Print handler
         document.getElementById('print-receipt-btn').addEventListener('click', function() {
             // In a real implementation, this would print the receipt
@@ -811,6 +870,41 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    // Poll the lightweight eTIMS status endpoint while the receipt is open
+    function watchFiscalStatus(statusUrl) {
+        const pollInterval = 3000;
+        const maxPolls = 10;
+        let pollCount = 0;
+        
+        const checkFiscalStatus = () => {
+            const statusLabel = document.getElementById('etims-fiscal-status');
+            if (!statusLabel) {
+                return; // Receipt closed
+            }
+            
+            fetch(statusUrl)
+                .then(response => response.json())
+                .then(result => {
+                    pollCount++;
+                    
+                    if (result.status === 'transmitted') {
+                        statusLabel.textContent = 'Transmitted';
+                        statusLabel.className = 'text-success';
+                    } else if (result.status === 'failed') {
+                        statusLabel.textContent = 'Transmission failed - will be resent from the offline queue';
+                        statusLabel.className = 'text-danger';
+                    } else if (pollCount < maxPolls) {
+                        setTimeout(checkFiscalStatus, pollInterval);
+                    }
+                })
+                .catch(error => {
+                    console.error('Error checking eTIMS status:', error);
+                });
+        };
+        
+        setTimeout(checkFiscalStatus, pollInterval);
+    }
+    
     // Helper function to show alerts
     function showAlert(message, type = 'info') {
         const alertDiv = document.createElement('div');
@@ -0,0 +1,21 @@
+import pytest
+from flask import Flask
+
+from extensions import db
+
+
+@pytest.fixture
+def app(tmp_path):
+    """A bare app bound to a temporary SQLite database with the full schema."""
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'pos.db'}"
+    app.config["TESTING"] = True
+    db.init_app(app)
+
+    import models  # noqa: F401  Registers the tables
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
@@ -0,0 +1,71 @@
+import pytest
+from sqlalchemy import select, update
+
+import catalogue
+from extensions import db
+from models import Inventory, Product, Store
+
+
+@pytest.fixture
+def store(app):
+    store = Store(name="Test store")
+    products = [Product(name=f"Product {i}", sku=f"SKU-{i}", selling_price=100.0) for i in range(3)]
+    db.session.add_all([store, *products])
+    db.session.flush()
+    db.session.add_all(
+        Inventory(product_id=product.id, store_id=store.id, quantity=10) for product in products
+    )
+    db.session.commit()
+    catalogue._catalogue_cache.clear()
+    yield store
+    catalogue._catalogue_cache.clear()
+
+
+def sell_one(store_id, product_id):
+    """Commit a one-unit sale on its own connection, as another request would; returns the new version."""
+    with db.engine.begin() as connection:
+        connection.execute(
+            update(Inventory)
+            .where(Inventory.store_id == store_id, Inventory.product_id == product_id)
+            .values(quantity=Inventory.quantity - 1)
+        )
+        connection.execute(
+            update(Store).where(Store.id == store_id).values(inventory_version=Store.inventory_version + 1)
+        )
+        return connection.execute(select(Store.inventory_version).where(Store.id == store_id)).scalar()
+
+
+def test_checkout_committed_while_catalogue_loads_is_counted_once(store, monkeypatch):
+    product_id = db.session.query(Inventory.product_id).filter_by(store_id=store.id).first()[0]
+    committed = {}
+    build_catalogue = catalogue.build_catalogue
+
+    def build_after_checkout(store_id, fallback_version):
+        # get_catalogue has read the version; the checkout lands before the rows are read
+        committed["version"] = sell_one(store_id, product_id)
+        return build_catalogue(store_id, fallback_version)
+
+    monkeypatch.setattr(catalogue, "build_catalogue", build_after_checkout)
+    snapshot = catalogue.get_catalogue(store.id)
+    monkeypatch.undo()
+    db.session.rollback()
+
+    assert snapshot.version == committed["version"]
+
+    # What checkout does once its transaction has committed
+    catalogue.apply_stock_changes(store.id, {product_id: -1}, committed["version"])
+    cached = catalogue.get_catalogue(store.id)
+    assert cached.quantities[cached.positions[product_id]] == 9
+
+
+def test_checkout_after_load_patches_cached_stock(store):
+    product_id = db.session.query(Inventory.product_id).filter_by(store_id=store.id).first()[0]
+    catalogue.get_catalogue(store.id)
+
+    version = sell_one(store.id, product_id)
+    assert catalogue.apply_stock_changes(store.id, {product_id: -1}, version)
+
+    db.session.rollback()
+    cached = catalogue.get_catalogue(store.id)
+    assert cached.version == version
+    assert cached.quantities[cached.positions[product_id]] == 9
@@ -0,0 +1,113 @@
+import json
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from etims import OfflineQueueDrain, _connect_offline_queue
+
+
+class StubETIMSHandler(BaseHTTPRequestHandler):
+    """
+    Local stand-in for the eTIMS invoice endpoint.
+
+    The invoice reference picks the answer: ``FAIL-*`` always gets a 500,
+    ``FLAKY-*`` gets a 500 on its first attempt only, ``GARBLED-*`` gets a
+    200 with a body that is not JSON, and anything else is accepted.
+    """
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        reference = json.loads(body).get("traderSystemInvoiceNumber", "")
+        with self.server.lock:
+            attempt = self.server.attempts[reference] = self.server.attempts.get(reference, 0) + 1
+
+        if reference.startswith("FAIL-") or (reference.startswith("FLAKY-") and attempt == 1):
+            status, payload = 500, b'{"error": "stub failure"}'
+        elif reference.startswith("GARBLED-"):
+            status, payload = 200, b"<html>Bad gateway</html>"
+        else:
+            status, payload = 200, json.dumps({"resultCd": "000", "reference": reference}).encode()
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_etims():
+    """Start the stub eTIMS server; yields its base URL."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubETIMSHandler)
+    server.lock = threading.Lock()
+    server.attempts = {}
+    threading.Thread(target=server.serve_forever, name="etims-stub", daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope="module")
+def signing_identity():
+    """A throwaway signing key and self-signed certificate."""
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(x509.oid.NameOID.COMMON_NAME, "etims-drain-test")])
+    now = datetime.utcnow()
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(private_key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + timedelta(days=1))
+        .sign(private_key, hashes.SHA256())
+    )
+    return private_key, certificate
+
+
+def test_drain_records_every_outcome(tmp_path, stub_etims, signing_identity):
+    prefixes = ["FAIL", "FLAKY", "GARBLED"] + ["OK"] * 5
+    references = [f"{prefixes[index % len(prefixes)]}-{index}" for index in range(40)]
+
+    db_path = str(tmp_path / "queue.db")
+    conn = _connect_offline_queue(db_path)
+    with conn:
+        rows = [
+            (f"TEST-{index}", reference, datetime.now().isoformat(),
+             json.dumps({"traderSystemInvoiceNumber": reference}))
+            for index, reference in enumerate(references)
+        ]
+        # A queue row that cannot be parsed must fail alone, not stop the drain
+        rows.append(("TEST-CORRUPT", "CORRUPT", datetime.now().isoformat(), "{"))
+        conn.executemany(
+            "INSERT INTO offline_queue (id, reference, timestamp, invoice_data) VALUES (?, ?, ?, ?)", rows
+        )
+
+    private_key, certificate = signing_identity
+    drain = OfflineQueueDrain(
+        stub_etims, private_key, certificate,
+        workers=8, max_attempts=2, backoff_base=0, backoff_max=0, db_path=db_path
+    )
+    result = drain.run()
+    counts = dict(conn.execute("SELECT status, count FROM offline_queue_stats").fetchall())
+    conn.close()
+
+    def expected_count(*names):
+        return sum(1 for reference in references if reference.split("-")[0] in names)
+
+    assert result["state"] == "completed"
+    assert result["transmitted"] == expected_count("OK", "FLAKY")
+    assert result["retried"] == expected_count("FAIL", "FLAKY", "GARBLED") + 1
+    assert result["failed"] == expected_count("FAIL", "GARBLED") + 1
+    assert counts.get("transmitted", 0) == result["transmitted"]
+    assert counts.get("failed", 0) == result["failed"]
+    assert not counts.get("pending", 0) and not counts.get("in_flight", 0)
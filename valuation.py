@@ -0,0 +1,154 @@
+"""
+Inventory valuation.
+
+Stock is valued with a single GROUP BY query per store, returning count,
+quantity and value per category. Results are cached per store and valuation
+method, keyed on ``Store.inventory_version``. Every stock or catalogue change
+bumps that version, so a repeat view costs one primary-key lookup until
+something changes.
+
+Valuation methods:
+1. last_cost - quantity x the product's most recent cost price
+2. retail - quantity x the product's selling price
+
+Products without a cost price are valued at zero and counted as unpriced.
+"""
+
+import threading
+from typing import Dict, Tuple
+
+from sqlalchemy import case, func, select
+
+from extensions import db
+from models import Category, Inventory, Product, Store
+
+VALUATION_METHODS = {
+    "last_cost": Product.cost_price,
+    "retail": Product.selling_price,
+}
+DEFAULT_VALUATION_METHOD = "last_cost"
+UNCATEGORIZED = "Uncategorized"
+
+# (store_id, method) -> (inventory_version, valuation)
+_valuation_cache: Dict[Tuple[int, str], Tuple[int, Dict]] = {}
+_valuation_cache_lock = threading.Lock()
+_valuation_cache_stats = {"hits": 0, "misses": 0}
+
+
+class ValuationError(Exception):
+    """Exception raised for an unknown valuation method."""
+    pass
+
+
+def compute_inventory_valuation(store_id: int, method: str = DEFAULT_VALUATION_METHOD) -> Dict:
+    """
+    Value a store's stock in the database.
+
+    Args:
+        store_id: Store to value
+        method: One of ``VALUATION_METHODS``
+
+    Returns:
+        Dictionary with store totals and a ``categories`` breakdown of
+        count, quantity and value per category name
+    """
+    if method not in VALUATION_METHODS:
+        raise ValuationError(f"Unknown valuation method: {method}")
+
+    unit_value = func.coalesce(VALUATION_METHODS[method], 0.0)
+    statement = (
+        select(
+            Category.name,
+            func.count(Inventory.id),
+            func.coalesce(func.sum(Inventory.quantity), 0),
+            func.coalesce(func.sum(Inventory.quantity * unit_value), 0.0),
+            func.coalesce(func.sum(case((Inventory.quantity <= Inventory.reorder_level, 1), else_=0)), 0),
+            func.coalesce(func.sum(case((Inventory.quantity <= 0, 1), else_=0)), 0),
+            func.coalesce(func.sum(case((VALUATION_METHODS[method].is_(None), 1), else_=0)), 0)
+        )
+        .select_from(Inventory)
+        .join(Product, Product.id == Inventory.product_id)
+        .outerjoin(Category, Category.id == Product.category_id)
+        .where(Inventory.store_id == store_id)
+        .group_by(Category.id, Category.name)
+        .order_by(Category.name)
+    )
+
+    valuation = {
+        "method": method,
+        "product_count": 0,
+        "total_quantity": 0,
+        "total_value": 0.0,
+        "low_stock_count": 0,
+        "out_of_stock_count": 0,
+        "unpriced_count": 0,
+        "categories": {},
+    }
+    for name, count, quantity, value, low_stock, out_of_stock, unpriced in db.session.execute(statement):
+        category = valuation["categories"].setdefault(
+            name or UNCATEGORIZED, {"count": 0, "quantity": 0, "value": 0.0}
+        )
+        category["count"] += count
+        category["quantity"] += quantity
+        category["value"] += value
+
+        valuation["product_count"] += count
+        valuation["total_quantity"] += quantity
+        valuation["total_value"] += value
+        valuation["low_stock_count"] += low_stock
+        valuation["out_of_stock_count"] += out_of_stock
+        valuation["unpriced_count"] += unpriced
+
+    return valuation
+
+
+def get_inventory_valuation(store_id: int, method: str = DEFAULT_VALUATION_METHOD) -> Dict:
+    """
+    Return a store's valuation, reusing the cached result while stock is unchanged.
+
+    The version is read before valuing, so a change that lands mid-computation
+    leaves the cache one version behind and the next call recomputes.
+
+    Args:
+        store_id: Store to value
+        method: One of ``VALUATION_METHODS``
+
+    Returns:
+        Valuation dictionary as returned by ``compute_inventory_valuation``,
+        plus the ``inventory_version`` it reflects
+    """
+    if method not in VALUATION_METHODS:
+        raise ValuationError(f"Unknown valuation method: {method}")
+
+    version = Store.get_inventory_version(store_id)
+    key = (store_id, method)
+
+    with _valuation_cache_lock:
+        cached = _valuation_cache.get(key)
+        if cached and cached[0] == version:
+            _valuation_cache_stats["hits"] += 1
+            return cached[1]
+        _valuation_cache_stats["misses"] += 1
+
+    valuation = compute_inventory_valuation(store_id, method)
+    valuation["inventory_version"] = version
+
+    with _valuation_cache_lock:
+        _valuation_cache[key] = (version, valuation)
+
+    return valuation
+
+
+def get_valuation_cache_stats() -> Dict:
+    """
+    Get statistics about the valuation cache.
+
+    Returns:
+        Dictionary with cache hits, misses and the number of cached valuations
+    """
+    with _valuation_cache_lock:
+        return {
+            "hits": _valuation_cache_stats["hits"],
+            "misses": _valuation_cache_stats["misses"],
+            "cached_valuations": len(_valuation_cache)
+        }